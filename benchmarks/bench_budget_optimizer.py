@@ -0,0 +1,52 @@
+"""Benchmark del optimizador de presupuesto sobre carteras sintticas
+
+Uso: python -m benchmarks.bench_budget_optimizer [--sizes 1000 10000 50000] [--days 28]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from src.core.budget_optimizer import ResponseCurves, optimize_portfolio
+
+def synthetic_portfolio(campaigns: int, days: int, seed: int = 42):
+    """Gasto y revenue diarios con curvas a * x ** b conocidas y ruido multiplicativo"""
+    rng = np.random.default_rng(seed)
+    base_spend = rng.lognormal(mean=4.0, sigma=1.0, size=campaigns)
+    true_b = rng.uniform(0.3, 0.9, size=campaigns)
+    true_a = rng.lognormal(mean=0.5, sigma=0.5, size=campaigns)
+    
+    spend = base_spend[:, None] * rng.lognormal(0.0, 0.3, size=(campaigns, days))
+    revenue = true_a[:, None] * np.power(spend, true_b[:, None]) * rng.lognormal(0.0, 0.1, size=(campaigns, days))
+    # Algunas campaas sin historial suficiente
+    spend[rng.random(campaigns) < 0.05, : days // 2] = 0.0
+    return [f"camp_{i}" for i in range(campaigns)], spend, revenue
+
+def run(sizes, days: int, repeat: int):
+    print(f"{'campaas':>10} {'ajuste ms':>10} {'reparto ms':>11} {'lift %':>8} {'cambiadas':>10}")
+    for size in sizes:
+        labels, spend, revenue = synthetic_portfolio(size, days)
+        
+        fit_times, optimize_times = [], []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            curves = ResponseCurves.fit(labels, spend, revenue)
+            fit_times.append(time.perf_counter() - started)
+            
+            started = time.perf_counter()
+            result = optimize_portfolio(curves)
+            optimize_times.append(time.perf_counter() - started)
+        
+        assert abs(result["budget"]["proposed"] - result["budget"]["current"]) < 0.01 * result["budget"]["current"]
+        print(
+            f"{size:>10} {min(fit_times) * 1000:>10.1f} {min(optimize_times) * 1000:>11.1f} "
+            f"{result['expected_daily_revenue']['lift_pct']:>8.2f} {result['campaigns_changed']:>10}"
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--days", type=int, default=28)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.sizes, args.days, args.repeat)
@@ -0,0 +1,135 @@
+"""Benchmark de consultas de historial antes y despus de las migraciones de conversation_history
+
+Crea dos esquemas en una base PostgreSQL de pruebas:
+- bench_before: esquema original (migracin 001: ndice slo por session_id, metadata JSON)
+- bench_after: todas las migraciones (ndice compuesto, JSONB con ndices, particionado mensual)
+los carga con las mismas N filas sintticas y mide las consultas del servicio.
+
+Uso: python -m benchmarks.bench_history_queries --database-url postgresql+asyncpg://... [--rows 10000000]
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.core.migrations import MigrationRunner
+
+# Filas repartidas en ~12 meses, 100 turnos por sesin de media
+LOAD_SQL = """
+INSERT INTO conversation_history (id, session_id, user_id, user_message, agent_response, agent_used, metadata, timestamp)
+SELECT
+    md5(i::text || '{schema}')::uuid,
+    'session_' || (i % {sessions}),
+    'user_' || (i % {users}),
+    'mensaje de usuario ' || i,
+    repeat('respuesta del agente ', 8),
+    (ARRAY['main_agent', 'campaign_agent', 'product_agent', 'analytics_agent'])[1 + i % 4],
+    json_build_object(
+        'latency_ms', i % 3000,
+        'tools_used', CASE WHEN i % 10 = 0 THEN json_build_array('kpi_summary') ELSE json_build_array() END,
+        'intent_analysis', json_build_object('sub_agent_type', (ARRAY['product', 'campaign', 'analytics'])[1 + i % 3])
+    ),
+    now() - (i % 31536000) * interval '1 second'
+FROM generate_series({start}, {end}) AS i
+"""
+
+QUERIES = {
+    "historial de sesin (ltimos 50)": """
+        SELECT * FROM conversation_history
+        WHERE session_id = 'session_{probe}'
+        ORDER BY timestamp DESC LIMIT 50
+    """,
+    "turnos con herramienta en 7 das": """
+        SELECT count(*) FROM conversation_history
+        WHERE (metadata::jsonb -> 'tools_used') @> '["kpi_summary"]'
+        AND timestamp >= now() - interval '7 days'
+    """,
+    "turnos por sub-agente en 1 da": """
+        SELECT count(*) FROM conversation_history
+        WHERE (metadata::jsonb -> 'intent_analysis' ->> 'sub_agent_type') = 'campaign'
+        AND timestamp >= now() - interval '1 day'
+    """,
+    "rango de un mes": """
+        SELECT agent_used, count(*) FROM conversation_history
+        WHERE timestamp >= date_trunc('month', now()) - interval '3 months'
+        AND timestamp < date_trunc('month', now()) - interval '2 months'
+        GROUP BY agent_used
+    """
+}
+
+async def prepare_schema(engine, schema: str, target: int, rows: int, batch: int):
+    """Crear el esquema, cargar las filas con el esquema original y migrar hasta `target`"""
+    async with engine.begin() as connection:
+        await connection.exec_driver_sql(f"DROP SCHEMA IF EXISTS {schema} CASCADE")
+        await connection.exec_driver_sql(f"CREATE SCHEMA {schema}")
+    
+    # Conexiones con search_path propio: las migraciones se aplican tal cual dentro del esquema
+    scoped = create_async_engine(engine.url, connect_args={"server_settings": {"search_path": schema}})
+    try:
+        # Esquema original, carga y despus el resto de migraciones (como en produccin)
+        await MigrationRunner(scoped).upgrade(target=1)
+        started = time.perf_counter()
+        for start in range(1, rows + 1, batch):
+            end = min(start + batch - 1, rows)
+            async with scoped.begin() as connection:
+                await connection.exec_driver_sql(LOAD_SQL.format(
+                    schema=schema, sessions=max(rows // 100, 1), users=max(rows // 1000, 1),
+                    start=start, end=end
+                ))
+        print(f" {schema}: {rows} filas cargadas en {time.perf_counter() - started:.0f}s")
+        
+        if target > 1:
+            started = time.perf_counter()
+            await MigrationRunner(scoped).upgrade(target=target)
+            print(f" {schema}: migraciones aplicadas en {time.perf_counter() - started:.0f}s")
+        
+        async with scoped.begin() as connection:
+            await connection.exec_driver_sql("ANALYZE conversation_history")
+    finally:
+        await scoped.dispose()
+
+async def measure(engine, schema: str, repeat: int, sessions: int):
+    """Mediana y mximo (ms) de cada consulta sobre el esquema indicado"""
+    scoped = create_async_engine(engine.url, connect_args={"server_settings": {"search_path": schema}})
+    results = {}
+    try:
+        async with scoped.connect() as connection:
+            for name, query in QUERIES.items():
+                timings = []
+                for attempt in range(repeat):
+                    sql = query.format(probe=(attempt * 7919) % sessions)
+                    started = time.perf_counter()
+                    await connection.exec_driver_sql(sql)
+                    timings.append((time.perf_counter() - started) * 1000)
+                results[name] = (statistics.median(timings), max(timings))
+    finally:
+        await scoped.dispose()
+    return results
+
+async def main(database_url: str, rows: int, batch: int, repeat: int):
+    engine = create_async_engine(database_url)
+    sessions = max(rows // 100, 1)
+    try:
+        await prepare_schema(engine, "bench_before", 1, rows, batch)
+        await prepare_schema(engine, "bench_after", 4, rows, batch)
+        
+        before = await measure(engine, "bench_before", repeat, sessions)
+        after = await measure(engine, "bench_after", repeat, sessions)
+    finally:
+        await engine.dispose()
+    
+    print(f"\n{'consulta':<36} {'antes p50 ms':>13} {'despus p50 ms':>15} {'mejora':>8}")
+    for name in QUERIES:
+        b, a = before[name][0], after[name][0]
+        print(f"{name:<36} {b:>13.1f} {a:>15.1f} {b / a if a else float('inf'):>7.1f}x")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", required=True, help="Base de datos de pruebas (se crean los esquemas bench_*)")
+    parser.add_argument("--rows", type=int, default=10_000_000)
+    parser.add_argument("--batch", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.database_url, args.rows, args.batch, args.repeat))
@@ -0,0 +1,139 @@
+"""Benchmark del backend local (src/core/ollama_chat.py) contra un servidor Ollama simulado
+
+El servidor simulado implementa /api/chat (respuesta completa y NDJSON en streaming) con
+un tiempo de carga del modelo, un tiempo por token y, como Ollama, un nmero mximo de
+peticiones en paralelo (OLLAMA_NUM_PARALLEL); las dems esperan en el servidor. Mide la
+carga del modelo en el calentamiento, el tiempo hasta el primer token en streaming frente
+a la respuesta completa y la latencia con peticiones concurrentes.
+
+Con --base-url se usa un servidor real en lugar del simulado.
+
+Uso: python -m benchmarks.bench_ollama_chat [--concurrency 16] [--parallel 4] [--tokens 40]
+"""
+import argparse
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from langchain_core.messages import HumanMessage
+
+from src.core.config import settings
+from src.core.ollama_chat import ChatOllamaLocal, get_ollama_server, close_ollama_servers
+
+def stand_in_server(parallel: int, tokens: int, token_ms: float, load_ms: float) -> ThreadingHTTPServer:
+    """Servidor HTTP local que imita /api/chat de Ollama"""
+    slots = threading.Semaphore(parallel)
+    loaded = threading.Event()
+    load_lock = threading.Lock()
+    
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        
+        def log_message(self, *args):
+            pass
+        
+        def _ensure_loaded(self):
+            with load_lock:
+                if not loaded.is_set():
+                    time.sleep(load_ms / 1000)
+                    loaded.set()
+        
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            with slots:
+                self._ensure_loaded()
+                if not body["messages"]:
+                    return self._send({"model": body["model"], "done": True})
+                prompt_tokens = sum(len(m["content"].split()) for m in body["messages"])
+                usage = {"model": body["model"], "done": True, "prompt_eval_count": prompt_tokens, "eval_count": tokens}
+                if not body.get("stream", True):
+                    time.sleep(tokens * token_ms / 1000)
+                    return self._send({**usage, "message": {"role": "assistant", "content": "palabra " * tokens}})
+                
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for _ in range(tokens):
+                    time.sleep(token_ms / 1000)
+                    self._chunk({"model": body["model"], "done": False, "message": {"role": "assistant", "content": "palabra "}})
+                self._chunk({**usage, "message": {"role": "assistant", "content": ""}})
+                self.wfile.write(b"0\r\n\r\n")
+        
+        def _send(self, payload):
+            data = json.dumps(payload).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        
+        def _chunk(self, payload):
+            line = json.dumps(payload).encode("utf-8") + b"\n"
+            self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+            self.wfile.flush()
+    
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * q), len(ordered) - 1)]
+
+async def run(base_url: str, model: str, concurrency: int):
+    llm = ChatOllamaLocal(model=model, base_url=base_url)
+    messages = [HumanMessage(content="Qu campaas tienen mejor ROAS este mes?")]
+    
+    started = time.perf_counter()
+    await get_ollama_server(base_url).warm_up(model)
+    warm_up = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    response = await llm.ainvoke(messages)
+    full = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    first_token = None
+    async for chunk in llm.astream(messages):
+        if first_token is None and chunk.content:
+            first_token = time.perf_counter() - started
+    streamed = time.perf_counter() - started
+    
+    async def timed():
+        started = time.perf_counter()
+        await llm.ainvoke(messages)
+        return time.perf_counter() - started
+    
+    started = time.perf_counter()
+    latencies = await asyncio.gather(*[timed() for _ in range(concurrency)])
+    total = time.perf_counter() - started
+    stats = get_ollama_server(base_url).get_stats()
+    
+    print(f"calentamiento (carga del modelo)      {warm_up * 1000:>8.0f} ms")
+    print(f"respuesta completa                    {full * 1000:>8.0f} ms  ({len(response.content.split())} tokens)")
+    print(f"streaming: primer token               {first_token * 1000:>8.0f} ms  (completo en {streamed * 1000:.0f} ms)")
+    print(f"{concurrency} concurrentes (mx. {stats['max_concurrency']} en curso): "
+          f"p50 {percentile(latencies, 0.5) * 1000:.0f} ms, p95 {percentile(latencies, 0.95) * 1000:.0f} ms, "
+          f"{concurrency / total:.1f} req/s; espera local p95 {stats['queue_time']['p95_ms']} ms")
+    await close_ollama_servers()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default=None, help="Servidor Ollama real (por defecto, el simulado)")
+    parser.add_argument("--model", default=settings.ollama_model)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--parallel", type=int, default=settings.ollama_max_concurrency, help="OLLAMA_NUM_PARALLEL simulado")
+    parser.add_argument("--tokens", type=int, default=40)
+    parser.add_argument("--token-ms", type=float, default=10.0)
+    parser.add_argument("--load-ms", type=float, default=1500.0)
+    args = parser.parse_args()
+    
+    base_url = args.base_url
+    if base_url is None:
+        server = stand_in_server(args.parallel, args.tokens, args.token_ms, args.load_ms)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    asyncio.run(run(base_url, args.model, args.concurrency))
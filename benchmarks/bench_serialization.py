@@ -0,0 +1,90 @@
+"""Benchmark de serializacin por turno de chat: json estndar frente al backend de src/core/serialization.py
+
+Un turno incluye la respuesta de /chat, los frames SSE de un stream (start, chunks, end),
+la lectura y escritura de la memoria de sesin y el turno cacheado en Redis, con las mismas
+funciones que usan main.py, stream_replay y MemoryManager.
+
+Uso: python -m benchmarks.bench_serialization [--turns 20000] [--chunks 40]
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+from src.core import serialization
+from src.core.serialization import dumps, dumps_str, encode_value, decode_value
+
+def synthetic_turn(chunks: int):
+    now = datetime.now().isoformat()
+    response = {
+        "session_id": "session_123",
+        "message_id": "3f1c2a9e-8d4b-4f6a-9b1e-2c7d5e8f0a11",
+        "content": "He revisado tus campaas activas y el ROAS medio de la ltima semana es 3,4. " * 6,
+        "agent_used": "campaign_agent",
+        "tools_used": ["kpi_summary", "period_over_period"],
+        "metadata": {"latency_ms": 1840, "token_usage": {"prompt_tokens": 812, "completion_tokens": 214, "total_tokens": 1026}},
+        "timestamp": now
+    }
+    events = [{"type": "start", "session_id": "session_123", "message_id": response["message_id"], "timestamp": now}]
+    events += [
+        {
+            "type": "chunk",
+            "session_id": "session_123",
+            "message_id": response["message_id"],
+            "content": f"fragmento {i} de la respuesta ",
+            "agent_used": "campaign_agent",
+            "metadata": {}
+        }
+        for i in range(chunks)
+    ]
+    events.append({"type": "end", "session_id": "session_123", "message_id": response["message_id"], "timestamp": now})
+    memory = {
+        "session_id": "session_123",
+        "user_id": "user_456",
+        "created_at": now,
+        "last_activity": now,
+        "context": {"platform": "web", "language": "es", "last_intent": {"sub_agent_type": "campaign", "confidence": 0.92}},
+        "preferences": {"currency": "EUR", "report_format": "summary"}
+    }
+    cached = {"user_message": "Cmo van mis campaas?", "agent_response": response["content"], "agent_used": "campaign_agent", "timestamp": now}
+    return response, events, memory, cached
+
+def stdlib_turn(response, events, memory, cached):
+    json.dumps(response)
+    for event in events:
+        f"data: {json.dumps(event)}\n\n"
+    json.loads(json.dumps(memory))
+    json.dumps(cached)
+
+def fast_turn(response, events, memory, cached):
+    dumps(response)
+    for event in events:
+        f"data: {dumps_str(event)}\n\n"
+    decode_value(encode_value(memory))
+    encode_value(cached)
+
+def measure(func, payload, turns: int) -> float:
+    started = time.perf_counter()
+    for _ in range(turns):
+        func(*payload)
+    return (time.perf_counter() - started) / turns * 1e6
+
+def run(turns: int, chunks: int, repeat: int):
+    payload = synthetic_turn(chunks)
+    # Mismo contenido con ambos backends (orden de claves y espacios aparte)
+    assert json.loads(dumps(payload[0])) == payload[0]
+    assert decode_value(encode_value(payload[3])) == payload[3]
+    
+    baseline = min(measure(stdlib_turn, payload, turns) for _ in range(repeat))
+    fast = min(measure(fast_turn, payload, turns) for _ in range(repeat))
+    print(f"backend: {serialization.BACKEND}  ({chunks} chunks por turno)")
+    print(f"{'json estndar':>16} {baseline:>9.1f} s/turno")
+    print(f"{serialization.BACKEND:>16} {fast:>9.1f} s/turno  ({baseline / fast:.1f}x)")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20000)
+    parser.add_argument("--chunks", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    run(args.turns, args.chunks, args.repeat)
@@ -1,17 +1,29 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Header, Request
+from fastapi.responses import Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import Optional, Dict, Any, AsyncGenerator
 import asyncio
-import json
+import hmac
 import uuid
-from datetime import datetime
+from datetime import date, datetime, timedelta
 
 # Importaciones locales
-from src.agents.main_agent import MainAgent
+from src.core.startup_profiler import startup_profiler
+MainAgent = startup_profiler.import_module("src.agents.main_agent").MainAgent
 from src.core.config import settings
-from src.models.schemas import ChatRequest, ChatResponse, StreamChatResponse
+from src.core.embedding_service import get_embedding_service
+from src.core.connection_pools import get_pool_stats
+from src.core.tool_executor import get_tool_stats
+from src.core.usage_rollups import usage_rollups
+from src.core.stream_replay import stream_replay
+from src.core.token_accounting import token_accounting, BudgetExceeded
+from src.core.shadow_traffic import shadow_traffic
+from src.core.structured_output import structured_output
+from src.core.request_scheduler import request_scheduler, SchedulerRejected
+from src.core.circuit_breaker import get_breaker_stats
+from src.core.serialization import dumps, negotiate_gzip
+from src.models.schemas import ChatRequest, ChatResponse, StreamChatResponse, PurgeRequest
 
 app = FastAPI(
     title="Agent VAM API",
@@ -34,12 +46,16 @@ main_agent = MainAgent()
 @app.on_event("startup")
 async def startup_event():
     """Inicializacin de la aplicacin"""
-    await main_agent.initialize()
+    with startup_profiler.measure("main_agent"):
+        await main_agent.initialize()
+    stream_replay.initialize(main_agent.memory_manager.redis_client)
+    startup_profiler.mark_ready()
     print(" Agent VAM API iniciada correctamente")
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Limpieza al cerrar la aplicacin"""
+    await stream_replay.cleanup()
     await main_agent.cleanup()
     print(" Agent VAM API cerrada")
 
@@ -66,10 +82,179 @@ async def health_check():
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Service unhealthy: {str(e)}")
 
-@app.post("/chat", response_model=ChatResponse)
+@app.get("/metrics/startup")
+async def get_startup_report():
+    """Informe de tiempos de importacin y arranque"""
+    return startup_profiler.report()
+
+@app.get("/metrics/semantic-memory")
+async def get_semantic_memory_stats():
+    """Latencia de recuperacin de la memoria semntica"""
+    semantic_memory = main_agent.memory_manager.semantic_memory
+    if not semantic_memory:
+        return {"enabled": False}
+    return {"enabled": True, **semantic_memory.get_stats()}
+
+@app.get("/metrics/pools")
+async def get_pool_metrics():
+    """Pools de PostgreSQL y Redis: conexiones abiertas, en uso, en espera y latencia de adquisicin"""
+    return get_pool_stats()
+
+@app.get("/metrics/session-store")
+async def get_session_store_stats():
+    """Aciertos por nivel (Redis / pendientes / PostgreSQL) y volcados de la memoria de sesin"""
+    return await main_agent.memory_manager.session_store.get_stats()
+
+@app.get("/metrics/session-cache")
+async def get_session_cache_stats():
+    """Cache de sesiones en proceso: tasa de aciertos, entradas y bytes, e invalidaciones entre workers"""
+    session_cache = main_agent.memory_manager.session_cache
+    if not session_cache:
+        return {"enabled": False}
+    return {"enabled": True, **session_cache.get_stats()}
+
+@app.get("/metrics/checkpoints")
+async def get_checkpoint_stats():
+    """Checkpoints del grafo: guardados, reanudaciones, nodos saltados y checkpoints descartados por tamao"""
+    if not main_agent.checkpointer:
+        return {"enabled": False}
+    return {"enabled": True, **main_agent.checkpointer.get_stats()}
+
+@app.get("/metrics/history-retention")
+async def get_history_retention_stats():
+    """Particiones de conversation_history y ltimo job de archivo"""
+    history_retention = main_agent.memory_manager.history_retention
+    if not history_retention:
+        return {"enabled": False}
+    return {"enabled": True, **await history_retention.get_stats()}
+
+@app.get("/metrics/history-export")
+async def get_history_export_stats():
+    """Exportaciones de historial: en curso, completadas, canceladas, filas y bytes enviados"""
+    return main_agent.memory_manager.history_export.get_stats()
+
+@app.get("/metrics/purge")
+async def get_purge_stats():
+    """Purgas de este worker: jobs encolados, en curso, completados, fallidos y tiempo de espera por el lmite de ritmo"""
+    return main_agent.memory_manager.session_purge.get_stats()
+
+@app.get("/metrics/tools")
+async def get_tool_metrics():
+    """Herramientas por agente: llamadas, ejecuciones reales, aciertos de cache, repeticiones idempotentes y latencia"""
+    return get_tool_stats()
+
+@app.get("/metrics/streams")
+async def get_stream_stats():
+    """Streams reanudables: generaciones en curso, reconexiones y eventos reenviados"""
+    return stream_replay.get_stats()
+
+@app.get("/metrics/scheduler")
+async def get_scheduler_stats():
+    """Scheduler de admisin: requests en curso, en cola por prioridad y usuario, y tiempo en cola"""
+    return request_scheduler.get_stats()
+
+@app.get("/metrics/ollama")
+async def get_ollama_metrics():
+    """Backend local: peticiones en curso y en espera por servidor, modelos cargados y latencia"""
+    if settings.default_llm_provider != "ollama":
+        return {"enabled": False}
+    from src.core.ollama_chat import get_ollama_stats
+    return {"enabled": True, "servers": get_ollama_stats()}
+
+@app.get("/metrics/structured-output")
+async def get_structured_output_stats():
+    """Decisiones estructuradas (intencin, herramientas): respuestas reparadas, cortes tempranos y tasa de fallos"""
+    return structured_output.get_stats()
+
+@app.get("/metrics/embeddings")
+async def get_embedding_stats():
+    """Estadsticas del servicio de embeddings (lotes, deduplicacin, cache)"""
+    return get_embedding_service().get_stats()
+
+@app.get("/analytics/usage")
+async def get_usage_analytics(
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    agent_used: Optional[str] = None,
+    user_id: Optional[str] = None,
+    group_by: str = "hour"
+):
+    """Uso del asistente (turnos, herramientas, latencia y tokens) desde los rollups horarios"""
+    end = end or datetime.now()
+    start = start or end - timedelta(days=1)
+    try:
+        usage = await usage_rollups.query_usage(start, end, agent_used, user_id, group_by)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": group_by,
+        "usage": usage,
+        "last_rollup": usage_rollups.last_run
+    }
+
+@app.get("/analytics/tokens")
+async def get_token_usage(
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    group_by: str = "user_id",
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    agent: Optional[str] = None
+):
+    """Tokens y coste por usuario, sesin, agente, nodo, modelo o da (hasta el ltimo volcado)"""
+    end = end or date.today()
+    start = start or end - timedelta(days=30)
+    try:
+        usage = await token_accounting.query_usage(start, end, group_by, user_id, session_id, agent)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return {
+        "start": start.isoformat(),
+        "end": end.isoformat(),
+        "group_by": group_by,
+        "usage": usage,
+        "accounting": token_accounting.get_stats()
+    }
+
+@app.get("/analytics/tokens/users/{user_id}")
+async def get_user_token_budget(user_id: str):
+    """Consumo del usuario en el periodo actual y estado de su presupuesto (tiempo real)"""
+    return await token_accounting.get_user_usage(user_id)
+
+@app.get("/analytics/shadow")
+async def get_shadow_report():
+    """Comparacin del modelo sombra con el real por agente y nodo: latencia, tokens y longitud de salida"""
+    return shadow_traffic.report()
+
+@app.delete("/analytics/shadow")
+async def reset_shadow_report():
+    """Reiniciar la comparacin (p.ej. al cambiar de modelo sombra)"""
+    shadow_traffic.reset()
+    return {"message": "Shadow comparison reset"}
+
+def request_priority(default: str, requested: Optional[str]) -> str:
+    """Prioridad en el scheduler: el cliente slo puede rebajarla a batch (X-Priority: batch)"""
+    return "batch" if (requested or "").lower() == "batch" else default
+
+def request_checkpoint_id(session_id: str, idempotency_key: Optional[str]) -> Optional[str]:
+    """Un reintento con la misma Idempotency-Key contina desde el ltimo nodo completado"""
+    return f"{session_id}:{idempotency_key}" if idempotency_key else None
+
+def request_context(request: ChatRequest, idempotency_key: Optional[str]) -> Dict[str, Any]:
+    """Contexto del request; la clave de idempotencia evita repetir herramientas que modifican datos"""
+    context = dict(request.context or {})
+    if idempotency_key:
+        context["idempotency_key"] = idempotency_key
+    return context
+
+@app.post("/chat", response_class=Response, responses={200: {"model": ChatResponse}})
 async def chat_sync(
     request: ChatRequest,
-    background_tasks: BackgroundTasks
+    background_tasks: BackgroundTasks,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    x_priority: Optional[str] = Header(None, alias="X-Priority")
 ):
     """Endpoint sncrono para chat - respuesta completa"""
     try:
@@ -80,8 +265,10 @@ async def chat_sync(
             message=request.message,
             session_id=session_id,
             user_id=request.user_id,
-            context=request.context,
-            stream=False
+            context=request_context(request, idempotency_key),
+            stream=False,
+            priority=request_priority("sync", x_priority),
+            checkpoint_id=request_checkpoint_id(session_id, idempotency_key)
         )
         
         # Guardar en historial en background
@@ -92,73 +279,34 @@ async def chat_sync(
             response["content"]
         )
         
-        return ChatResponse(
-            session_id=session_id,
-            message_id=str(uuid.uuid4()),
-            content=response["content"],
-            agent_used=response["agent_used"],
-            tools_used=response.get("tools_used", []),
-            metadata=response.get("metadata", {}),
-            timestamp=datetime.now().isoformat()
+        # Campos de ChatResponse codificados directamente, sin pasar por la validacin de Pydantic
+        return Response(
+            content=dumps({
+                "session_id": session_id,
+                "message_id": str(uuid.uuid4()),
+                "content": response["content"],
+                "agent_used": response["agent_used"],
+                "tools_used": response.get("tools_used", []),
+                "metadata": response.get("metadata", {}),
+                "timestamp": datetime.now().isoformat()
+            }),
+            media_type="application/json"
         )
         
+    except BudgetExceeded as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except SchedulerRejected as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing message: {str(e)}")
 
-@app.post("/chat/stream")
-async def chat_stream(request: ChatRequest):
-    """Endpoint de streaming para chat - respuesta en tiempo real"""
-    
-    async def generate_response() -> AsyncGenerator[str, None]:
-        try:
-            session_id = request.session_id or str(uuid.uuid4())
-            message_id = str(uuid.uuid4())
-            
-            # Enviar metadata inicial
-            initial_data = {
-                "type": "start",
-                "session_id": session_id,
-                "message_id": message_id,
-                "timestamp": datetime.now().isoformat()
-            }
-            yield f"data: {json.dumps(initial_data)}\n\n"
-            
-            # Procesar mensaje con streaming
-            async for chunk in main_agent.process_message_stream(
-                message=request.message,
-                session_id=session_id,
-                user_id=request.user_id,
-                context=request.context
-            ):
-                stream_data = {
-                    "type": "chunk",
-                    "session_id": session_id,
-                    "message_id": message_id,
-                    "content": chunk["content"],
-                    "agent_used": chunk.get("agent_used"),
-                    "metadata": chunk.get("metadata", {})
-                }
-                yield f"data: {json.dumps(stream_data)}\n\n"
-            
-            # Enviar seal de finalizacin
-            end_data = {
-                "type": "end",
-                "session_id": session_id,
-                "message_id": message_id,
-                "timestamp": datetime.now().isoformat()
-            }
-            yield f"data: {json.dumps(end_data)}\n\n"
-            
-        except Exception as e:
-            error_data = {
-                "type": "error",
-                "error": str(e),
-                "timestamp": datetime.now().isoformat()
-            }
-            yield f"data: {json.dumps(error_data)}\n\n"
-    
+def format_sse(seq: int, data: str) -> str:
+    """Evento SSE con id: el cliente lo reenva como Last-Event-ID al reconectar"""
+    return f"id: {seq}\ndata: {data}\n\n"
+
+def sse_response(events: AsyncGenerator[str, None]) -> StreamingResponse:
     return StreamingResponse(
-        generate_response(),
+        events,
         media_type="text/plain",
         headers={
             "Cache-Control": "no-cache",
@@ -167,19 +315,162 @@ async def chat_stream(request: ChatRequest):
         }
     )
 
-@app.get("/sessions/{session_id}/history")
-async def get_session_history(session_id: str, limit: int = 50):
-    """Obtener historial de conversacin"""
+async def generate_events(
+    request: ChatRequest,
+    session_id: str,
+    message_id: str,
+    context: Dict[str, Any],
+    priority: str = "stream",
+    checkpoint_id: Optional[str] = None
+) -> AsyncGenerator[Dict[str, Any], None]:
+    """Eventos de una respuesta (start, chunk..., end/error); se ejecuta en background"""
     try:
-        history = await main_agent.get_conversation_history(session_id, limit)
-        return {
+        # Enviar metadata inicial
+        yield {
+            "type": "start",
             "session_id": session_id,
-            "history": history,
-            "count": len(history)
+            "message_id": message_id,
+            "timestamp": datetime.now().isoformat()
+        }
+        
+        # Procesar mensaje con streaming
+        async for chunk in main_agent.process_message_stream(
+            message=request.message,
+            session_id=session_id,
+            user_id=request.user_id,
+            context=context,
+            priority=priority,
+            checkpoint_id=checkpoint_id
+        ):
+            yield {
+                "type": "chunk",
+                "session_id": session_id,
+                "message_id": message_id,
+                "content": chunk["content"],
+                "agent_used": chunk.get("agent_used"),
+                "metadata": chunk.get("metadata", {})
+            }
+        
+        # Enviar seal de finalizacin
+        yield {
+            "type": "end",
+            "session_id": session_id,
+            "message_id": message_id,
+            "timestamp": datetime.now().isoformat()
         }
+        
+    except Exception as e:
+        yield {
+            "type": "error",
+            "message_id": message_id,
+            "error": str(e),
+            "timestamp": datetime.now().isoformat()
+        }
+
+async def replay_events(message_id: str, last_event_id: int = 0) -> AsyncGenerator[str, None]:
+    async for seq, data in stream_replay.subscribe(message_id, last_event_id):
+        yield format_sse(seq, data)
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: ChatRequest,
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key"),
+    x_priority: Optional[str] = Header(None, alias="X-Priority")
+):
+    """Endpoint de streaming para chat - respuesta en tiempo real
+    
+    La generacin corre en background y sus eventos se guardan en Redis: si la conexin se
+    corta, el cliente puede reanudar con GET /chat/stream/{message_id} y Last-Event-ID.
+    """
+    # Con la cuota agotada se rechaza antes de abrir el stream
+    if await token_accounting.check_budget(request.user_id) == "reject":
+        raise HTTPException(status_code=429, detail=f"Cuota de tokens agotada para el usuario {request.user_id}")
+    
+    session_id = request.session_id or str(uuid.uuid4())
+    message_id = str(uuid.uuid4())
+    stream_replay.start(
+        message_id,
+        generate_events(
+            request,
+            session_id,
+            message_id,
+            request_context(request, idempotency_key),
+            request_priority("stream", x_priority),
+            request_checkpoint_id(session_id, idempotency_key)
+        )
+    )
+    return sse_response(replay_events(message_id))
+
+@app.get("/chat/stream/{message_id}")
+async def resume_chat_stream(
+    message_id: str,
+    last_event_id: Optional[str] = None,
+    last_event_id_header: Optional[str] = Header(None, alias="Last-Event-ID")
+):
+    """Reanudar un stream: reenva los eventos posteriores a Last-Event-ID y sigue la generacin"""
+    if not await stream_replay.exists(message_id):
+        raise HTTPException(status_code=404, detail=f"Stream {message_id} not found or expired")
+    
+    last_seen = stream_replay.parse_event_id(last_event_id_header or last_event_id)
+    return sse_response(replay_events(message_id, last_seen))
+
+@app.get("/sessions/{session_id}/history")
+async def get_session_history(session_id: str, request: Request, limit: int = 50):
+    """Obtener historial de conversacin (gzip si el cliente lo acepta y el payload es grande)"""
+    try:
+        history = await main_agent.get_conversation_history(session_id, limit)
+        body, headers = negotiate_gzip(
+            dumps({
+                "session_id": session_id,
+                "history": history,
+                "count": len(history)
+            }),
+            request.headers.get("accept-encoding")
+        )
+        return Response(content=body, media_type="application/json", headers=headers)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error retrieving history: {str(e)}")
 
+@app.get("/history/export")
+async def export_history(
+    request: Request,
+    user_id: Optional[str] = None,
+    session_id: Optional[str] = None,
+    agent_used: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    format: str = "ndjson",
+    x_admin_key: Optional[str] = Header(None, alias="X-Admin-Key")
+):
+    """Exportar historial en streaming (NDJSON, o gzip con format=ndjson.gz) sin lmite de filas"""
+    if format not in ("ndjson", "ndjson.gz"):
+        raise HTTPException(status_code=400, detail="format debe ser ndjson o ndjson.gz")
+    
+    # Sin user_id ni session_id se exportara el historial de todos los usuarios: slo administracin
+    if not user_id and not session_id:
+        if not settings.admin_api_key or not hmac.compare_digest(x_admin_key or "", settings.admin_api_key):
+            raise HTTPException(status_code=403, detail="Exportar sin user_id ni session_id requiere X-Admin-Key")
+    
+    # ndjson.gz descarga un archivo .gz; con ndjson, gzip transparente si el cliente lo acepta
+    download = format == "ndjson.gz"
+    compress = download or "gzip" in (request.headers.get("accept-encoding") or "").lower()
+    try:
+        chunks = await main_agent.memory_manager.history_export.export(
+            user_id, session_id, agent_used, start, end, compress=compress
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    filename = f"history-{datetime.now().strftime('%Y%m%d%H%M%S')}.{format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"', "Vary": "Accept-Encoding"}
+    if compress and not download:
+        headers["Content-Encoding"] = "gzip"
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if download else "application/x-ndjson",
+        headers=headers
+    )
+
 @app.delete("/sessions/{session_id}")
 async def clear_session(session_id: str):
     """Limpiar sesin y memoria"""
@@ -189,6 +480,32 @@ async def clear_session(session_id: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error clearing session: {str(e)}")
 
+@app.post("/purge/jobs", status_code=202)
+async def create_purge_job(request: PurgeRequest):
+    """Purgar en background las sesiones de un usuario, una lista de sesiones o las inactivas"""
+    try:
+        job = await main_agent.memory_manager.session_purge.submit(
+            request.user_id, request.session_ids, request.older_than_days, request.archive
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return job.to_dict()
+
+@app.get("/purge/jobs/{job_id}")
+async def get_purge_job(job_id: str):
+    """Estado y progreso de una purga"""
+    job = await main_agent.memory_manager.session_purge.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail=f"Purge job {job_id} not found")
+    return job
+
+@app.delete("/purge/jobs/{job_id}")
+async def cancel_purge_job(job_id: str):
+    """Cancelar una purga al terminar el lote en curso"""
+    if not await main_agent.memory_manager.session_purge.cancel(job_id):
+        raise HTTPException(status_code=404, detail=f"Purge job {job_id} not running on this worker")
+    return {"message": f"Purge job {job_id} cancelling"}
+
 @app.get("/agents/status")
 async def get_agents_status():
     """Estado de todos los sub-agentes"""
@@ -197,6 +514,7 @@ async def get_agents_status():
         return {
             "main_agent": "active",
             "sub_agents": status,
+            "llm_backends": get_breaker_stats("llm:"),
             "timestamp": datetime.now().isoformat()
         }
     except Exception as e:
@@ -0,0 +1,27 @@
+-- Esquema inicial de historial y memoria de sesiones (equivalente a los modelos originales)
+CREATE TABLE IF NOT EXISTS conversation_history (
+    id UUID PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL,
+    user_id VARCHAR(255),
+    user_message TEXT NOT NULL,
+    agent_response TEXT NOT NULL,
+    agent_used VARCHAR(100) NOT NULL,
+    metadata JSON,
+    timestamp TIMESTAMP NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_conversation_history_session_id ON conversation_history (session_id);
+CREATE INDEX IF NOT EXISTS ix_conversation_history_user_id ON conversation_history (user_id);
+
+CREATE TABLE IF NOT EXISTS session_memory (
+    id UUID PRIMARY KEY,
+    session_id VARCHAR(255) NOT NULL UNIQUE,
+    user_id VARCHAR(255),
+    context JSON,
+    preferences JSON,
+    created_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP,
+    expires_at TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS ix_session_memory_user_id ON session_memory (user_id);
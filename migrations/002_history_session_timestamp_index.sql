@@ -0,0 +1,8 @@
+-- migrate: no-transaction
+-- Índice compuesto para "últimos N turnos de la sesión": evita ordenar por timestamp en cada lectura.
+-- CONCURRENTLY no bloquea escrituras; por eso esta migración corre fuera de transacción.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conversation_history_session_timestamp
+    ON conversation_history (session_id, timestamp DESC);
+
+-- El índice de una sola columna queda cubierto por el prefijo del compuesto
+DROP INDEX CONCURRENTLY IF EXISTS ix_conversation_history_session_id;
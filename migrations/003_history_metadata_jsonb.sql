@@ -0,0 +1,17 @@
+-- metadata pasa de JSON (texto) a JSONB (binario, indexable) con índices para las consultas reales
+ALTER TABLE conversation_history
+    ALTER COLUMN metadata TYPE JSONB USING metadata::jsonb,
+    ALTER COLUMN metadata SET DEFAULT '{}'::jsonb;
+
+-- Turnos que usaron una herramienta: metadata -> 'tools_used' @> '["kpi_summary"]'
+CREATE INDEX IF NOT EXISTS ix_conversation_history_tools_used
+    ON conversation_history USING GIN ((metadata -> 'tools_used') jsonb_path_ops);
+
+-- Turnos por sub-agente elegido en el análisis de intención, en un rango de fechas
+CREATE INDEX IF NOT EXISTS ix_conversation_history_sub_agent_type
+    ON conversation_history (((metadata -> 'intent_analysis' ->> 'sub_agent_type')), timestamp);
+
+-- Turnos con error (índice parcial: sólo ocupa espacio para los fallidos)
+CREATE INDEX IF NOT EXISTS ix_conversation_history_errors
+    ON conversation_history (timestamp)
+    WHERE metadata ? 'error';
@@ -0,0 +1,120 @@
+-- migrate: no-transaction
+-- Particionado mensual por rango de timestamp.
+-- Las lecturas por sesión/rango sólo tocan las particiones relevantes y la retención pasa a ser
+-- DETACH + archivo + DROP de particiones completas en lugar de DELETE masivos.
+-- La clave primaria de una tabla particionada debe incluir la columna de partición: (id, timestamp).
+--
+-- La copia se hace por lotes, cada uno en su propia transacción, mientras la tabla original sigue
+-- recibiendo tráfico. Sólo el intercambio final (resto de filas nuevas + RENAME) bloquea las escrituras.
+
+-- Clave de recorrido de la copia por lotes
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_conversation_history_copy_key
+    ON conversation_history (timestamp, id);
+
+CREATE TABLE IF NOT EXISTS conversation_history_partitioned (
+    id UUID NOT NULL,
+    session_id VARCHAR(255) NOT NULL,
+    user_id VARCHAR(255),
+    user_message TEXT NOT NULL,
+    agent_response TEXT NOT NULL,
+    agent_used VARCHAR(100) NOT NULL,
+    metadata JSONB DEFAULT '{}'::jsonb,
+    timestamp TIMESTAMP NOT NULL,
+    PRIMARY KEY (id, timestamp)
+) PARTITION BY RANGE (timestamp);
+
+-- Una partición por mes desde el dato más antiguo hasta dos meses en el futuro
+DO $$
+DECLARE
+    month_start DATE := date_trunc('month', COALESCE((SELECT min(timestamp) FROM conversation_history), now()))::date;
+    last_month DATE := (date_trunc('month', now()) + interval '2 months')::date;
+BEGIN
+    WHILE month_start <= last_month LOOP
+        EXECUTE format(
+            'CREATE TABLE IF NOT EXISTS %I PARTITION OF conversation_history_partitioned FOR VALUES FROM (%L) TO (%L)',
+            'conversation_history_' || to_char(month_start, '"y"YYYY"m"MM'),
+            month_start,
+            (month_start + interval '1 month')::date
+        );
+        month_start := (month_start + interval '1 month')::date;
+    END LOOP;
+END
+$$;
+
+-- Red de seguridad para filas fuera de rango (el job de retención crea las particiones por adelantado)
+CREATE TABLE IF NOT EXISTS conversation_history_default PARTITION OF conversation_history_partitioned DEFAULT;
+
+-- Posición de la copia (timestamp, id): permite reanudar si la migración se interrumpe
+CREATE TABLE IF NOT EXISTS conversation_history_copy_progress (
+    last_timestamp TIMESTAMP NOT NULL,
+    last_id UUID NOT NULL
+);
+
+INSERT INTO conversation_history_copy_progress (last_timestamp, last_id)
+SELECT '-infinity'::timestamp, '00000000-0000-0000-0000-000000000000'::uuid
+WHERE NOT EXISTS (SELECT 1 FROM conversation_history_copy_progress);
+
+-- Lotes de 10000 filas en orden (timestamp, id); termina cuando un lote no encuentra filas
+-- migrate: repeat
+WITH batch AS (
+    SELECT h.id, h.session_id, h.user_id, h.user_message, h.agent_response, h.agent_used, h.metadata, h.timestamp
+    FROM conversation_history h, conversation_history_copy_progress p
+    WHERE (h.timestamp, h.id) > (p.last_timestamp, p.last_id)
+    ORDER BY h.timestamp, h.id
+    LIMIT 10000
+), copied AS (
+    INSERT INTO conversation_history_partitioned (id, session_id, user_id, user_message, agent_response, agent_used, metadata, timestamp)
+    SELECT id, session_id, user_id, user_message, agent_response, agent_used, metadata, timestamp FROM batch
+    ON CONFLICT DO NOTHING
+)
+UPDATE conversation_history_copy_progress
+SET (last_timestamp, last_id) = (
+    SELECT timestamp, id FROM batch ORDER BY timestamp DESC, id DESC LIMIT 1
+)
+WHERE EXISTS (SELECT 1 FROM batch);
+
+ALTER INDEX IF EXISTS ix_conversation_history_session_timestamp RENAME TO ix_conversation_history_unpartitioned_session_timestamp;
+ALTER INDEX IF EXISTS ix_conversation_history_user_id RENAME TO ix_conversation_history_unpartitioned_user_id;
+ALTER INDEX IF EXISTS ix_conversation_history_tools_used RENAME TO ix_conversation_history_unpartitioned_tools_used;
+ALTER INDEX IF EXISTS ix_conversation_history_sub_agent_type RENAME TO ix_conversation_history_unpartitioned_sub_agent_type;
+ALTER INDEX IF EXISTS ix_conversation_history_errors RENAME TO ix_conversation_history_unpartitioned_errors;
+
+-- Índices en la tabla padre: se crean (y heredan) en cada partición.
+-- La tabla nueva todavía no recibe tráfico, así que construirlos aquí no bloquea a nadie.
+CREATE INDEX IF NOT EXISTS ix_conversation_history_session_timestamp ON conversation_history_partitioned (session_id, timestamp DESC);
+CREATE INDEX IF NOT EXISTS ix_conversation_history_user_id ON conversation_history_partitioned (user_id);
+CREATE INDEX IF NOT EXISTS ix_conversation_history_tools_used
+    ON conversation_history_partitioned USING GIN ((metadata -> 'tools_used') jsonb_path_ops);
+CREATE INDEX IF NOT EXISTS ix_conversation_history_sub_agent_type
+    ON conversation_history_partitioned (((metadata -> 'intent_analysis' ->> 'sub_agent_type')), timestamp);
+CREATE INDEX IF NOT EXISTS ix_conversation_history_errors
+    ON conversation_history_partitioned (timestamp)
+    WHERE metadata ? 'error';
+
+-- Intercambio en una transacción corta: bloquea escrituras (no lecturas), copia las filas llegadas
+-- durante la copia por lotes y renombra. El margen de una hora recoge filas confirmadas tarde con
+-- timestamp anterior a la posición de la copia; ON CONFLICT descarta las ya copiadas.
+DO $$
+BEGIN
+    IF to_regclass('conversation_history_partitioned') IS NULL THEN
+        RETURN;
+    END IF;
+    
+    LOCK TABLE conversation_history IN EXCLUSIVE MODE;
+    
+    INSERT INTO conversation_history_partitioned (id, session_id, user_id, user_message, agent_response, agent_used, metadata, timestamp)
+    SELECT id, session_id, user_id, user_message, agent_response, agent_used, metadata, timestamp
+    FROM conversation_history
+    WHERE timestamp >= (SELECT last_timestamp FROM conversation_history_copy_progress) - interval '1 hour'
+    ON CONFLICT DO NOTHING;
+    
+    ALTER TABLE conversation_history RENAME TO conversation_history_unpartitioned;
+    ALTER TABLE conversation_history_partitioned RENAME TO conversation_history;
+END
+$$;
+
+DROP TABLE IF EXISTS conversation_history_unpartitioned;
+DROP TABLE IF EXISTS conversation_history_copy_progress;
+ALTER INDEX IF EXISTS conversation_history_partitioned_pkey RENAME TO conversation_history_pkey;
+
+ANALYZE conversation_history;
@@ -1,22 +1,248 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
+from datetime import date, datetime, timedelta
+import asyncio
+import json
+
+from langchain.tools import BaseTool
+
 from src.core.llm_factory import LLMFactory
+from src.core.analytics_engine import get_analytics_engine, KPI_DEFINITIONS, METRIC_COLUMNS
+from src.core.usage_rollups import usage_rollups
+from src.core.tool_executor import ToolExecutor, run_sync
+from src.core.token_accounting import token_accounting
+from src.core.structured_output import structured_output
+
+def _parse_period(engine, start: Optional[str], end: Optional[str], days: int = 30):
+    """Periodo solicitado o, por defecto, los ltimos das con datos"""
+    if start and end:
+        return date.fromisoformat(start), date.fromisoformat(end)
+    return engine.default_period(days)
+
+class KPISummaryTool(BaseTool):
+    """Herramienta para obtener totales y KPIs de un periodo"""
+    name = "kpi_summary"
+    description = "Totales y KPIs (CTR, CVR, CPC, CPA, ROAS) de un periodo, opcionalmente por campaas o canal"
+    engine: Any = None
+    
+    def _run(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        campaign_ids: Optional[List[str]] = None,
+        channel: Optional[str] = None
+    ) -> str:
+        period = _parse_period(self.engine, start, end)
+        return json.dumps(self.engine.summary(*period, campaign_ids=campaign_ids, channel=channel))
+    
+    async def _arun(self, **kwargs) -> str:
+        # Clculo CPU sobre arrays: fuera del event loop
+        return await asyncio.to_thread(self._run, **kwargs)
+
+class PeriodComparisonTool(BaseTool):
+    """Herramienta para comparar un periodo con el anterior"""
+    name = "period_comparison"
+    description = "Variacin de mtricas y KPIs frente al periodo anterior de la misma duracin"
+    engine: Any = None
+    
+    def _run(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        campaign_ids: Optional[List[str]] = None,
+        channel: Optional[str] = None
+    ) -> str:
+        period = _parse_period(self.engine, start, end)
+        return json.dumps(self.engine.period_over_period(*period, campaign_ids=campaign_ids, channel=channel))
+    
+    async def _arun(self, **kwargs) -> str:
+        return await asyncio.to_thread(self._run, **kwargs)
+
+class TopCampaignsTool(BaseTool):
+    """Herramienta para obtener el ranking de campaas o canales"""
+    name = "top_campaigns"
+    description = "Mejores o peores N campaas/canales segn una mtrica o KPI"
+    engine: Any = None
+    
+    def _run(
+        self,
+        metric: str = "roas",
+        n: int = 5,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        group_by: str = "campaign_id",
+        ascending: bool = False,
+        min_spend: float = 0.0
+    ) -> str:
+        if metric not in METRIC_COLUMNS and metric not in KPI_DEFINITIONS:
+            raise ValueError(f"Mtrica no soportada: {metric}")
+        period = _parse_period(self.engine, start, end)
+        ranking = self.engine.top_n(
+            metric=metric, n=int(n), start=period[0], end=period[1],
+            group_by=group_by, ascending=ascending, min_spend=float(min_spend)
+        )
+        return json.dumps({
+            "period": {"start": period[0].isoformat(), "end": period[1].isoformat()},
+            "metric": metric,
+            "ranking": ranking
+        })
+    
+    async def _arun(self, **kwargs) -> str:
+        return await asyncio.to_thread(self._run, **kwargs)
+
+class UsageStatsTool(BaseTool):
+    """Herramienta para consultar el uso del asistente desde los rollups horarios"""
+    name = "usage_stats"
+    description = "Turnos, uso de herramientas, latencia y tokens del asistente por hora, agente o usuario"
+    
+    def _run(self, **kwargs) -> str:
+        # La consulta usa el pool async de la aplicacin
+        return run_sync(self._arun(**kwargs))
+    
+    async def _arun(
+        self,
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        agent_used: Optional[str] = None,
+        user_id: Optional[str] = None,
+        group_by: str = "agent"
+    ) -> str:
+        if not usage_rollups.is_ready:
+            raise RuntimeError("Los rollups de uso no estn inicializados")
+        end_at = datetime.fromisoformat(end) if end else datetime.now()
+        start_at = datetime.fromisoformat(start) if start else end_at - timedelta(days=1)
+        usage = await usage_rollups.query_usage(start_at, end_at, agent_used, user_id, group_by)
+        return json.dumps({
+            "period": {"start": start_at.isoformat(), "end": end_at.isoformat()},
+            "group_by": group_by,
+            "usage": usage
+        })
 
 class AnalyticsAgent:
+    """Sub-agente de anlisis: los nmeros salen del motor vectorizado, el LLM slo los narra"""
+    
     def __init__(self):
         self.llm = None
+        self.tools = []
+        self.engine = None
+        self.tool_executor = None
         self.name = "analytics_agent"
         self.status = "inactive"
-        
+    
     async def initialize(self):
         self.llm = LLMFactory.create_llm()
+        
+        # Motor de KPIs de campaas (opcional: requiere ANALYTICS_DATA_PATH)
+        self.engine = await asyncio.to_thread(get_analytics_engine)
+        if self.engine:
+            self.tools = [
+                KPISummaryTool(engine=self.engine),
+                PeriodComparisonTool(engine=self.engine),
+                TopCampaignsTool(engine=self.engine)
+            ]
+        
+        # Uso del propio asistente (rollups de conversation_history)
+        self.tools.append(UsageStatsTool())
+        
+        # Todas las herramientas son de lectura: resultados cacheados por argumentos
+        self.tool_executor = ToolExecutor(self.name, read_only=[tool.name for tool in self.tools])
+        self.tool_executor.initialize()
+        
         self.status = "active"
         print(f" {self.name} inicializado")
-        
+    
     async def process_message(self, message: str, session_id: str, context: Optional[Dict] = None):
         system_prompt = "Eres un especialista en anlisis y reportes. Ayuda con mtricas, KPIs, insights y generacin de reportes."
-        response = await self.llm.ainvoke(f"{system_prompt}\n\nUsuario: {message}")
-        return {"content": response.content, "tools_used": [], "metadata": {"agent": self.name}}
         
+        tool_decision = await self._decide_tool_usage(message)
+        tool = next((t for t in self.tools if t.name == tool_decision.get("tool_name")), None)
+        
+        if not tool_decision.get("use_tool") or tool is None:
+            response = await self.llm.ainvoke(f"{system_prompt}\n\nUsuario: {message}")
+            return {"content": response.content, "tools_used": [], "metadata": {"agent": self.name}}
+        
+        try:
+            tool_result = await self.tool_executor.execute(tool, dict(tool_decision.get("tool_params") or {}))
+        except Exception as e:
+            return {
+                "status": "error",
+                "content": f"No pude calcular las mtricas solicitadas: {str(e)}",
+                "tools_used": [tool.name],
+                "metadata": {"agent": self.name, "error": str(e)}
+            }
+        
+        narration_prompt = f"""
+        {system_prompt}
+        
+        El usuario pregunt: "{message}"
+        
+        Resultados calculados con la herramienta "{tool.name}" (datos reales):
+        {tool_result}
+        
+        Explica estos resultados de forma breve. Usa exclusivamente estas cifras;
+        no inventes ni recalcules nmeros.
+        """
+        response = await self.llm.ainvoke(narration_prompt)
+        return {
+            "content": response.content,
+            "tools_used": [tool.name],
+            "metadata": {
+                "agent": self.name,
+                "tool_decision": tool_decision,
+                "processed_at": datetime.now().isoformat()
+            }
+        }
+    
+    async def _decide_tool_usage(self, message: str) -> Dict[str, Any]:
+        """Decidir qu herramienta de analtica usar y con qu parmetros"""
+        if self.engine:
+            first, last = self.engine.date_bounds()
+            campaign_tools = f"""
+        Datos de campaas disponibles del {first.isoformat()} al {last.isoformat()}.
+        - kpi_summary - params: start, end (YYYY-MM-DD), campaign_ids (lista), channel
+        - period_comparison - params: start, end, campaign_ids, channel
+        - top_campaigns - params: metric ({", ".join(METRIC_COLUMNS + list(KPI_DEFINITIONS))}), n, start, end, group_by ("campaign_id" o "channel"), ascending, min_spend
+        """
+        else:
+            campaign_tools = ""
+        
+        decision_prompt = f"""
+        Analiza el siguiente mensaje y determina si necesita calcular mtricas:
+        
+        Mensaje: "{message}"
+        
+        Herramientas disponibles:
+        {campaign_tools}
+        - usage_stats - uso del asistente; params: start, end (ISO), agent_used, user_id, group_by ("hour", "agent", "user" o "total")
+        
+        Omite los parmetros que el usuario no especifique.
+        
+        Responde en formato JSON:
+        {{
+            "use_tool": true/false,
+            "tool_name": "nombre_herramienta" o null,
+            "tool_params": {{}} o null
+        }}
+        """
+        
+        try:
+            with token_accounting.node("tool_decision"):
+                decision = await structured_output.ainvoke_json(
+                    self.llm, decision_prompt, "tool_decision:analytics", required=("use_tool",)
+                )
+            return decision or {"use_tool": False, "tool_name": None, "tool_params": None}
+        except:
+            return {"use_tool": False, "tool_name": None, "tool_params": None}
+    
     async def health_check(self): return True
-    async def get_status(self): return {"name": self.name, "status": self.status}
-    async def cleanup(self): self.status = "inactive"
+    async def get_status(self):
+        return {
+            "name": self.name,
+            "status": self.status,
+            "tools_available": [tool.name for tool in self.tools],
+            "tool_execution": self.tool_executor.get_stats() if self.tool_executor else None,
+            "data": self.engine.get_stats() if self.engine else None
+        }
+    async def cleanup(self):
+        if self.tool_executor:
+            await self.tool_executor.cleanup()
+        self.status = "inactive"
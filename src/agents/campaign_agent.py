@@ -1,38 +1,151 @@
 from typing import Dict, Any, List, Optional
-from datetime import datetime
+from datetime import date, datetime
+import asyncio
 import json
 
-from langchain.schema import BaseMessage, HumanMessage
+from langchain.schema import HumanMessage
 from langchain.tools import BaseTool
-from langchain_openai import ChatOpenAI
 
 from src.core.config import settings
 from src.core.llm_factory import LLMFactory
+from src.core.campaign_repository import CampaignRepository
+from src.core.analytics_engine import get_analytics_engine
+from src.core.budget_optimizer import ResponseCurves, optimize_portfolio
+from src.core.tool_executor import ToolExecutor, run_sync
+from src.core.token_accounting import token_accounting
+from src.core.structured_output import structured_output
+from src.core.circuit_breaker import CircuitOpenError
+
+# Inicio de los resultados de error de las herramientas de una sola campaa
+FAILURE_PREFIX = "No se pudo"
+
+def _bulk_failed(result: str) -> bool:
+    """Operacin masiva sin ningn xito: reintentarla no duplica nada"""
+    summary = json.loads(result)
+    return summary["total"] > 0 and summary["succeeded"] == 0
+
+def _summarize_results(results: List[Dict[str, Any]]) -> str:
+    """Resumen JSON de una operacin masiva con el resultado de cada elemento"""
+    succeeded = sum(1 for r in results if r["success"])
+    return json.dumps({
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "results": results
+    }, ensure_ascii=False)
 
 class CampaignCreationTool(BaseTool):
     """Herramienta para crear campaas"""
     name = "create_campaign"
     description = "Crear una nueva campaa publicitaria"
+    repository: Any = None
+    
+    def _run(self, campaign_data: Dict[str, Any], user_id: Optional[str] = None) -> str:
+        return run_sync(self._arun(campaign_data, user_id=user_id))
     
-    def _run(self, campaign_data: Dict[str, Any]) -> str:
-        # Simular creacin de campaa
-        campaign_id = f"camp_{datetime.now().strftime("%Y%m%d_%H%M%S")}"
-        return f"Campaa creada exitosamente con ID: {campaign_id}"
+    async def _arun(self, campaign_data: Dict[str, Any], user_id: Optional[str] = None) -> str:
+        result = (await self.repository.create_many([campaign_data], user_id=user_id))[0]
+        if not result["success"]:
+            return f"{FAILURE_PREFIX} crear la campaa: {result['error']}"
+        return f"Campaa creada exitosamente con ID: {result['campaign']['id']}"
     
-    async def _arun(self, campaign_data: Dict[str, Any]) -> str:
-        return self._run(campaign_data)
+    def is_failure(self, result: str) -> bool:
+        return result.startswith(FAILURE_PREFIX)
 
 class CampaignOptimizationTool(BaseTool):
     """Herramienta para optimizar campaas"""
     name = "optimize_campaign"
     description = "Optimizar una campaa existente"
+    repository: Any = None
+    
+    def _run(self, campaign_id: str, optimization_params: Dict[str, Any], user_id: Optional[str] = None) -> str:
+        return run_sync(self._arun(campaign_id, optimization_params, user_id=user_id))
+    
+    async def _arun(self, campaign_id: str, optimization_params: Dict[str, Any], user_id: Optional[str] = None) -> str:
+        result = (await self.repository.update_many(
+            [{**(optimization_params or {}), "id": campaign_id}], user_id=user_id
+        ))[0]
+        if not result["success"]:
+            return f"{FAILURE_PREFIX} optimizar la campaa {campaign_id}: {result['error']}"
+        return f"Campaa {campaign_id} actualizada: {json.dumps(result['campaign'], ensure_ascii=False)}"
+    
+    def is_failure(self, result: str) -> bool:
+        return result.startswith(FAILURE_PREFIX)
+
+class BulkCampaignCreationTool(BaseTool):
+    """Herramienta para crear muchas campaas en una sola transaccin"""
+    name = "create_campaigns_bulk"
+    description = "Crear varias campaas a la vez (un nico INSERT); devuelve el resultado de cada una"
+    repository: Any = None
+    
+    def _run(self, campaigns: List[Dict[str, Any]], user_id: Optional[str] = None) -> str:
+        return run_sync(self._arun(campaigns, user_id=user_id))
+    
+    async def _arun(self, campaigns: List[Dict[str, Any]], user_id: Optional[str] = None) -> str:
+        return _summarize_results(await self.repository.create_many(campaigns, user_id=user_id))
+    
+    def is_failure(self, result: str) -> bool:
+        # Con xitos parciales el registro se conserva: repetirla volvera a crear las que s se crearon
+        return _bulk_failed(result)
+
+class BulkCampaignOptimizationTool(BaseTool):
+    """Herramienta para actualizar muchas campaas en una sola transaccin"""
+    name = "optimize_campaigns_bulk"
+    description = "Actualizar presupuesto, puja, estado o segmentacin de varias campaas a la vez"
+    repository: Any = None
+    
+    def _run(self, updates: List[Dict[str, Any]], user_id: Optional[str] = None) -> str:
+        return run_sync(self._arun(updates, user_id=user_id))
+    
+    async def _arun(self, updates: List[Dict[str, Any]], user_id: Optional[str] = None) -> str:
+        return _summarize_results(await self.repository.update_many(updates, user_id=user_id))
     
-    def _run(self, campaign_id: str, optimization_params: Dict[str, Any]) -> str:
-        # Simular optimizacin
-        return f"Campaa {campaign_id} optimizada con mejoras en CTR del 15%"
+    def is_failure(self, result: str) -> bool:
+        return _bulk_failed(result)
+
+class BudgetAllocationTool(BaseTool):
+    """Herramienta para redistribuir presupuesto entre campaas segn su rendimiento histrico"""
+    name = "optimize_budget_allocation"
+    description = "Reasignar presupuestos diarios igualando el ROAS marginal de la cartera; devuelve el diff propuesto"
+    engine: Any = None
+    repository: Any = None
+    
+    def _run(self, **kwargs) -> str:
+        return run_sync(self._arun(**kwargs))
     
-    async def _arun(self, campaign_id: str, optimization_params: Dict[str, Any]) -> str:
-        return self._run(campaign_id, optimization_params)
+    async def _arun(self, user_id: Optional[str] = None, **kwargs) -> str:
+        # Slo la cartera del usuario, nunca la de todos los datos cargados
+        campaign_ids = await self.repository.owned_ids(user_id)
+        if not campaign_ids:
+            return json.dumps({"campaigns": 0, "changes": [], "error": "El usuario no tiene campaas"}, ensure_ascii=False)
+        # Ajuste y biseccin sobre arrays: fuera del event loop
+        return await asyncio.to_thread(self._optimize, campaign_ids, **kwargs)
+    
+    def _optimize(
+        self,
+        campaign_ids: List[str],
+        start: Optional[str] = None,
+        end: Optional[str] = None,
+        total_budget: Optional[float] = None,
+        max_change: Optional[float] = None,
+        channel: Optional[str] = None,
+        top: int = 20
+    ) -> str:
+        if start and end:
+            period = date.fromisoformat(start), date.fromisoformat(end)
+        else:
+            period = self.engine.default_period(settings.budget_history_days)
+        curves = ResponseCurves.from_engine(self.engine, *period, channel=channel, campaign_ids=campaign_ids)
+        result = optimize_portfolio(
+            curves,
+            total_budget=float(total_budget) if total_budget is not None else None,
+            max_change=float(max_change) if max_change is not None else None,
+            top=int(top)
+        )
+        return json.dumps({
+            "history": {"start": period[0].isoformat(), "end": period[1].isoformat()},
+            **result
+        }, ensure_ascii=False)
 
 class CampaignAgent:
     """Sub-agente especializado en gestin de campaas"""
@@ -40,23 +153,41 @@ class CampaignAgent:
     def __init__(self):
         self.llm = None
         self.tools = []
+        self.repository = None
+        self.tool_executor = None
         self.name = "campaign_agent"
         self.status = "inactive"
         
     async def initialize(self):
         """Inicializar el agente de campaas"""
         try:
-            self.llm = LLMFactory.create_llm(
-                provider=settings.default_llm_provider,
-                model=settings.default_model
-            )
+            self.llm = LLMFactory.create_llm()
+            
+            # Repositorio de campaas compartido por todas las herramientas
+            self.repository = CampaignRepository()
+            await self.repository.initialize()
             
             # Inicializar herramientas
             self.tools = [
-                CampaignCreationTool(),
-                CampaignOptimizationTool()
+                CampaignCreationTool(repository=self.repository),
+                CampaignOptimizationTool(repository=self.repository),
+                BulkCampaignCreationTool(repository=self.repository),
+                BulkCampaignOptimizationTool(repository=self.repository)
             ]
             
+            # Optimizador de presupuesto (requiere datos de rendimiento en ANALYTICS_DATA_PATH)
+            engine = await asyncio.to_thread(get_analytics_engine)
+            if engine:
+                self.tools.append(BudgetAllocationTool(engine=engine, repository=self.repository))
+            
+            # Cache de resultados de lectura e idempotencia de las herramientas que crean o modifican
+            self.tool_executor = ToolExecutor(
+                self.name,
+                read_only=["optimize_budget_allocation"],
+                mutating=["create_campaign", "optimize_campaign", "create_campaigns_bulk", "optimize_campaigns_bulk"]
+            )
+            self.tool_executor.initialize()
+            
             self.status = "active"
             print(f" {self.name} inicializado correctamente")
             
@@ -73,7 +204,12 @@ class CampaignAgent:
     ) -> Dict[str, Any]:
         """Procesar mensaje relacionado con campaas"""
         
-        system_prompt = """
+        # El optimizador slo se anuncia si hay datos de rendimiento cargados
+        budget_tool = (
+            "\n        - optimize_budget_allocation: Para redistribuir presupuesto entre campaas con datos reales"
+            if self._has_tool("optimize_budget_allocation") else ""
+        )
+        system_prompt = f"""
         Eres un especialista en gestin de campaas publicitarias. Tu rol es:
         
         1. Ayudar a crear nuevas campaas publicitarias
@@ -84,6 +220,8 @@ class CampaignAgent:
         Herramientas disponibles:
         - create_campaign: Para crear nuevas campaas
         - optimize_campaign: Para optimizar campaas existentes
+        - create_campaigns_bulk: Para crear muchas campaas en una sola operacin
+        - optimize_campaigns_bulk: Para actualizar muchas campaas en una sola operacin{budget_tool}
         
         Siempre proporciona respuestas detalladas y accionables.
         Si necesitas informacin adicional, pregunta especficamente qu necesitas.
@@ -99,11 +237,15 @@ class CampaignAgent:
             if tool_decision["use_tool"]:
                 # Usar herramienta especfica
                 tool_name = tool_decision["tool_name"]
-                tool_params = tool_decision["tool_params"]
+                tool_params = dict(tool_decision.get("tool_params") or {})
+                # El propietario de las campaas sale del contexto, nunca del LLM
+                tool_params["user_id"] = (context or {}).get("user_id")
                 
                 tool = next((t for t in self.tools if t.name == tool_name), None)
                 if tool:
-                    tool_result = await tool._arun(**tool_params)
+                    tool_result = await self.tool_executor.execute(
+                        tool, tool_params, idempotency_key=(context or {}).get("idempotency_key")
+                    )
                     tools_used.append(tool_name)
                     
                     # Generar respuesta basada en el resultado de la herramienta
@@ -132,24 +274,40 @@ class CampaignAgent:
                 }
             }
             
+        except CircuitOpenError:
+            # El circuito del LLM est abierto: que el agente principal responda con su respaldo
+            raise
         except Exception as e:
             return {
+                "status": "error",
                 "content": f"Error procesando solicitud de campaa: {str(e)}",
                 "tools_used": [],
                 "metadata": {"error": str(e)}
             }
     
+    def _has_tool(self, name: str) -> bool:
+        return any(tool.name == name for tool in self.tools)
+    
     async def _decide_tool_usage(self, message: str) -> Dict[str, Any]:
         """Decidir si usar herramientas y cules"""
         
+        budget_tool = (
+            "\n        5. optimize_budget_allocation - Para redistribuir presupuesto entre campaas segn su rendimiento; "
+            "params: start, end (YYYY-MM-DD), total_budget (diario), max_change (fraccin, p.ej. 0.3), channel, top"
+            if self._has_tool("optimize_budget_allocation") else ""
+        )
         decision_prompt = f"""
         Analiza el siguiente mensaje y determina si necesita usar alguna herramienta:
         
         Mensaje: "{message}"
         
         Herramientas disponibles:
-        1. create_campaign - Para crear nuevas campaas
-        2. optimize_campaign - Para optimizar campaas existentes
+        1. create_campaign - Para crear una campaa; params: campaign_data (name, objective, channel, budget, bid, targeting, start_date, end_date)
+        2. optimize_campaign - Para ajustar una campaa; params: campaign_id, optimization_params (budget, bid, status, targeting, end_date)
+        3. create_campaigns_bulk - Para crear varias campaas; params: campaigns (lista de campaign_data)
+        4. optimize_campaigns_bulk - Para ajustar varias campaas; params: updates (lista de objetos con id y los campos a cambiar){budget_tool}
+        
+        Usa las herramientas masivas siempre que el usuario mencione ms de una campaa.
         
         Responde en formato JSON:
         {{
@@ -161,8 +319,17 @@ class CampaignAgent:
         """
         
         try:
-            response = await self.llm.ainvoke(decision_prompt)
-            decision = json.loads(response.content)
+            with token_accounting.node("tool_decision"):
+                # La explicacin va al final: no hace falta esperarla para decidir
+                decision = await structured_output.astream_json(
+                    self.llm,
+                    decision_prompt,
+                    "tool_decision:campaign",
+                    required=("use_tool",),
+                    ready=("use_tool", "tool_name", "tool_params")
+                )
+            if decision is None:
+                return {"use_tool": False, "tool_name": None, "tool_params": None}
             return decision
         except:
             return {"use_tool": False, "tool_name": None, "tool_params": None}
@@ -183,6 +350,7 @@ class CampaignAgent:
         
         Genera una respuesta natural y til para el usuario basada en este resultado.
         Explica qu se hizo y proporciona prximos pasos si es relevante.
+        Usa exclusivamente las cifras del resultado; no inventes mejoras ni porcentajes.
         """
         
         response = await self.llm.ainvoke(response_prompt)
@@ -202,10 +370,16 @@ class CampaignAgent:
             "name": self.name,
             "status": self.status,
             "tools_available": [tool.name for tool in self.tools],
+            "tool_execution": self.tool_executor.get_stats() if self.tool_executor else None,
+            "campaign_store": self.repository.database_url.split("://")[0] if self.repository else None,
             "last_health_check": datetime.now().isoformat()
         }
     
     async def cleanup(self):
         """Limpieza del agente"""
+        if self.repository:
+            await self.repository.cleanup()
+        if self.tool_executor:
+            await self.tool_executor.cleanup()
         self.status = "inactive"
         print(f" {self.name} limpiado")
@@ -1,25 +1,56 @@
 from typing import Dict, Any, List, Optional, AsyncGenerator
 import asyncio
-import json
+import contextvars
+import hashlib
+import time
 from datetime import datetime, timedelta
 import uuid
 
 from langchain.schema import BaseMessage, HumanMessage, AIMessage
-from langchain.memory import ConversationBufferWindowMemory
-from langchain_openai import ChatOpenAI
-from langchain_community.llms import Ollama
 from langgraph.graph import StateGraph, END
 from langgraph.graph.message import add_messages
 from typing_extensions import Annotated, TypedDict
 
 from src.core.config import settings
-from src.agents.product_agent import ProductAgent
-from src.agents.campaign_agent import CampaignAgent
-from src.agents.account_agent import AccountAgent
-from src.agents.platform_agent import PlatformAgent
-from src.agents.analytics_agent import AnalyticsAgent
 from src.core.memory_manager import MemoryManager
 from src.core.llm_factory import LLMFactory
+from src.core.embedding_service import cleanup_embedding_service
+from src.core.startup_profiler import startup_profiler
+from src.core.token_accounting import token_accounting
+from src.core.structured_output import structured_output
+from src.core.shadow_traffic import shadow_traffic
+from src.core.request_scheduler import request_scheduler
+from src.core.circuit_breaker import CircuitOpenError, get_breaker, get_breaker_stats
+from src.core.checkpointer import Checkpoint, create_checkpointer
+
+# Registro de sub-agentes: (mdulo, clase). El mdulo se importa y el agente
+# se inicializa la primera vez que el router lo necesita
+SUB_AGENT_REGISTRY = {
+    "product": ("src.agents.product_agent", "ProductAgent"),
+    "campaign": ("src.agents.campaign_agent", "CampaignAgent"),
+    "account": ("src.agents.account_agent", "AccountAgent"),
+    "platform": ("src.agents.platform_agent", "PlatformAgent"),
+    "analytics": ("src.agents.analytics_agent", "AnalyticsAgent")
+}
+
+# Ttulos de cada parte cuando una respuesta combina varios sub-agentes
+SUB_AGENT_LABELS = {
+    "product": "Productos",
+    "campaign": "Campaas",
+    "account": "Cuenta",
+    "platform": "Plataforma",
+    "analytics": "Analtica"
+}
+
+# Cola del stream en curso: las partes de una respuesta multi-agente se envan segn terminan
+_stream_parts: contextvars.ContextVar[Optional[asyncio.Queue]] = contextvars.ContextVar("stream_parts", default=None)
+
+# Checkpoint del request en curso: los nodos ya completados en un intento anterior no se repiten
+_checkpoint: contextvars.ContextVar[Optional[Checkpoint]] = contextvars.ContextVar("checkpoint", default=None)
+
+class SubAgentError(Exception):
+    """Un sub-agente respondi por su camino de error: cuenta como fallo en su circuito"""
+    pass
 
 class AgentState(TypedDict):
     """Estado compartido entre agentes"""
@@ -34,6 +65,8 @@ class AgentState(TypedDict):
     metadata: Dict[str, Any]
     requires_sub_agent: bool
     sub_agent_type: Optional[str]
+    sub_agent_types: List[str]
+    sub_agent_responses: Dict[str, Dict[str, Any]]
 
 class MainAgent:
     """Agente principal que coordina todos los sub-agentes"""
@@ -41,38 +74,35 @@ class MainAgent:
     def __init__(self):
         self.llm = None
         self.memory_manager = None
-        self.sub_agents = {}
+        self.sub_agents = {}  # Sub-agentes ya inicializados
         self.graph = None
-        self.sessions = {}  # Cache de sesiones activas
+        self.sessions = None  # Cache de sesiones activas (SessionCache del MemoryManager)
+        self.checkpointer = None
+        self._sub_agent_locks = {}
+        self._prewarm_task = None
+        self._warmup_task = None
         
     async def initialize(self):
-        """Inicializar el agente principal y todos los sub-agentes"""
+        """Inicializar el agente principal (los sub-agentes se inicializan bajo demanda)"""
         try:
             # Inicializar LLM
-            self.llm = LLMFactory.create_llm(
-                provider=settings.default_llm_provider,
-                model=settings.default_model
-            )
+            with startup_profiler.measure("main_llm"):
+                self.llm = LLMFactory.create_llm()
             
             # Inicializar gestor de memoria
-            self.memory_manager = MemoryManager()
-            await self.memory_manager.initialize()
+            with startup_profiler.measure("memory_manager"):
+                self.memory_manager = MemoryManager()
+                await self.memory_manager.initialize()
+                self.sessions = self.memory_manager.session_cache
+                self.checkpointer = create_checkpointer(self.memory_manager.redis_values)
             
-            # Inicializar sub-agentes
-            self.sub_agents = {
-                "product": ProductAgent(),
-                "campaign": CampaignAgent(),
-                "account": AccountAgent(),
-                "platform": PlatformAgent(),
-                "analytics": AnalyticsAgent()
-            }
-            
-            # Inicializar cada sub-agente
-            for agent in self.sub_agents.values():
-                await agent.initialize()
+            # Pre-calentar sub-agentes en background sin bloquear el arranque
+            if settings.prewarm_sub_agents:
+                self._prewarm_task = asyncio.create_task(self._prewarm_sub_agents())
             
-            # Crear el grafo de decisiones
-            self._create_decision_graph()
+            # Cargar el modelo local antes de la primera request
+            if settings.default_llm_provider == "ollama" and settings.ollama_warmup_on_startup:
+                self._warmup_task = asyncio.create_task(self._warm_up_local_model())
             
             print(" Agente principal inicializado correctamente")
             
@@ -80,16 +110,62 @@ class MainAgent:
             print(f" Error inicializando agente principal: {e}")
             raise
     
+    async def _get_sub_agent(self, agent_type: str):
+        """Obtener un sub-agente, importndolo e inicializndolo en el primer uso"""
+        agent = self.sub_agents.get(agent_type)
+        if agent is not None:
+            return agent
+        
+        lock = self._sub_agent_locks.setdefault(agent_type, asyncio.Lock())
+        async with lock:
+            if agent_type not in self.sub_agents:
+                module_name, class_name = SUB_AGENT_REGISTRY[agent_type]
+                with startup_profiler.measure(f"sub_agent:{agent_type}"):
+                    module = startup_profiler.import_module(module_name)
+                    agent = getattr(module, class_name)()
+                    await agent.initialize()
+                self.sub_agents[agent_type] = agent
+        
+        return self.sub_agents[agent_type]
+    
+    async def _prewarm_sub_agents(self):
+        """Inicializar todos los sub-agentes en background"""
+        for agent_type in SUB_AGENT_REGISTRY:
+            try:
+                await self._get_sub_agent(agent_type)
+            except Exception as e:
+                print(f" Error pre-calentando sub-agente {agent_type}: {e}")
+    
+    async def _warm_up_local_model(self):
+        # Como los SDKs de los proveedores, el backend local se importa slo si se usa
+        from src.core.ollama_chat import get_ollama_server
+        try:
+            await get_ollama_server().warm_up(settings.ollama_model)
+        except Exception as e:
+            print(f" Error cargando el modelo local {settings.ollama_model}: {e}")
+    
+    def _get_graph(self):
+        """Obtener el grafo de decisiones, compilndolo en la primera request"""
+        if self.graph is None:
+            with startup_profiler.measure("decision_graph"):
+                self._create_decision_graph()
+        return self.graph
+    
     def _create_decision_graph(self):
         """Crear el grafo de decisiones con LangGraph"""
         workflow = StateGraph(AgentState)
         
-        # Nodos del grafo
-        workflow.add_node("analyze_intent", self._analyze_intent)
-        workflow.add_node("route_to_agent", self._route_to_agent)
-        workflow.add_node("process_with_main", self._process_with_main)
-        workflow.add_node("process_with_sub", self._process_with_sub_agent)
-        workflow.add_node("finalize_response", self._finalize_response)
+        # Nodos del grafo (con checkpoint tras cada uno)
+        nodes = {
+            "analyze_intent": self._analyze_intent,
+            "route_to_agent": self._route_to_agent,
+            "process_with_main": self._process_with_main,
+            "process_with_sub": self._process_with_sub_agent,
+            "merge_responses": self._merge_responses,
+            "finalize_response": self._finalize_response
+        }
+        for name, node in nodes.items():
+            workflow.add_node(name, self._checkpointed(name, node))
         
         # Definir el flujo
         workflow.set_entry_point("analyze_intent")
@@ -105,20 +181,59 @@ class MainAgent:
         
         workflow.add_edge("route_to_agent", "process_with_sub")
         workflow.add_edge("process_with_main", "finalize_response")
-        workflow.add_edge("process_with_sub", "finalize_response")
+        workflow.add_edge("process_with_sub", "merge_responses")
+        workflow.add_edge("merge_responses", "finalize_response")
         workflow.add_edge("finalize_response", END)
         
         self.graph = workflow.compile()
     
+    @staticmethod
+    def _state_ok(state: AgentState) -> bool:
+        """Sin nodos degradados: ni error del anlisis o del agente principal ni sub-agentes con respaldo"""
+        if "error" in state["metadata"] or "intent_error" in state["metadata"]:
+            return False
+        return all(response["status"] == "ok" for response in state["sub_agent_responses"].values())
+    
+    def _checkpointed(self, name: str, node):
+        """Envolver un nodo: se salta si el checkpoint ya lo incluye y, si no, se guarda al terminar
+        
+        Un nodo degradado (los nodos no lanzan: registran el error en el estado) no se guarda,
+        ni tampoco los siguientes, porque el estado lo arrastra: el reintento lo vuelve a ejecutar.
+        """
+        async def run(state: AgentState) -> AgentState:
+            checkpoint = _checkpoint.get()
+            if checkpoint is None:
+                return await node(state)
+            if checkpoint.is_completed(name):
+                self.checkpointer.stats["nodes_skipped"] += 1
+                return checkpoint.restore(state)
+            state = await node(state)
+            if self._state_ok(state):
+                checkpoint.advance(name, state)
+                await self.checkpointer.save(checkpoint)
+            return state
+        return run
+    
+    async def _load_checkpoint(self, checkpoint_id: Optional[str]) -> Optional[Checkpoint]:
+        if not checkpoint_id or self.checkpointer is None:
+            return None
+        return await self.checkpointer.load(checkpoint_id)
+    
     async def process_message(
         self,
         message: str,
         session_id: str,
         user_id: Optional[str] = None,
         context: Optional[Dict[str, Any]] = None,
-        stream: bool = False
+        stream: bool = False,
+        priority: str = "sync",
+        checkpoint_id: Optional[str] = None
     ) -> Dict[str, Any]:
-        """Procesar mensaje del usuario (modo sncrono)"""
+        """Procesar mensaje del usuario (modo sncrono)
+        
+        Con `checkpoint_id` (p.ej. derivado de Idempotency-Key), el estado se guarda tras cada
+        nodo y un reintento con el mismo id contina desde el ltimo nodo completado.
+        """
         
         # Preparar estado inicial
         initial_state = AgentState(
@@ -130,13 +245,22 @@ class MainAgent:
             current_agent="main",
             agent_response="",
             tools_used=[],
-            metadata={},
+            metadata={"received_at": datetime.now().isoformat()},
             requires_sub_agent=False,
-            sub_agent_type=None
+            sub_agent_type=None,
+            sub_agent_types=[],
+            sub_agent_responses={}
         )
         
-        # Ejecutar el grafo
-        final_state = await self.graph.ainvoke(initial_state)
+        # Ejecutar el grafo; las llamadas al LLM se atribuyen a este request
+        checkpoint_token = _checkpoint.set(await self._load_checkpoint(checkpoint_id))
+        try:
+            with token_accounting.request(session_id, user_id) as usage:
+                await token_accounting.enforce_budget(usage)
+                async with request_scheduler.slot(user_id, priority):
+                    final_state = await self._get_graph().ainvoke(initial_state)
+        finally:
+            _checkpoint.reset(checkpoint_token)
         
         return {
             "content": final_state["agent_response"],
@@ -150,9 +274,11 @@ class MainAgent:
         message: str,
         session_id: str,
         user_id: Optional[str] = None,
-        context: Optional[Dict[str, Any]] = None
+        context: Optional[Dict[str, Any]] = None,
+        priority: str = "stream",
+        checkpoint_id: Optional[str] = None
     ) -> AsyncGenerator[Dict[str, Any], None]:
-        """Procesar mensaje del usuario (modo streaming)"""
+        """Procesar mensaje del usuario (modo streaming; `checkpoint_id` como en process_message)"""
         
         # Preparar estado inicial
         initial_state = AgentState(
@@ -164,23 +290,75 @@ class MainAgent:
             current_agent="main",
             agent_response="",
             tools_used=[],
-            metadata={},
+            metadata={"received_at": datetime.now().isoformat()},
             requires_sub_agent=False,
-            sub_agent_type=None
+            sub_agent_type=None,
+            sub_agent_types=[],
+            sub_agent_responses={}
         )
         
-        # Ejecutar el grafo con streaming
-        async for state in self.graph.astream(initial_state):
-            for node_name, node_state in state.items():
-                if "agent_response" in node_state and node_state["agent_response"]:
+        # Los nodos y las partes de los sub-agentes llegan por la misma cola
+        queue: asyncio.Queue = asyncio.Queue()
+        
+        async def run_graph():
+            try:
+                async for state in self._get_graph().astream(initial_state):
+                    for node_name, node_state in state.items():
+                        await queue.put(("node", node_name, node_state))
+            finally:
+                await queue.put(None)
+        
+        # La tarea hereda la cola, el checkpoint y el mbito de contabilidad de tokens a travs del contexto
+        checkpoint = await self._load_checkpoint(checkpoint_id)
+        token = _stream_parts.set(queue)
+        checkpoint_token = _checkpoint.set(checkpoint)
+        try:
+            with token_accounting.request(session_id, user_id) as usage:
+                await token_accounting.enforce_budget(usage)
+                # El hueco del scheduler se ocupa hasta el ltimo evento
+                await request_scheduler.acquire(user_id, priority)
+                runner = asyncio.create_task(run_graph())
+        finally:
+            _checkpoint.reset(checkpoint_token)
+            _stream_parts.reset(token)
+        
+        parts_streamed = False
+        try:
+            while (item := await queue.get()) is not None:
+                kind, name, payload = item
+                if kind == "token":
+                    parts_streamed = True
+                    yield {
+                        "content": payload["content"],
+                        "agent_used": name,
+                        "metadata": {"node": "process_with_main", "token": True}
+                    }
+                elif kind == "part":
+                    parts_streamed = True
+                    yield {
+                        "content": payload["content"],
+                        "agent_used": name,
+                        "metadata": {
+                            "node": "process_with_sub",
+                            "part": name,
+                            "tools_used": payload.get("tools_used", [])
+                        }
+                    }
+                elif payload.get("agent_response") and not parts_streamed:
+                    # Con partes ya enviadas, la respuesta combinada sera una repeticin
                     yield {
-                        "content": node_state["agent_response"],
-                        "agent_used": node_state["current_agent"],
+                        "content": payload["agent_response"],
+                        "agent_used": payload["current_agent"],
                         "metadata": {
-                            "node": node_name,
-                            "tools_used": node_state.get("tools_used", [])
+                            "node": name,
+                            "tools_used": payload.get("tools_used", [])
                         }
                     }
+            await runner
+        finally:
+            if not runner.done():
+                runner.cancel()
+            request_scheduler.release()
     
     async def _analyze_intent(self, state: AgentState) -> AgentState:
         """Analizar la intencin del usuario"""
@@ -188,8 +366,9 @@ class MainAgent:
         analysis_prompt = f"""
         Analiza el siguiente mensaje del usuario y determina:
         1. La intencin principal
-        2. Si requiere un sub-agente especializado
-        3. Qu tipo de sub-agente sera ms apropiado
+        2. Si requiere sub-agentes especializados
+        3. Qu sub-agentes son necesarios: uno, o varios si la pregunta combina temas
+           (p.ej. rendimiento de una campaa y condiciones del plan de la cuenta)
         
         Mensaje: {state["user_message"]}
         
@@ -203,23 +382,42 @@ class MainAgent:
         Responde en formato JSON:
         {{
             "requires_sub_agent": true/false,
-            "sub_agent_type": "tipo" o null,
+            "sub_agent_types": ["tipo", ...] (vaco si no requiere sub-agente),
             "confidence": 0.0-1.0,
             "reasoning": "explicacin"
         }}
         """
         
         try:
-            response = await self.llm.ainvoke(analysis_prompt)
-            analysis = json.loads(response.content)
+            with token_accounting.node("intent"):
+                # En streaming: el enrutado se decide en cuanto llegan sus dos campos
+                analysis = await structured_output.astream_json(
+                    self.llm,
+                    analysis_prompt,
+                    "intent",
+                    required=("requires_sub_agent",),
+                    ready=("requires_sub_agent", "sub_agent_types")
+                )
+            if analysis is None:
+                state["requires_sub_agent"] = False
+                return state
             
-            state["requires_sub_agent"] = analysis["requires_sub_agent"]
-            state["sub_agent_type"] = analysis.get("sub_agent_type")
+            # Sub-agentes conocidos, sin repetir y acotados; se acepta tambin el formato antiguo
+            requested = analysis.get("sub_agent_types") or [analysis.get("sub_agent_type")]
+            sub_agent_types = list(dict.fromkeys(t for t in requested if t in SUB_AGENT_REGISTRY))
+            sub_agent_types = sub_agent_types[:settings.max_parallel_sub_agents]
+            # sub_agent_type (el primero) se mantiene para los ndices y rollups existentes
+            analysis["sub_agent_type"] = sub_agent_types[0] if sub_agent_types else None
+            
+            state["requires_sub_agent"] = bool(analysis["requires_sub_agent"] and sub_agent_types)
+            state["sub_agent_types"] = sub_agent_types
+            state["sub_agent_type"] = analysis["sub_agent_type"]
             state["metadata"]["intent_analysis"] = analysis
             
         except Exception as e:
             print(f"Error en anlisis de intencin: {e}")
             state["requires_sub_agent"] = False
+            state["metadata"]["intent_error"] = str(e)
             
         return state
     
@@ -228,17 +426,17 @@ class MainAgent:
         return "sub_agent" if state["requires_sub_agent"] else "main_agent"
     
     async def _route_to_agent(self, state: AgentState) -> AgentState:
-        """Enrutar a sub-agente especfico"""
-        agent_type = state["sub_agent_type"]
-        if agent_type and agent_type in self.sub_agents:
-            state["current_agent"] = agent_type
+        """Enrutar a uno o varios sub-agentes"""
+        if state["sub_agent_types"]:
+            # Respuestas combinadas se registran como "campaign+account"
+            state["current_agent"] = "+".join(state["sub_agent_types"])
         return state
     
     async def _process_with_main(self, state: AgentState) -> AgentState:
         """Procesar con agente principal"""
         
         # Obtener memoria de la sesin
-        memory = await self.memory_manager.get_session_memory(state["session_id"])
+        memory = await self.memory_manager.get_session_memory(state["session_id"], state["user_id"])
         
         # Crear prompt con contexto
         system_prompt = """
@@ -248,51 +446,224 @@ class MainAgent:
         manera de ayudar al usuario.
         """
         
+        # Recuperar intercambios pasados relevantes del usuario (acotado por timeout)
+        if state["user_id"]:
+            relevant = await self.memory_manager.get_relevant_history(
+                state["user_id"], state["user_message"]
+            )
+            state["metadata"]["semantic_memory_results"] = len(relevant)
+            if relevant:
+                past_context = self.memory_manager.semantic_memory.format_context(relevant)
+                system_prompt += f"""
+        Conversaciones anteriores relevantes con este usuario:
+        {past_context}
+        """
+        
+        parts = _stream_parts.get()
+        streamed = ""
         try:
-            # Procesar con LLM
+            # Procesar con LLM; en streaming, cada token se enva segn llega
             messages = [HumanMessage(content=system_prompt)] + state["messages"]
-            response = await self.llm.ainvoke(messages)
+            if parts is None:
+                response = await self.llm.ainvoke(messages)
+                streamed = response.content
+            else:
+                async for chunk in self.llm.astream(messages):
+                    if chunk.content:
+                        streamed += chunk.content
+                        await parts.put(("token", "main", {"content": chunk.content}))
             
-            state["agent_response"] = response.content
+            state["agent_response"] = streamed
             state["current_agent"] = "main"
             
         except Exception as e:
             state["agent_response"] = f"Lo siento, hubo un error procesando tu solicitud: {str(e)}"
+            state["metadata"]["error"] = str(e)
+            if parts is not None and streamed:
+                # Parte de la respuesta ya se envi: el error llega como continuacin
+                await parts.put(("token", "main", {"content": f"\n\n{state['agent_response']}"}))
             
         return state
     
-    async def _process_with_sub_agent(self, state: AgentState) -> AgentState:
-        """Procesar con sub-agente especializado"""
+    async def _run_sub_agent(self, agent_type: str, state: AgentState) -> Dict[str, Any]:
+        """Consultar un sub-agente con su plazo y su circuit breaker; nunca lanza excepcin"""
+        timeout = settings.sub_agent_timeouts.get(agent_type, settings.agent_timeout_seconds)
+        started = time.perf_counter()
+        try:
+            async with get_breaker(f"agent:{agent_type}").guard():
+                sub_agent = await self._get_sub_agent(agent_type)
+                with token_accounting.agent(agent_type):
+                    response = await asyncio.wait_for(
+                        sub_agent.process_message(
+                            message=state["user_message"],
+                            session_id=state["session_id"],
+                            context={**state["context"], "user_id": state["user_id"]}
+                        ),
+                        timeout=timeout
+                    )
+                    if response.get("status", "ok") != "ok":
+                        raise SubAgentError(response.get("metadata", {}).get("error") or response.get("content"))
+            result = {"status": "ok", **response}
+            await self._remember_answer(agent_type, sub_agent, state, result)
+        except CircuitOpenError:
+            result = await self._fallback_response(agent_type, state, "circuit_open")
+        except asyncio.TimeoutError:
+            result = await self._fallback_response(agent_type, state, "timeout")
+        except Exception as e:
+            result = await self._fallback_response(agent_type, state, "error")
+            result["error"] = str(e)
+        result["latency_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        return result
+    
+    def _fallback_key(self, agent_type: str, state: AgentState) -> str:
+        identity = f"{state['user_id']}:{' '.join(state['user_message'].lower().split())}"
+        return f"agent:fallback:{agent_type}:{hashlib.sha1(identity.encode('utf-8')).hexdigest()}"
+    
+    async def _remember_answer(self, agent_type: str, sub_agent, state: AgentState, result: Dict[str, Any]):
+        """Guardar la respuesta como respaldo para cuando el sub-agente no est disponible"""
+        # Sin usuario la clave sera comn a todos los annimos
+        if settings.breaker_fallback_cache_ttl_seconds <= 0 or not state["user_id"]:
+            return
+        # Las respuestas de operaciones que modifican datos no se reutilizan
+        executor = getattr(sub_agent, "tool_executor", None)
+        if executor is not None and set(result.get("tools_used", [])) & executor.mutating:
+            return
+        try:
+            await self.memory_manager.redis_client.set(
+                self._fallback_key(agent_type, state),
+                result["content"],
+                ex=settings.breaker_fallback_cache_ttl_seconds
+            )
+        except Exception as e:
+            print(f"Error guardando respuesta de respaldo: {e}")
+    
+    async def _fallback_response(self, agent_type: str, state: AgentState, status: str) -> Dict[str, Any]:
+        """Respuesta degradada cuando el sub-agente falla o su circuito est abierto
         
-        agent_type = state["current_agent"]
-        if agent_type in self.sub_agents:
+        Por orden: la ltima respuesta del sub-agente a la misma pregunta del usuario, una
+        respuesta general del agente principal (acotada por BREAKER_FALLBACK_TIMEOUT_SECONDS;
+        con el circuito de su LLM abierto falla al instante) o un mensaje esttico.
+        """
+        label = SUB_AGENT_LABELS.get(agent_type, agent_type).lower()
+        result = {"status": status, "tools_used": [], "metadata": {}}
+        
+        cached = None
+        if state["user_id"]:
             try:
-                sub_agent = self.sub_agents[agent_type]
-                response = await sub_agent.process_message(
-                    message=state["user_message"],
-                    session_id=state["session_id"],
-                    context=state["context"]
-                )
-                
-                state["agent_response"] = response["content"]
-                state["tools_used"].extend(response.get("tools_used", []))
-                state["metadata"].update(response.get("metadata", {}))
-                
-            except Exception as e:
-                state["agent_response"] = f"Error en sub-agente {agent_type}: {str(e)}"
+                cached = await self.memory_manager.redis_client.get(self._fallback_key(agent_type, state))
+            except Exception:
+                pass
+        if cached:
+            return {**result, "fallback": "cache", "content": cached}
+        
+        prompt = f"""
+        Eres el agente principal de Agent VAM. El especialista en {label} no est disponible
+        en este momento. Responde con informacin general, sin inventar datos concretos de la
+        cuenta del usuario, e indica que podr consultar el detalle en unos minutos.
+        """
+        try:
+            response = await asyncio.wait_for(
+                self.llm.ainvoke([HumanMessage(content=prompt)] + state["messages"]),
+                timeout=settings.breaker_fallback_timeout_seconds
+            )
+            return {**result, "fallback": "main", "content": response.content}
+        except Exception:
+            pass
+        
+        return {
+            **result,
+            "fallback": "static",
+            "content": f"El servicio de {label} no est disponible en este momento. Intntalo de nuevo en unos minutos."
+        }
+    
+    @staticmethod
+    def _format_part(agent_type: str, content: str) -> str:
+        return f"**{SUB_AGENT_LABELS.get(agent_type, agent_type)}**\n{content}"
+    
+    async def _process_with_sub_agent(self, state: AgentState) -> AgentState:
+        """Procesar con uno o varios sub-agentes especializados en paralelo"""
+        
+        agent_types = state["sub_agent_types"]
+        if not agent_types:
+            return state
+        
+        if len(agent_types) == 1:
+            state["sub_agent_responses"][agent_types[0]] = await self._run_sub_agent(agent_types[0], state)
+            return state
         
+        # Varias partes: la latencia es la del sub-agente ms lento, no la suma
+        parts = _stream_parts.get()
+        
+        async def run(agent_type: str):
+            result = await self._run_sub_agent(agent_type, state)
+            # Orden de insercin = orden de llegada, el mismo en que se envan por streaming
+            state["sub_agent_responses"][agent_type] = result
+            if parts is not None:
+                await parts.put(("part", agent_type, {
+                    "content": self._format_part(agent_type, result["content"]),
+                    "tools_used": result.get("tools_used", [])
+                }))
+        
+        await asyncio.gather(*[run(agent_type) for agent_type in agent_types])
+        return state
+    
+    async def _merge_responses(self, state: AgentState) -> AgentState:
+        """Componer una nica respuesta a partir de las de los sub-agentes"""
+        responses = state["sub_agent_responses"]
+        if not responses:
+            return state
+        
+        if len(responses) == 1:
+            agent_type, response = next(iter(responses.items()))
+            state["agent_response"] = response["content"]
+            state["tools_used"].extend(response.get("tools_used", []))
+            state["metadata"].update(response.get("metadata", {}))
+            if response["status"] != "ok":
+                state["metadata"]["degraded"] = {
+                    "agent": agent_type,
+                    "status": response["status"],
+                    "fallback": response.get("fallback")
+                }
+            return state
+        
+        state["agent_response"] = "\n\n".join(
+            self._format_part(agent_type, response["content"])
+            for agent_type, response in responses.items()
+        )
+        for response in responses.values():
+            state["tools_used"].extend(response.get("tools_used", []))
+        state["metadata"]["sub_agents"] = {
+            agent_type: {
+                "status": response["status"],
+                "fallback": response.get("fallback"),
+                "latency_ms": response["latency_ms"],
+                "metadata": response.get("metadata", {})
+            }
+            for agent_type, response in responses.items()
+        }
         return state
     
     async def _finalize_response(self, state: AgentState) -> AgentState:
         """Finalizar respuesta y guardar en memoria"""
         
+        # Mtricas del turno para los rollups de uso
+        received_at = state["metadata"].get("received_at")
+        if received_at:
+            elapsed = datetime.now() - datetime.fromisoformat(received_at)
+            state["metadata"]["latency_ms"] = round(elapsed.total_seconds() * 1000, 1)
+        state["metadata"]["tools_used"] = state["tools_used"]
+        usage = token_accounting.current()
+        if usage is not None:
+            state["metadata"]["token_usage"] = usage.summary()
+        
         # Guardar en memoria
         await self.memory_manager.save_conversation(
             session_id=state["session_id"],
             user_message=state["user_message"],
             agent_response=state["agent_response"],
             agent_used=state["current_agent"],
-            metadata=state["metadata"]
+            metadata=state["metadata"],
+            user_id=state["user_id"]
         )
         
         # Actualizar timestamp
@@ -311,8 +682,12 @@ class MainAgent:
         except:
             health["llm"] = "unhealthy"
         
-        # Verificar sub-agentes
-        for name, agent in self.sub_agents.items():
+        # Verificar sub-agentes (los no inicializados no se cargan para el check)
+        for name in SUB_AGENT_REGISTRY:
+            agent = self.sub_agents.get(name)
+            if agent is None:
+                health[f"agent_{name}"] = "not_loaded"
+                continue
             try:
                 await agent.health_check()
                 health[f"agent_{name}"] = "healthy"
@@ -333,10 +708,8 @@ class MainAgent:
         return await self.memory_manager.get_conversation_history(session_id, limit)
     
     async def clear_session(self, session_id: str):
-        """Limpiar sesin"""
+        """Limpiar sesin (tambin invalida la cache de sesiones de todos los workers)"""
         await self.memory_manager.clear_session(session_id)
-        if session_id in self.sessions:
-            del self.sessions[session_id]
     
     async def save_conversation_history(self, session_id: str, user_message: str, agent_response: str):
         """Guardar historial de conversacin (para background tasks)"""
@@ -351,18 +724,41 @@ class MainAgent:
     async def get_agents_status(self) -> Dict[str, Dict]:
         """Obtener estado de todos los sub-agentes"""
         status = {}
-        for name, agent in self.sub_agents.items():
+        for name in SUB_AGENT_REGISTRY:
+            agent = self.sub_agents.get(name)
+            if agent is None:
+                status[name] = {"name": name, "status": "not_loaded"}
+                continue
             try:
                 agent_status = await agent.get_status()
                 status[name] = agent_status
             except Exception as e:
                 status[name] = {"status": "error", "error": str(e)}
+        
+        # Estado del circuito de cada sub-agente (los que an no se han llamado estn cerrados)
+        breakers = get_breaker_stats("agent:")
+        for name in SUB_AGENT_REGISTRY:
+            status[name]["circuit"] = breakers.get(f"agent:{name}", {"state": "closed"})
         return status
     
     async def cleanup(self):
         """Limpieza al cerrar"""
+        if self._prewarm_task and not self._prewarm_task.done():
+            self._prewarm_task.cancel()
+        if self._warmup_task and not self._warmup_task.done():
+            self._warmup_task.cancel()
+        
+        # Llamadas sombra en curso: se descartan sin esperar
+        await shadow_traffic.cleanup()
+        
         if self.memory_manager:
             await self.memory_manager.cleanup()
         
+        await cleanup_embedding_service()
+        
+        if settings.default_llm_provider == "ollama":
+            from src.core.ollama_chat import close_ollama_servers
+            await close_ollama_servers()
+        
         for agent in self.sub_agents.values():
             await agent.cleanup()
@@ -1,7 +1,10 @@
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional
 from datetime import datetime
+import json
 from src.core.llm_factory import LLMFactory
 from src.core.config import settings
+from src.core.product_catalog import ProductCatalogIndex
+from src.core.embedding_service import get_embedding_service
 
 class ProductAgent:
     """Sub-agente para informacin de productos"""
@@ -10,17 +13,60 @@ class ProductAgent:
         self.llm = None
         self.name = "product_agent"
         self.status = "inactive"
+        self.catalog_index = None
         
     async def initialize(self):
         self.llm = LLMFactory.create_llm()
+        
+        # ndice del catlogo de productos (opcional)
+        if settings.product_catalog_path:
+            self.catalog_index = ProductCatalogIndex(
+                settings.product_catalog_path,
+                settings.product_index_dir,
+                embedding_service=get_embedding_service() if settings.product_vector_search else None
+            )
+            await self.catalog_index.initialize()
+        
         self.status = "active"
         print(f" {self.name} inicializado")
         
     async def process_message(self, message: str, session_id: str, context: Optional[Dict] = None):
         system_prompt = "Eres un especialista en informacin de productos. Ayuda con consultas sobre caractersticas, precios y comparaciones."
+        products = []
+        
+        if self.catalog_index:
+            products = await self.catalog_index.search(message)
+            # Slo los productos relevantes van al prompt: respuestas cortas y basadas en datos
+            system_prompt += (
+                " Responde de forma breve usando nicamente los productos del catlogo listados."
+                " Si la informacin no est en ellos, dilo."
+                f"\n\nProductos relevantes del catlogo:\n{self._format_products(products)}"
+            )
+        
         response = await self.llm.ainvoke(f"{system_prompt}\n\nUsuario: {message}")
-        return {"content": response.content, "tools_used": [], "metadata": {"agent": self.name}}
+        return {
+            "content": response.content,
+            "tools_used": ["product_search"] if self.catalog_index else [],
+            "metadata": {
+                "agent": self.name,
+                "products_matched": [p.get("id") or p.get("sku") or p.get("name") for p in products]
+            }
+        }
+        
+    @staticmethod
+    def _format_products(products: List[Dict[str, Any]]) -> str:
+        if not products:
+            return "(ningn producto coincide con la consulta)"
+        lines = []
+        for product in products:
+            fields = {k: v for k, v in product.items() if not k.startswith("_") and v not in (None, "")}
+            lines.append("- " + json.dumps(fields, ensure_ascii=False, default=str)[:settings.product_max_record_chars])
+        return "\n".join(lines)
         
     async def health_check(self): return True
-    async def get_status(self): return {"name": self.name, "status": self.status}
+    async def get_status(self):
+        status = {"name": self.name, "status": self.status}
+        if self.catalog_index:
+            status["catalog_index"] = self.catalog_index.get_stats()
+        return status
     async def cleanup(self): self.status = "inactive"
@@ -0,0 +1,313 @@
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import date, timedelta
+import json
+import os
+
+import numpy as np
+
+from src.core.config import settings
+
+# Columnas numricas de rendimiento que se agregan
+METRIC_COLUMNS = ["impressions", "clicks", "conversions", "spend", "revenue"]
+
+# Columnas categricas: se codifican como enteros + diccionario de categoras
+CATEGORICAL_COLUMNS = ["campaign_id", "channel"]
+
+# KPIs derivados: (numerador, denominador)
+KPI_DEFINITIONS = {
+    "ctr": ("clicks", "impressions"),
+    "cvr": ("conversions", "clicks"),
+    "cpc": ("spend", "clicks"),
+    "cpa": ("spend", "conversions"),
+    "roas": ("revenue", "spend")
+}
+
+def _safe_ratio(numerator, denominator):
+    """Divisin vectorizada que devuelve 0 donde el denominador es 0"""
+    numerator = np.asarray(numerator, dtype=np.float64)
+    denominator = np.asarray(denominator, dtype=np.float64)
+    out = np.zeros(np.broadcast(numerator, denominator).shape, dtype=np.float64)
+    np.divide(numerator, denominator, out=out, where=denominator != 0)
+    return out
+
+def _encode_categorical(values) -> Tuple[np.ndarray, List[str]]:
+    categories, codes = np.unique(np.asarray(values).astype(str), return_inverse=True)
+    return codes.astype(np.int32), categories.tolist()
+
+def convert_to_columnar(source_path: str, target_dir: str):
+    """Convertir Parquet/CSV a columnas .npy (abribles con mmap sin copia ni parseo)"""
+    try:
+        import pyarrow.parquet as pq
+        import pyarrow.csv as pacsv
+    except ImportError:
+        raise ImportError("pyarrow es necesario para convertir datos de analtica: pip install pyarrow")
+    
+    if source_path.endswith(".parquet"):
+        table = pq.read_table(source_path, memory_map=True)
+    else:
+        table = pacsv.read_csv(source_path)
+    
+    os.makedirs(target_dir, exist_ok=True)
+    dates = table.column("date").to_numpy(zero_copy_only=False).astype("datetime64[D]")
+    order = np.argsort(dates, kind="stable")  # Ordenado por fecha: filtros por rango O(log n)
+    np.save(os.path.join(target_dir, "date.npy"), dates[order].astype(np.int32))
+    
+    categories = {}
+    for name in CATEGORICAL_COLUMNS:
+        if name in table.column_names:
+            codes, categories[name] = _encode_categorical(table.column(name).to_numpy(zero_copy_only=False))
+            np.save(os.path.join(target_dir, f"{name}.npy"), codes[order])
+    
+    for name in METRIC_COLUMNS:
+        values = table.column(name).to_numpy(zero_copy_only=False).astype(np.float64)
+        np.save(os.path.join(target_dir, f"{name}.npy"), values[order])
+    
+    with open(os.path.join(target_dir, "categories.json"), "w", encoding="utf-8") as f:
+        json.dump(categories, f)
+
+class AnalyticsEngine:
+    """Motor de KPIs vectorizado sobre datos de rendimiento en arrays columnares"""
+    
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, List[str]]):
+        self.columns = columns
+        self.categories = categories
+        self._category_index = {
+            name: {value: code for code, value in enumerate(values)}
+            for name, values in categories.items()
+        }
+        dates = columns["date"]
+        self.sorted_by_date = bool(dates.size < 2 or np.all(dates[1:] >= dates[:-1]))
+    
+    @property
+    def num_rows(self) -> int:
+        return int(self.columns["date"].size)
+    
+    @classmethod
+    def load(cls, path: str) -> "AnalyticsEngine":
+        """Cargar datos: directorio de columnas .npy (mmap), Parquet (mmap) o CSV"""
+        if os.path.isdir(path):
+            categories = {}
+            categories_path = os.path.join(path, "categories.json")
+            if os.path.exists(categories_path):
+                with open(categories_path, encoding="utf-8") as f:
+                    categories = json.load(f)
+            columns = {
+                name[:-4]: np.load(os.path.join(path, name), mmap_mode="r")
+                for name in os.listdir(path)
+                if name.endswith(".npy")
+            }
+            return cls(columns, categories)
+        
+        try:
+            import pyarrow.parquet as pq
+            import pyarrow.csv as pacsv
+        except ImportError:
+            raise ImportError("pyarrow es necesario para leer Parquet/CSV: pip install pyarrow")
+        
+        table = pq.read_table(path, memory_map=True) if path.endswith(".parquet") else pacsv.read_csv(path)
+        columns = {
+            "date": table.column("date").to_numpy(zero_copy_only=False).astype("datetime64[D]").astype(np.int32)
+        }
+        categories = {}
+        for name in CATEGORICAL_COLUMNS:
+            if name in table.column_names:
+                columns[name], categories[name] = _encode_categorical(
+                    table.column(name).to_numpy(zero_copy_only=False)
+                )
+        for name in METRIC_COLUMNS:
+            columns[name] = table.column(name).to_numpy(zero_copy_only=False).astype(np.float64)
+        return cls(columns, categories)
+    
+    @staticmethod
+    def _day(value: date) -> int:
+        return int(np.datetime64(value, "D").astype(np.int64))
+    
+    def date_bounds(self) -> Tuple[date, date]:
+        dates = self.columns["date"]
+        if self.sorted_by_date:
+            low, high = dates[0], dates[-1]
+        else:
+            low, high = dates.min(), dates.max()
+        return (
+            np.datetime64(int(low), "D").astype(date),
+            np.datetime64(int(high), "D").astype(date)
+        )
+    
+    def default_period(self, days: int = 30) -> Tuple[date, date]:
+        """ltimos `days` das disponibles en los datos"""
+        _, last = self.date_bounds()
+        return last - timedelta(days=days - 1), last
+    
+    def _select(
+        self,
+        start: date,
+        end: date,
+        campaign_ids: Optional[List[str]] = None,
+        channel: Optional[str] = None
+    ):
+        """Selector de filas para [start, end]: slice si est ordenado por fecha, si no mscara"""
+        dates = self.columns["date"]
+        if self.sorted_by_date:
+            low = int(np.searchsorted(dates, self._day(start), side="left"))
+            high = int(np.searchsorted(dates, self._day(end), side="right"))
+            selector = slice(low, high)
+            mask = None
+        else:
+            selector = None
+            mask = (dates >= self._day(start)) & (dates <= self._day(end))
+        
+        def _restrict(column: str, values: List[str]):
+            nonlocal mask
+            index = self._category_index.get(column, {})
+            codes = np.asarray([index[v] for v in values if v in index], dtype=np.int32)
+            column_values = self.columns[column] if selector is None else self.columns[column][selector]
+            condition = np.isin(column_values, codes)
+            mask = condition if mask is None else mask & condition
+        
+        if campaign_ids:
+            _restrict("campaign_id", campaign_ids)
+        if channel:
+            _restrict("channel", [channel])
+        
+        return selector, mask
+    
+    def _column(self, name: str, selector, mask) -> np.ndarray:
+        values = self.columns[name]
+        if selector is not None:
+            values = values[selector]
+        if mask is not None:
+            values = values[mask]
+        return values
+    
+    def rows(
+        self,
+        start: date,
+        end: date,
+        columns: List[str],
+        campaign_ids: Optional[List[str]] = None,
+        channel: Optional[str] = None
+    ) -> Dict[str, np.ndarray]:
+        """Columnas crudas de las filas del periodo (categricas como cdigos enteros)"""
+        selector, mask = self._select(start, end, campaign_ids, channel)
+        return {name: self._column(name, selector, mask) for name in columns}
+    
+    @staticmethod
+    def _with_kpis(totals: Dict[str, float]) -> Dict[str, float]:
+        result = {name: float(value) for name, value in totals.items()}
+        for kpi, (numerator, denominator) in KPI_DEFINITIONS.items():
+            result[kpi] = float(_safe_ratio(totals[numerator], totals[denominator]))
+        return result
+    
+    def summary(
+        self,
+        start: date,
+        end: date,
+        campaign_ids: Optional[List[str]] = None,
+        channel: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Totales y KPIs (CTR, CVR, CPC, CPA, ROAS) del periodo"""
+        selector, mask = self._select(start, end, campaign_ids, channel)
+        totals = {name: float(np.sum(self._column(name, selector, mask))) for name in METRIC_COLUMNS}
+        return {
+            "period": {"start": start.isoformat(), "end": end.isoformat()},
+            "rows": int(self._column("date", selector, mask).size),
+            **self._with_kpis(totals)
+        }
+    
+    def period_over_period(
+        self,
+        start: date,
+        end: date,
+        campaign_ids: Optional[List[str]] = None,
+        channel: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """Comparar el periodo con el inmediatamente anterior de la misma duracin"""
+        length = (end - start).days + 1
+        previous_end = start - timedelta(days=1)
+        previous_start = previous_end - timedelta(days=length - 1)
+        
+        current = self.summary(start, end, campaign_ids, channel)
+        previous = self.summary(previous_start, previous_end, campaign_ids, channel)
+        
+        deltas = {}
+        for name in METRIC_COLUMNS + list(KPI_DEFINITIONS):
+            change = current[name] - previous[name]
+            deltas[name] = {
+                "absolute": change,
+                "percent": float(_safe_ratio(change, previous[name]) * 100) if previous[name] else None
+            }
+        
+        return {"current": current, "previous": previous, "deltas": deltas}
+    
+    def grouped(
+        self,
+        start: date,
+        end: date,
+        group_by: str = "campaign_id",
+        channel: Optional[str] = None
+    ) -> Tuple[List[str], Dict[str, np.ndarray]]:
+        """Agregacin por grupo con np.bincount (un pase por columna, sin ordenar)"""
+        selector, mask = self._select(start, end, channel=channel)
+        codes = self._column(group_by, selector, mask)
+        groups = len(self.categories[group_by])
+        totals = {
+            name: np.bincount(codes, weights=self._column(name, selector, mask), minlength=groups)
+            for name in METRIC_COLUMNS
+        }
+        for kpi, (numerator, denominator) in KPI_DEFINITIONS.items():
+            totals[kpi] = _safe_ratio(totals[numerator], totals[denominator])
+        return self.categories[group_by], totals
+    
+    def top_n(
+        self,
+        metric: str = "roas",
+        n: int = 10,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        group_by: str = "campaign_id",
+        ascending: bool = False,
+        min_spend: float = 0.0,
+        channel: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Mejores (o peores) N grupos segn una mtrica o KPI"""
+        if start is None or end is None:
+            start, end = self.default_period()
+        
+        labels, totals = self.grouped(start, end, group_by, channel)
+        eligible = np.flatnonzero((totals["spend"] >= min_spend) & (totals["impressions"] > 0))
+        if eligible.size == 0:
+            return []
+        
+        values = totals[metric][eligible]
+        k = min(n, eligible.size)
+        ranked = values if ascending else -values
+        # argpartition O(n) + ordenar slo los k elegidos
+        top = np.argpartition(ranked, k - 1)[:k]
+        top = top[np.argsort(ranked[top], kind="stable")]
+        
+        return [
+            {
+                group_by: labels[eligible[i]],
+                **{name: float(totals[name][eligible[i]]) for name in METRIC_COLUMNS + list(KPI_DEFINITIONS)}
+            }
+            for i in top
+        ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        first, last = self.date_bounds() if self.num_rows else (None, None)
+        return {
+            "rows": self.num_rows,
+            "sorted_by_date": self.sorted_by_date,
+            "date_range": [first.isoformat(), last.isoformat()] if first else None,
+            "campaigns": len(self.categories.get("campaign_id", []))
+        }
+
+_analytics_engine: Optional[AnalyticsEngine] = None
+
+def get_analytics_engine() -> Optional[AnalyticsEngine]:
+    """Obtener el motor compartido (None si no hay datos configurados)"""
+    global _analytics_engine
+    if _analytics_engine is None and settings.analytics_data_path:
+        _analytics_engine = AnalyticsEngine.load(settings.analytics_data_path)
+        print(f" Motor de analtica cargado: {_analytics_engine.num_rows} filas")
+    return _analytics_engine
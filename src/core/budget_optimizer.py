@@ -0,0 +1,233 @@
+from typing import Dict, Any, List, Optional
+from datetime import date
+
+import numpy as np
+
+from src.core.config import settings
+
+class ResponseCurves:
+    """Curvas de respuesta por campaa: revenue_diario = a * spend_diario ** b (0 < b < 1)"""
+    
+    def __init__(self, labels: List[str], a: np.ndarray, b: np.ndarray, current_spend: np.ndarray, fitted: np.ndarray):
+        self.labels = labels
+        self.a = a
+        self.b = b
+        self.current_spend = current_spend
+        self.fitted = fitted  # True si la elasticidad sale de la regresin (no del valor por defecto)
+    
+    def __len__(self) -> int:
+        return len(self.labels)
+    
+    def revenue(self, spend: np.ndarray) -> np.ndarray:
+        return self.a * np.power(spend, self.b)
+    
+    def marginal_roas(self, spend: np.ndarray) -> np.ndarray:
+        """Derivada d(revenue)/d(spend) = a * b * spend ** (b - 1)"""
+        out = np.full(spend.shape, np.inf)
+        positive = spend > 0
+        out[positive] = self.a[positive] * self.b[positive] * np.power(spend[positive], self.b[positive] - 1)
+        return out
+    
+    @classmethod
+    def fit(
+        cls,
+        labels: List[str],
+        daily_spend: np.ndarray,
+        daily_revenue: np.ndarray,
+        min_days: Optional[int] = None,
+        default_elasticity: Optional[float] = None
+    ) -> "ResponseCurves":
+        """Ajuste log-log por mnimos cuadrados de todas las campaas a la vez (matrices campaas x das)"""
+        min_days = min_days or settings.budget_min_history_days
+        default_elasticity = default_elasticity or settings.budget_default_elasticity
+        
+        valid = (daily_spend > 0) & (daily_revenue > 0)
+        n = valid.sum(axis=1).astype(np.float64)
+        log_x = np.log(np.where(valid, daily_spend, 1.0))
+        log_y = np.log(np.where(valid, daily_revenue, 1.0))
+        
+        # Sumas suficientes de la regresin por fila (las celdas no vlidas aportan 0)
+        sum_x = np.where(valid, log_x, 0.0).sum(axis=1)
+        sum_y = np.where(valid, log_y, 0.0).sum(axis=1)
+        sum_xx = np.where(valid, log_x * log_x, 0.0).sum(axis=1)
+        sum_xy = np.where(valid, log_x * log_y, 0.0).sum(axis=1)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean_x = sum_x / n
+            mean_y = sum_y / n
+            var_x = sum_xx / n - mean_x ** 2
+            slope = (sum_xy / n - mean_x * mean_y) / var_x
+        
+        # Sin historial suficiente o sin variacin de gasto: elasticidad por defecto
+        fitted = (n >= min_days) & (var_x > 1e-6) & np.isfinite(slope)
+        b = np.where(fitted, slope, default_elasticity)
+        b = np.clip(b, settings.budget_min_elasticity, settings.budget_max_elasticity)
+        
+        # a se recalibra con b acotado para que la curva pase por el punto medio observado
+        days_observed = np.maximum((daily_spend > 0).sum(axis=1), 1)
+        current_spend = daily_spend.sum(axis=1) / days_observed
+        current_revenue = daily_revenue.sum(axis=1) / days_observed
+        with np.errstate(divide="ignore", invalid="ignore"):
+            a_fitted = np.exp(mean_y - b * mean_x)
+            a_default = current_revenue / np.power(current_spend, b)
+        a = np.where(fitted, a_fitted, a_default)
+        a = np.where(np.isfinite(a), a, 0.0)
+        
+        return cls(labels, a, b, current_spend, fitted)
+    
+    @classmethod
+    def from_engine(
+        cls,
+        engine,
+        start: date,
+        end: date,
+        channel: Optional[str] = None,
+        campaign_ids: Optional[List[str]] = None
+    ) -> "ResponseCurves":
+        """Construir las matrices diarias campaa x da desde el motor de analtica y ajustar
+        
+        Con campaign_ids slo entran esas campaas (p.ej. la cartera de un usuario).
+        """
+        labels = engine.categories["campaign_id"]
+        keep = None
+        if campaign_ids is not None:
+            index = {label: i for i, label in enumerate(labels)}
+            keep = np.asarray(sorted({index[c] for c in campaign_ids if c in index}), dtype=np.int64)
+            if keep.size == 0:
+                empty = np.zeros((0, 1))
+                return cls.fit([], empty, empty)
+        rows = engine.rows(
+            start, end, ["date", "campaign_id", "spend", "revenue"],
+            campaign_ids=[labels[i] for i in keep] if keep is not None else None,
+            channel=channel
+        )
+        n_days = (end - start).days + 1
+        
+        # Agregado diario en un nico bincount sobre la clave campaa * das + da
+        day = rows["date"].astype(np.int64) - int(np.datetime64(start, "D").astype(np.int64))
+        key = rows["campaign_id"].astype(np.int64) * n_days + day
+        shape = (len(labels), n_days)
+        daily_spend = np.bincount(key, weights=rows["spend"], minlength=shape[0] * shape[1]).reshape(shape)
+        daily_revenue = np.bincount(key, weights=rows["revenue"], minlength=shape[0] * shape[1]).reshape(shape)
+        if keep is not None:
+            labels = [labels[i] for i in keep]
+            daily_spend, daily_revenue = daily_spend[keep], daily_revenue[keep]
+        return cls.fit(labels, daily_spend, daily_revenue)
+
+def allocate_budget(
+    curves: ResponseCurves,
+    total_budget: Optional[float] = None,
+    max_change: Optional[float] = None,
+    min_budget: float = 0.0,
+    iterations: int = 100
+) -> np.ndarray:
+    """Repartir el presupuesto igualando el ROAS marginal (condicin KKT) con cotas por campaa
+    
+    Para un multiplicador lambda, el gasto ptimo de cada campaa es
+    x = (lambda / (a * b)) ** (1 / (b - 1)) acotado a [lo, hi]; el gasto total es decreciente
+    en lambda, as que se busca por biseccin (en escala logartmica) el lambda que agota el
+    presupuesto. Cada iteracin es O(n) vectorizada.
+    """
+    max_change = settings.budget_max_change if max_change is None else max_change
+    current = curves.current_spend
+    total_budget = float(current.sum()) if total_budget is None else float(total_budget)
+    
+    lo = np.maximum(current * (1 - max_change), min_budget)
+    hi = np.maximum(current * (1 + max_change), lo)
+    # Campaas sin curva (sin revenue) slo pueden bajar hasta el mnimo
+    active = (curves.a > 0) & (curves.b > 0)
+    hi = np.where(active, hi, lo)
+    
+    if total_budget <= lo.sum():
+        return lo
+    if total_budget >= hi.sum():
+        return hi
+    
+    ab = np.where(active, curves.a * curves.b, 1.0)
+    exponent = 1.0 / (curves.b - 1.0)
+    
+    def spend_at(log_lambda: float) -> np.ndarray:
+        with np.errstate(over="ignore", divide="ignore"):
+            unconstrained = np.exp((log_lambda - np.log(ab)) * exponent)
+        return np.where(active, np.clip(unconstrained, lo, hi), lo)
+    
+    # Intervalo inicial: ROAS marginales posibles dentro de las cotas
+    marginal_hi = curves.marginal_roas(np.maximum(lo, 1e-9))[active]
+    marginal_lo = curves.marginal_roas(np.maximum(hi, 1e-9))[active]
+    low = float(np.log(max(marginal_lo.min(), 1e-12))) - 1.0
+    high = float(np.log(max(marginal_hi.max(), 1e-12))) + 1.0
+    
+    for _ in range(iterations):
+        middle = (low + high) / 2
+        if spend_at(middle).sum() > total_budget:
+            low = middle
+        else:
+            high = middle
+        if high - low < 1e-10:
+            break
+    
+    allocation = spend_at(high)
+    # Repartir el residuo de la biseccin entre las campaas con holgura
+    residual = total_budget - allocation.sum()
+    slack = (hi - allocation) if residual > 0 else (allocation - lo)
+    if slack.sum() > 0:
+        allocation = allocation + residual * slack / slack.sum()
+    return allocation
+
+def optimize_portfolio(
+    curves: ResponseCurves,
+    total_budget: Optional[float] = None,
+    max_change: Optional[float] = None,
+    min_budget: float = 0.0,
+    top: int = 20,
+    min_change: float = 0.01
+) -> Dict[str, Any]:
+    """Optimizar la cartera y devolver el diff explicable (gasto diario actual vs propuesto)"""
+    current = curves.current_spend
+    proposed = allocate_budget(curves, total_budget, max_change, min_budget)
+    
+    revenue_current = curves.revenue(current)
+    revenue_proposed = curves.revenue(proposed)
+    change = proposed - current
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change_pct = np.where(current > 0, change / current * 100, 0.0)
+    marginal_current = curves.marginal_roas(current)
+    marginal_proposed = curves.marginal_roas(proposed)
+    
+    # Slo los cambios relevantes, ordenados por magnitud (argpartition + ordenar los k elegidos)
+    relevant = np.flatnonzero(np.abs(change) > np.maximum(current * min_change, 1e-9))
+    if relevant.size > top:
+        keep = np.argpartition(-np.abs(change[relevant]), top - 1)[:top]
+        relevant = relevant[keep]
+    relevant = relevant[np.argsort(-np.abs(change[relevant]), kind="stable")]
+    
+    changes = [
+        {
+            "campaign_id": curves.labels[i],
+            "current_daily_budget": round(float(current[i]), 2),
+            "proposed_daily_budget": round(float(proposed[i]), 2),
+            "change": round(float(change[i]), 2),
+            "change_pct": round(float(change_pct[i]), 1),
+            "elasticity": round(float(curves.b[i]), 3),
+            "fitted": bool(curves.fitted[i]),
+            "marginal_roas_current": round(float(marginal_current[i]), 3),
+            "marginal_roas_proposed": round(float(marginal_proposed[i]), 3)
+        }
+        for i in relevant
+    ]
+    
+    total_current = float(revenue_current.sum())
+    total_proposed = float(revenue_proposed.sum())
+    return {
+        "campaigns": len(curves),
+        "campaigns_changed": int(np.count_nonzero(np.abs(change) > np.maximum(current * min_change, 1e-9))),
+        "fitted_campaigns": int(curves.fitted.sum()),
+        "budget": {"current": round(float(current.sum()), 2), "proposed": round(float(proposed.sum()), 2)},
+        "expected_daily_revenue": {
+            "current": round(total_current, 2),
+            "proposed": round(total_proposed, 2),
+            "lift_pct": round((total_proposed / total_current - 1) * 100, 2) if total_current else None
+        },
+        "max_change": settings.budget_max_change if max_change is None else max_change,
+        "changes": changes
+    }
@@ -0,0 +1,214 @@
+from typing import Dict, Any, List, Optional
+from datetime import datetime, date
+import uuid
+
+from sqlalchemy import select, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from src.core.config import settings
+from src.core.connection_pools import create_database_engine
+from src.models.database import Base, Campaign
+
+# Campos editables de una campaa y su tipo esperado
+CAMPAIGN_FIELDS = {
+    "name": str,
+    "objective": str,
+    "channel": str,
+    "status": str,
+    "budget": float,
+    "bid": float,
+    "targeting": dict,
+    "start_date": date,
+    "end_date": date
+}
+
+CAMPAIGN_STATUSES = {"draft", "active", "paused", "archived"}
+
+class CampaignRepository:
+    """Repositorio asncrono de campaas con operaciones masivas en una sola transaccin"""
+    
+    def __init__(self, database_url: Optional[str] = None):
+        # SQLite (sqlite+aiosqlite:///...) para tests; PostgreSQL en produccin
+        self.database_url = database_url or settings.campaign_database_url or settings.database_url
+        self.db_engine = None
+        self.db_session = None
+    
+    async def initialize(self):
+        """Crear el engine y la tabla de campaas"""
+        self.db_engine = create_database_engine(self.database_url, name="campaigns")
+        self.db_session = sessionmaker(self.db_engine, class_=AsyncSession, expire_on_commit=False)
+        
+        async with self.db_engine.begin() as connection:
+            await connection.run_sync(
+                lambda sync_conn: Base.metadata.create_all(sync_conn, tables=[Campaign.__table__])
+            )
+    
+    @staticmethod
+    def _normalize(item: Dict[str, Any], partial: bool) -> Dict[str, Any]:
+        """Validar y convertir los campos de una campaa; lanza ValueError si no es vlida"""
+        values = {}
+        for field, value in item.items():
+            if field not in CAMPAIGN_FIELDS or value is None:
+                continue
+            expected = CAMPAIGN_FIELDS[field]
+            if expected is date and isinstance(value, str):
+                value = date.fromisoformat(value)
+            elif expected is float:
+                value = float(value)
+            if not isinstance(value, expected):
+                raise ValueError(f"Campo {field} invlido")
+            values[field] = value
+        
+        if not partial and not values.get("name"):
+            raise ValueError("El nombre de la campaa es obligatorio")
+        if "budget" in values and values["budget"] < 0:
+            raise ValueError("El presupuesto no puede ser negativo")
+        if "bid" in values and values["bid"] < 0:
+            raise ValueError("La puja no puede ser negativa")
+        if "status" in values and values["status"] not in CAMPAIGN_STATUSES:
+            raise ValueError(f"Estado invlido: {values['status']}")
+        if values.get("start_date") and values.get("end_date") and values["end_date"] < values["start_date"]:
+            raise ValueError("La fecha de fin es anterior a la de inicio")
+        return values
+    
+    @staticmethod
+    def _owned_by(user_id: Optional[str]):
+        """Filtro de propiedad: sin usuario slo se ven las campaas creadas sin usuario"""
+        return Campaign.user_id == user_id if user_id else Campaign.user_id.is_(None)
+    
+    @staticmethod
+    def to_dict(campaign: Campaign) -> Dict[str, Any]:
+        return {
+            "id": str(campaign.id),
+            "user_id": campaign.user_id,
+            "name": campaign.name,
+            "objective": campaign.objective,
+            "channel": campaign.channel,
+            "status": campaign.status,
+            "budget": campaign.budget,
+            "bid": campaign.bid,
+            "targeting": campaign.targeting,
+            "start_date": campaign.start_date.isoformat() if campaign.start_date else None,
+            "end_date": campaign.end_date.isoformat() if campaign.end_date else None,
+            "updated_at": campaign.updated_at.isoformat() if campaign.updated_at else None
+        }
+    
+    async def create_many(
+        self,
+        items: List[Dict[str, Any]],
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Crear campaas en un nico INSERT multi-fila; devuelve un resultado por elemento"""
+        if len(items) > settings.campaign_bulk_max_items:
+            raise ValueError(f"Mximo {settings.campaign_bulk_max_items} campaas por operacin")
+        
+        results: List[Dict[str, Any]] = [None] * len(items)
+        rows, positions = [], []
+        now = datetime.now()
+        
+        for position, item in enumerate(items):
+            try:
+                values = self._normalize(item, partial=False)
+            except (ValueError, TypeError) as e:
+                results[position] = {"index": position, "success": False, "error": str(e)}
+                continue
+            values.setdefault("status", "draft")
+            values.setdefault("budget", 0.0)
+            rows.append({**values, "id": uuid.uuid4(), "user_id": user_id, "created_at": now, "updated_at": now})
+            positions.append(position)
+        
+        if rows:
+            async with self.db_session() as session:
+                # executemany con RETURNING: una sola ida y vuelta para todo el lote
+                created = await session.execute(
+                    insert(Campaign).returning(Campaign, sort_by_parameter_order=True),
+                    rows
+                )
+                campaigns = created.scalars().all()
+                await session.commit()
+            
+            for position, campaign in zip(positions, campaigns):
+                results[position] = {"index": position, "success": True, "campaign": self.to_dict(campaign)}
+        
+        return results
+    
+    async def update_many(
+        self,
+        updates: List[Dict[str, Any]],
+        user_id: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Actualizar campaas por id en una sola transaccin; devuelve un resultado por elemento"""
+        if len(updates) > settings.campaign_bulk_max_items:
+            raise ValueError(f"Mximo {settings.campaign_bulk_max_items} campaas por operacin")
+        
+        results: List[Dict[str, Any]] = [None] * len(updates)
+        parsed = []
+        for position, item in enumerate(updates):
+            try:
+                campaign_id = uuid.UUID(str(item.get("id") or item.get("campaign_id")))
+                values = self._normalize(item, partial=True)
+                if not values:
+                    raise ValueError("No hay campos para actualizar")
+                parsed.append((position, campaign_id, values))
+            except (ValueError, TypeError) as e:
+                results[position] = {"index": position, "success": False, "error": str(e)}
+        
+        if parsed:
+            async with self.db_session() as session:
+                # Una lectura para validar existencia y propiedad de todo el lote
+                query = select(Campaign.id).where(
+                    Campaign.id.in_([c for _, c, _ in parsed]),
+                    self._owned_by(user_id)
+                )
+                existing = set((await session.execute(query)).scalars().all())
+                
+                now = datetime.now()
+                rows = []
+                for position, campaign_id, values in parsed:
+                    if campaign_id not in existing:
+                        results[position] = {"index": position, "success": False, "error": "Campaa no encontrada"}
+                        continue
+                    rows.append((position, {"id": campaign_id, **values, "updated_at": now}))
+                
+                # UPDATE masivo por clave primaria (executemany agrupado por columnas)
+                if rows:
+                    await session.execute(update(Campaign), [row for _, row in rows])
+                    
+                    changed = {
+                        c.id: c for c in (await session.execute(
+                            select(Campaign).where(Campaign.id.in_([row["id"] for _, row in rows]))
+                        )).scalars()
+                    }
+                    for position, row in rows:
+                        results[position] = {"index": position, "success": True, "campaign": self.to_dict(changed[row["id"]])}
+                
+                await session.commit()
+        
+        return results
+    
+    async def get_many(self, campaign_ids: List[str], user_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Obtener campaas por id"""
+        ids = [uuid.UUID(str(c)) for c in campaign_ids]
+        query = select(Campaign).where(Campaign.id.in_(ids), self._owned_by(user_id))
+        async with self.db_session() as session:
+            return [self.to_dict(c) for c in (await session.execute(query)).scalars()]
+    
+    async def owned_ids(self, user_id: Optional[str]) -> List[str]:
+        """Ids de todas las campaas del usuario (sin usuario: las creadas sin usuario)"""
+        async with self.db_session() as session:
+            return [str(c) for c in (await session.execute(
+                select(Campaign.id).where(self._owned_by(user_id))
+            )).scalars()]
+    
+    async def list_by_user(self, user_id: str, status: Optional[str] = None, limit: int = 1000) -> List[Dict[str, Any]]:
+        """Listar campaas de un usuario"""
+        query = select(Campaign).where(Campaign.user_id == user_id).order_by(Campaign.created_at.desc()).limit(limit)
+        if status:
+            query = query.where(Campaign.status == status)
+        async with self.db_session() as session:
+            return [self.to_dict(c) for c in (await session.execute(query)).scalars()]
+    
+    async def cleanup(self):
+        if self.db_engine:
+            await self.db_engine.dispose()
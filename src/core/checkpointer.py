@@ -0,0 +1,188 @@
+from typing import Dict, Any, List, Optional
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+import time
+
+from src.core.config import settings
+from src.core.serialization import encode_value, decode_value
+
+# Campos de AgentState que producen los nodos; el resto (mensaje, sesin, usuario, contexto,
+# messages) sale del propio request y no se guarda
+CHECKPOINT_FIELDS = (
+    "current_agent",
+    "agent_response",
+    "tools_used",
+    "metadata",
+    "requires_sub_agent",
+    "sub_agent_type",
+    "sub_agent_types",
+    "sub_agent_responses"
+)
+
+# Metadatos propios de cada intento: se conservan los del request en curso al reanudar
+REQUEST_METADATA_FIELDS = ("received_at",)
+
+CHECKPOINT_VERSION = 1
+
+class Checkpoint:
+    """Progreso de un request por el grafo: nodos completados y estado tras el ltimo"""
+    
+    def __init__(self, checkpoint_id: str, completed: Optional[List[str]] = None, state: Optional[Dict[str, Any]] = None):
+        self.checkpoint_id = checkpoint_id
+        self.completed = completed or []
+        self.state = state or {}
+    
+    def is_completed(self, node: str) -> bool:
+        return node in self.completed
+    
+    def restore(self, state: Dict[str, Any]) -> Dict[str, Any]:
+        """Aplicar el estado guardado sobre el del request en curso"""
+        current = state.get("metadata") or {}
+        state.update(self.state)
+        if "metadata" in self.state:
+            state["metadata"] = {
+                **self.state["metadata"],
+                **{field: current[field] for field in REQUEST_METADATA_FIELDS if field in current}
+            }
+        return state
+    
+    def advance(self, node: str, state: Dict[str, Any]):
+        self.completed.append(node)
+        self.state = {field: state[field] for field in CHECKPOINT_FIELDS if field in state}
+
+class BaseCheckpointer(ABC):
+    """Guarda un Checkpoint tras cada nodo para que un reintento contine desde el ltimo
+    
+    El formato es compacto (slo los campos que producen los nodos, en JSON o MessagePack
+    segn REDIS_VALUE_FORMAT) y acotado: un checkpoint mayor que CHECKPOINT_MAX_BYTES no se
+    guarda y el reintento empieza desde el principio. Caducan tras CHECKPOINT_TTL_SECONDS.
+    """
+    
+    backend = "base"
+    
+    def __init__(self):
+        self.stats = {
+            "saved": 0,
+            "resumed": 0,
+            "nodes_skipped": 0,
+            "oversized": 0,
+            "errors": 0,
+            "bytes_last": 0
+        }
+    
+    async def load(self, checkpoint_id: str) -> Checkpoint:
+        """Checkpoint guardado o, si no existe o no se puede leer, uno vaco"""
+        try:
+            data = await self._get(checkpoint_id)
+            if data is not None:
+                payload = decode_value(data)
+                if payload.get("v") == CHECKPOINT_VERSION:
+                    self.stats["resumed"] += 1
+                    return Checkpoint(checkpoint_id, payload["completed"], payload["state"])
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error leyendo checkpoint {checkpoint_id}: {e}")
+        return Checkpoint(checkpoint_id)
+    
+    async def save(self, checkpoint: Checkpoint):
+        try:
+            data = encode_value({"v": CHECKPOINT_VERSION, "completed": checkpoint.completed, "state": checkpoint.state})
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Checkpoint {checkpoint.checkpoint_id} no serializable: {e}")
+            return
+        if len(data) > settings.checkpoint_max_bytes:
+            # Mejor sin checkpoint que uno truncado: se descarta el anterior para no reanudar con l
+            self.stats["oversized"] += 1
+            await self.delete(checkpoint.checkpoint_id)
+            return
+        try:
+            await self._set(checkpoint.checkpoint_id, data)
+            self.stats["saved"] += 1
+            self.stats["bytes_last"] = len(data)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error guardando checkpoint {checkpoint.checkpoint_id}: {e}")
+    
+    async def delete(self, checkpoint_id: str):
+        try:
+            await self._delete(checkpoint_id)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error borrando checkpoint {checkpoint_id}: {e}")
+    
+    @abstractmethod
+    async def _get(self, checkpoint_id: str):
+        """Datos guardados del checkpoint o None"""
+    
+    @abstractmethod
+    async def _set(self, checkpoint_id: str, data: bytes):
+        """Guardar los datos del checkpoint con caducidad CHECKPOINT_TTL_SECONDS"""
+    
+    @abstractmethod
+    async def _delete(self, checkpoint_id: str):
+        """Borrar el checkpoint (sin error si no existe)"""
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, **self.stats}
+
+class InMemoryCheckpointer(BaseCheckpointer):
+    """Checkpoints en el proceso (un nico worker, desarrollo y tests)"""
+    
+    backend = "memory"
+    
+    def __init__(self, max_entries: Optional[int] = None):
+        super().__init__()
+        self.max_entries = max_entries or settings.checkpoint_memory_max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # id -> (datos, expira)
+    
+    async def _get(self, checkpoint_id: str):
+        entry = self._entries.get(checkpoint_id)
+        if entry is None:
+            return None
+        if entry[1] <= time.monotonic():
+            del self._entries[checkpoint_id]
+            return None
+        return entry[0]
+    
+    async def _set(self, checkpoint_id: str, data: bytes):
+        self._entries.pop(checkpoint_id, None)
+        self._entries[checkpoint_id] = (data, time.monotonic() + settings.checkpoint_ttl_seconds)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def _delete(self, checkpoint_id: str):
+        self._entries.pop(checkpoint_id, None)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), "entries": len(self._entries)}
+
+class RedisCheckpointer(BaseCheckpointer):
+    """Checkpoints en Redis: un reintento puede continuar en cualquier worker"""
+    
+    backend = "redis"
+    
+    def __init__(self, redis_client):
+        super().__init__()
+        self.redis_client = redis_client
+    
+    @staticmethod
+    def _key(checkpoint_id: str) -> str:
+        return f"checkpoint:{checkpoint_id}"
+    
+    async def _get(self, checkpoint_id: str):
+        return await self.redis_client.get(self._key(checkpoint_id))
+    
+    async def _set(self, checkpoint_id: str, data: bytes):
+        await self.redis_client.set(self._key(checkpoint_id), data, ex=settings.checkpoint_ttl_seconds)
+    
+    async def _delete(self, checkpoint_id: str):
+        await self.redis_client.delete(self._key(checkpoint_id))
+
+def create_checkpointer(redis_client=None) -> Optional[BaseCheckpointer]:
+    """Checkpointer segn CHECKPOINT_BACKEND ("redis", "memory" o "none")"""
+    if settings.checkpoint_backend == "redis" and redis_client is not None:
+        return RedisCheckpointer(redis_client)
+    if settings.checkpoint_backend in ("redis", "memory"):
+        return InMemoryCheckpointer()
+    return None
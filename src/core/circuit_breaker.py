@@ -0,0 +1,151 @@
+from typing import Dict, Any, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+import time
+
+from src.core.config import settings
+
+class CircuitOpenError(Exception):
+    """El circuito est abierto: la llamada se descarta sin intentarla"""
+
+class CircuitBreaker:
+    """Circuito cerrado/abierto/semiabierto sobre las ltimas BREAKER_WINDOW_SIZE llamadas
+    
+    - closed: las llamadas pasan; se abre si, con al menos BREAKER_MIN_CALLS llamadas en la
+      ventana, la tasa de errores supera BREAKER_FAILURE_RATE o la de llamadas lentas
+      (ms de BREAKER_SLOW_CALL_MS) supera BREAKER_SLOW_CALL_RATE.
+    - open: toda llamada falla al instante con CircuitOpenError durante BREAKER_OPEN_SECONDS.
+    - half_open: se dejan pasar BREAKER_HALF_OPEN_CALLS llamadas de prueba; si todas van bien
+      se cierra, y con el primer fallo vuelve a abrirse.
+    """
+    
+    def __init__(self, name: str):
+        self.name = name
+        self.state = "closed"
+        self._outcomes = deque(maxlen=settings.breaker_window_size)  # (fallida, lenta)
+        self._opened_at = 0.0
+        self._probes_in_flight = 0
+        self._probes_succeeded = 0
+        self.stats = {
+            "calls": 0,
+            "failures": 0,
+            "slow_calls": 0,
+            "short_circuited": 0,
+            "times_opened": 0,
+            "last_opened_at": None
+        }
+    
+    def allow(self) -> bool:
+        """Reservar una llamada; False si el circuito la descarta"""
+        if self.state == "open":
+            if time.monotonic() - self._opened_at < settings.breaker_open_seconds:
+                self.stats["short_circuited"] += 1
+                return False
+            self.state = "half_open"
+            self._probes_in_flight = 0
+            self._probes_succeeded = 0
+        if self.state == "half_open":
+            if self._probes_in_flight + self._probes_succeeded >= settings.breaker_half_open_calls:
+                self.stats["short_circuited"] += 1
+                return False
+            self._probes_in_flight += 1
+        return True
+    
+    def record_success(self, latency_ms: float):
+        slow = latency_ms >= settings.breaker_slow_call_ms
+        self._record(False, slow)
+        if self.state == "half_open":
+            self._probes_in_flight -= 1
+            if slow:
+                self._open()
+                return
+            self._probes_succeeded += 1
+            if self._probes_succeeded >= settings.breaker_half_open_calls:
+                self.state = "closed"
+                self._outcomes.clear()
+            return
+        self._evaluate()
+    
+    def record_failure(self):
+        self._record(True, False)
+        if self.state == "half_open":
+            self._probes_in_flight -= 1
+            self._open()
+            return
+        self._evaluate()
+    
+    def release(self):
+        """Llamada reservada que termin sin resultado (p.ej. cancelada)"""
+        if self.state == "half_open":
+            self._probes_in_flight -= 1
+    
+    @asynccontextmanager
+    async def guard(self):
+        """Ejecutar el bloque a travs del circuito, midiendo su latencia"""
+        if not self.allow():
+            raise CircuitOpenError(f"Circuito {self.name} abierto")
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.record_failure()
+            raise
+        except BaseException:
+            self.release()
+            raise
+        self.record_success((time.perf_counter() - started) * 1000)
+    
+    def _record(self, failed: bool, slow: bool):
+        self._outcomes.append((failed, slow))
+        self.stats["calls"] += 1
+        self.stats["failures"] += failed
+        self.stats["slow_calls"] += slow
+    
+    def _rates(self):
+        total = len(self._outcomes)
+        if not total:
+            return 0.0, 0.0
+        failed = sum(1 for outcome in self._outcomes if outcome[0])
+        slow = sum(1 for outcome in self._outcomes if outcome[1])
+        return failed / total, slow / total
+    
+    def _evaluate(self):
+        if self.state != "closed" or len(self._outcomes) < settings.breaker_min_calls:
+            return
+        failure_rate, slow_rate = self._rates()
+        if failure_rate >= settings.breaker_failure_rate or slow_rate >= settings.breaker_slow_call_rate:
+            self._open()
+    
+    def _open(self):
+        self.state = "open"
+        self._opened_at = time.monotonic()
+        self.stats["times_opened"] += 1
+        self.stats["last_opened_at"] = datetime.now().isoformat()
+        print(f" Circuito {self.name} abierto durante {settings.breaker_open_seconds:g}s")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        failure_rate, slow_rate = self._rates()
+        return {
+            **self.stats,
+            "state": self.state,
+            "window_calls": len(self._outcomes),
+            "failure_rate": round(failure_rate, 3),
+            "slow_call_rate": round(slow_rate, 3)
+        }
+
+# Circuitos de todo el proceso, por nombre ("agent:campaign", "llm:openai:gpt-4"...)
+circuit_breakers: Dict[str, CircuitBreaker] = {}
+
+def get_breaker(name: str) -> CircuitBreaker:
+    breaker = circuit_breakers.get(name)
+    if breaker is None:
+        breaker = circuit_breakers[name] = CircuitBreaker(name)
+    return breaker
+
+def get_breaker_stats(prefix: Optional[str] = None) -> Dict[str, Any]:
+    return {
+        name: breaker.get_stats()
+        for name, breaker in circuit_breakers.items()
+        if prefix is None or name.startswith(prefix)
+    }
@@ -0,0 +1,217 @@
+from typing import Dict, Any, Optional
+import asyncio
+import time
+
+import aioredis
+from sqlalchemy import event, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+
+from src.core.config import settings
+from src.core.semantic_memory import LatencyStats
+
+class PoolMonitor:
+    """Estadsticas de un pool de conexiones: en uso, en espera y latencia de adquisicin"""
+    
+    def __init__(self, name: str, kind: str, max_size: int):
+        self.name = name
+        self.kind = kind
+        self.max_size = max_size
+        self.in_use = 0
+        self.waiting = 0
+        self.max_in_use = 0
+        self.max_waiting = 0
+        self.acquired = 0
+        self.acquire_latency = LatencyStats()
+        self.warmed_up = 0
+        self.size = lambda: None  # Conexiones abiertas (lo rellena cada tipo de pool)
+    
+    def start_wait(self) -> float:
+        self.waiting += 1
+        self.max_waiting = max(self.max_waiting, self.waiting)
+        return time.perf_counter()
+    
+    def end_wait(self, started: float, acquired: bool):
+        self.waiting -= 1
+        if acquired:
+            self.acquired += 1
+            self.acquire_latency.record((time.perf_counter() - started) * 1000)
+        else:
+            self.acquire_latency.timeouts += 1
+    
+    def checked_out(self):
+        self.in_use += 1
+        self.max_in_use = max(self.max_in_use, self.in_use)
+    
+    def checked_in(self):
+        self.in_use = max(self.in_use - 1, 0)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "max_size": self.max_size,
+            "open": self.size(),
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "max_in_use": self.max_in_use,
+            "max_waiting": self.max_waiting,
+            "acquired": self.acquired,
+            "warmed_up": self.warmed_up,
+            "acquire": self.acquire_latency.snapshot()
+        }
+
+# Monitores de todos los pools creados por el proceso (expuestos en /metrics/pools)
+pool_monitors: Dict[str, PoolMonitor] = {}
+
+class MonitoredQueuePool(AsyncAdaptedQueuePool):
+    """Pool de SQLAlchemy que mide la espera por conexin (la subclase por engine fija `monitor`)"""
+    
+    monitor: Optional[PoolMonitor] = None
+    
+    def _do_get(self):
+        started = self.monitor.start_wait()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.monitor.end_wait(started, acquired=False)
+            raise
+        except BaseException:
+            self.monitor.waiting -= 1
+            raise
+        self.monitor.end_wait(started, acquired=True)
+        return connection
+
+def create_database_engine(database_url: Optional[str] = None, name: str = "postgres"):
+    """Engine asncrono con el pool configurado en Settings y monitorizado"""
+    database_url = database_url or settings.database_url
+    if database_url.startswith("sqlite"):
+        # SQLite (tests) usa su propio pool; sin dimensionado ni monitor
+        return create_async_engine(database_url, echo=settings.debug)
+    
+    monitor = PoolMonitor(name, "postgres", settings.db_pool_size + settings.db_max_overflow)
+    # Subclase por engine: el pool se recrea en dispose() y conserva as su monitor
+    pool_class = type(f"MonitoredQueuePool_{name}", (MonitoredQueuePool,), {"monitor": monitor})
+    db_engine = create_async_engine(
+        database_url,
+        echo=settings.debug,
+        poolclass=pool_class,
+        pool_size=settings.db_pool_size,
+        max_overflow=settings.db_max_overflow,
+        pool_timeout=settings.db_pool_timeout_seconds,
+        pool_recycle=settings.db_pool_recycle_seconds,
+        pool_pre_ping=settings.db_pool_pre_ping
+    )
+    monitor.size = lambda: db_engine.sync_engine.pool.checkedin() + db_engine.sync_engine.pool.checkedout()
+    
+    event.listen(db_engine.sync_engine, "checkout", lambda *args: monitor.checked_out())
+    event.listen(db_engine.sync_engine, "checkin", lambda *args: monitor.checked_in())
+    
+    pool_monitors[name] = monitor
+    return db_engine
+
+class MonitoredBlockingConnectionPool(aioredis.BlockingConnectionPool):
+    """Pool de Redis con tamao fijo: espera (hasta `timeout`) en lugar de abrir conexiones sin lmite"""
+    
+    def __init__(self, *args, monitor: Optional[PoolMonitor] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.monitor = monitor
+    
+    async def get_connection(self, command_name, *keys, **options):
+        if self.monitor is None:
+            return await super().get_connection(command_name, *keys, **options)
+        started = self.monitor.start_wait()
+        try:
+            connection = await super().get_connection(command_name, *keys, **options)
+        except aioredis.ConnectionError:
+            self.monitor.end_wait(started, acquired=False)
+            raise
+        except BaseException:
+            self.monitor.waiting -= 1
+            raise
+        self.monitor.end_wait(started, acquired=True)
+        self.monitor.checked_out()
+        return connection
+    
+    async def release(self, connection):
+        if self.monitor is not None:
+            self.monitor.checked_in()
+        await super().release(connection)
+
+def create_redis_client(
+    redis_url: Optional[str] = None,
+    name: str = "redis",
+    decode_responses: bool = True,
+    max_connections: Optional[int] = None
+):
+    """Cliente aioredis sobre un pool bloqueante dimensionado en Settings y monitorizado"""
+    max_connections = max_connections or settings.redis_pool_max_connections
+    monitor = PoolMonitor(name, "redis", max_connections)
+    pool = MonitoredBlockingConnectionPool.from_url(
+        redis_url or settings.redis_url,
+        monitor=monitor,
+        max_connections=max_connections,
+        timeout=settings.redis_pool_timeout_seconds,
+        health_check_interval=settings.redis_health_check_interval_seconds,
+        socket_connect_timeout=settings.redis_socket_connect_timeout_seconds,
+        encoding="utf-8",
+        decode_responses=decode_responses
+    )
+    monitor.size = lambda: len(pool._connections)
+    pool_monitors[name] = monitor
+    return aioredis.Redis(connection_pool=pool)
+
+async def warm_up_database(db_engine, connections: Optional[int] = None) -> int:
+    """Abrir `connections` conexiones a la vez para que queden en el pool antes del primer request"""
+    connections = settings.db_pool_size if connections is None else connections
+    if connections <= 0:
+        return 0
+    ready = asyncio.Event()
+    opened = 0
+    
+    async def _open():
+        nonlocal opened
+        try:
+            async with db_engine.connect() as connection:
+                await connection.execute(text("SELECT 1"))
+                opened += 1
+                if opened == connections:
+                    ready.set()
+                # Retener la conexin hasta que todas estn abiertas: si no, se reutilizara la misma
+                await ready.wait()
+        except Exception:
+            # Un fallo libera al resto: el calentamiento es best-effort
+            ready.set()
+            raise
+    
+    results = await asyncio.gather(*[_open() for _ in range(connections)], return_exceptions=True)
+    ready.set()
+    errors = [r for r in results if isinstance(r, Exception)]
+    if errors:
+        print(f" Calentamiento de PostgreSQL incompleto: {errors[0]}")
+    monitor = getattr(db_engine.sync_engine.pool, "monitor", None)
+    if monitor:
+        monitor.warmed_up = opened
+    return opened
+
+async def warm_up_redis(redis_client, connections: Optional[int] = None) -> int:
+    """Abrir y autenticar `connections` conexiones de Redis y devolverlas al pool"""
+    connections = settings.redis_pool_min_connections if connections is None else connections
+    pool = redis_client.connection_pool
+    acquired = []
+    try:
+        for _ in range(connections):
+            connection = await pool.get_connection("PING")
+            acquired.append(connection)
+            await connection.connect()
+    except Exception as e:
+        print(f" Calentamiento de Redis incompleto: {e}")
+    finally:
+        for connection in acquired:
+            await pool.release(connection)
+    if getattr(pool, "monitor", None):
+        pool.monitor.warmed_up = len(acquired)
+    return len(acquired)
+
+def get_pool_stats() -> Dict[str, Any]:
+    return {name: monitor.get_stats() for name, monitor in pool_monitors.items()}
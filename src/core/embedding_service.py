@@ -0,0 +1,312 @@
+from typing import Dict, Any, List, Optional
+from collections import OrderedDict
+import asyncio
+import dbm
+import hashlib
+import os
+import re
+import threading
+
+import numpy as np
+
+from src.core.config import settings
+
+class OpenAIEmbeddingBackend:
+    """Backend de embeddings del proveedor configurado (una llamada por lote)"""
+    
+    def __init__(self, model: Optional[str] = None):
+        # Import diferido: llm_factory -> shadow_traffic -> request_scheduler -> semantic_memory
+        # -> embedding_service formara un ciclo al importar cualquiera de ellos primero
+        from src.core.llm_factory import LLMFactory
+        self.model = model or settings.embedding_model
+        self.embeddings = LLMFactory.create_embeddings(model=self.model)
+    
+    async def embed_batch(self, texts: List[str]) -> np.ndarray:
+        vectors = await self.embeddings.aembed_documents(texts)
+        return np.asarray(vectors, dtype=np.float32)
+
+class LocalEmbeddingBackend:
+    """Backend local determinista (feature hashing) para desarrollo y tests sin red"""
+    
+    _token_pattern = re.compile(r"\w+", re.UNICODE)
+    
+    def __init__(self, dimensions: Optional[int] = None):
+        self.model = "local-hashing"
+        self.dimensions = dimensions or settings.embedding_dimensions
+    
+    def _embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dimensions, dtype=np.float32)
+        for token in self._token_pattern.findall(text.lower()):
+            digest = hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            sign = 1.0 if value & 1 else -1.0
+            vector[(value >> 1) % self.dimensions] += sign
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+    
+    async def embed_batch(self, texts: List[str]) -> np.ndarray:
+        return np.stack([self._embed(t) for t in texts]) if texts else np.empty((0, self.dimensions), dtype=np.float32)
+
+class MemoryEmbeddingCache:
+    """Cache LRU en proceso"""
+    
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for key in keys:
+            vector = self._entries.get(key)
+            if vector is not None:
+                self._entries.move_to_end(key)
+                found[key] = vector
+        return found
+    
+    async def set_many(self, items: Dict[str, np.ndarray]):
+        for key, vector in items.items():
+            self._entries[key] = vector
+            self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+    
+    async def close(self):
+        self._entries.clear()
+
+class DiskEmbeddingCache:
+    """Cache persistente en disco (dbm) con vectores como bytes crudos float16/float32"""
+    
+    def __init__(self, path: str, dtype: str):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._db = dbm.open(path, "c")
+        # Los backends de dbm no son thread-safe y las lecturas/escrituras van al executor
+        self._lock = threading.Lock()
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        def _read():
+            found = {}
+            with self._lock:
+                for key in keys:
+                    raw = self._db.get(key.encode("utf-8"))
+                    if raw is not None:
+                        found[key] = np.frombuffer(raw, dtype=self.dtype).astype(np.float32)
+            return found
+        return await asyncio.get_running_loop().run_in_executor(None, _read)
+    
+    async def set_many(self, items: Dict[str, np.ndarray]):
+        def _write():
+            with self._lock:
+                for key, vector in items.items():
+                    self._db[key.encode("utf-8")] = np.asarray(vector, dtype=self.dtype).tobytes()
+        await asyncio.get_running_loop().run_in_executor(None, _write)
+    
+    async def close(self):
+        def _close():
+            with self._lock:
+                self._db.close()
+        await asyncio.get_running_loop().run_in_executor(None, _close)
+
+class RedisEmbeddingCache:
+    """Cache compartido en Redis con vectores como bytes crudos float16/float32"""
+    
+    def __init__(self, redis_url: str, dtype: str, ttl_seconds: int):
+        self.dtype = np.dtype(dtype)
+        self.ttl_seconds = ttl_seconds
+        # Importacin diferida: connection_pools depende de semantic_memory, que importa este mdulo
+        from src.core.connection_pools import create_redis_client
+        
+        # Cliente binario: los vectores no son texto
+        self.redis_client = create_redis_client(redis_url, name="redis_embeddings", decode_responses=False)
+    
+    async def get_many(self, keys: List[str]) -> Dict[str, np.ndarray]:
+        if not keys:
+            return {}
+        values = await self.redis_client.mget(keys)
+        return {
+            key: np.frombuffer(raw, dtype=self.dtype).astype(np.float32)
+            for key, raw in zip(keys, values)
+            if raw is not None
+        }
+    
+    async def set_many(self, items: Dict[str, np.ndarray]):
+        if not items:
+            return
+        pipe = self.redis_client.pipeline(transaction=False)
+        for key, vector in items.items():
+            pipe.set(key, np.asarray(vector, dtype=self.dtype).tobytes(), ex=self.ttl_seconds)
+        await pipe.execute()
+    
+    async def close(self):
+        await self.redis_client.close()
+
+class EmbeddingService:
+    """Servicio compartido de embeddings con micro-batching, deduplicacin y cache"""
+    
+    def __init__(
+        self,
+        backend,
+        cache,
+        batch_size: Optional[int] = None,
+        batch_window_ms: Optional[int] = None,
+        dtype: Optional[str] = None
+    ):
+        self.backend = backend
+        self.cache = cache
+        self.batch_size = batch_size or settings.embedding_batch_size
+        self.batch_window = (batch_window_ms if batch_window_ms is not None else settings.embedding_batch_window_ms) / 1000
+        self.dtype = dtype or settings.embedding_cache_dtype
+        self._pending: Dict[str, str] = {}  # key -> texto a la espera del prximo lote
+        self._futures: Dict[str, asyncio.Future] = {}  # key -> resultado pendiente o en vuelo
+        self._flush_handle = None
+        self._tasks = set()
+        self.stats = {
+            "requests": 0,
+            "deduplicated": 0,
+            "cache_hits": 0,
+            "backend_calls": 0,
+            "backend_texts": 0,
+            "batches": 0
+        }
+    
+    def _key(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"emb:{self.backend.model}:{self.dtype}:{digest}"
+    
+    async def embed(self, text: str) -> np.ndarray:
+        """Obtener el embedding de un texto (agrupado con las dems peticiones concurrentes)"""
+        self.stats["requests"] += 1
+        key = self._key(text)
+        
+        future = self._futures.get(key)
+        if future is not None:
+            # Mismo contenido ya pendiente o en vuelo: compartir el resultado
+            self.stats["deduplicated"] += 1
+            return await asyncio.shield(future)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        self._pending[key] = text
+        
+        if len(self._pending) >= self.batch_size:
+            self._schedule_flush(0)
+        elif self._flush_handle is None:
+            self._schedule_flush(self.batch_window)
+        
+        return await asyncio.shield(future)
+    
+    async def embed_many(self, texts: List[str]) -> np.ndarray:
+        """Obtener embeddings de varios textos como matriz (n, dims)"""
+        vectors = await asyncio.gather(*(self.embed(t) for t in texts))
+        return np.stack(vectors) if vectors else np.empty((0, settings.embedding_dimensions), dtype=np.float32)
+    
+    # Interfaz compatible con los embeddings de LangChain
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.embed(text)).tolist()
+    
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return (await self.embed_many(texts)).tolist()
+    
+    def _schedule_flush(self, delay: float):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+        loop = asyncio.get_running_loop()
+        self._flush_handle = loop.call_later(delay, self._start_flush)
+    
+    def _start_flush(self):
+        self._flush_handle = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+        task = asyncio.create_task(self._flush(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    async def _flush(self, batch: Dict[str, str]):
+        """Resolver un lote: una lectura de cache y una llamada al backend para los fallos"""
+        self.stats["batches"] += 1
+        keys = list(batch)
+        try:
+            found = await self.cache.get_many(keys)
+            self.stats["cache_hits"] += len(found)
+            
+            missing = [k for k in keys if k not in found]
+            if missing:
+                vectors = await self.backend.embed_batch([batch[k] for k in missing])
+                self.stats["backend_calls"] += 1
+                self.stats["backend_texts"] += len(missing)
+                computed = {k: vectors[i] for i, k in enumerate(missing)}
+                await self.cache.set_many(computed)
+                found.update(computed)
+            
+            for key in keys:
+                future = self._futures.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_result(np.asarray(found[key], dtype=np.float32))
+        
+        except Exception as e:
+            print(f"Error calculando embeddings: {e}")
+            for key in keys:
+                future = self._futures.pop(key, None)
+                if future is not None and not future.done():
+                    future.set_exception(e)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "backend": self.backend.model,
+            "cache": type(self.cache).__name__,
+            **self.stats,
+            "avg_backend_batch_size": round(self.stats["backend_texts"] / max(self.stats["backend_calls"], 1), 2)
+        }
+    
+    async def cleanup(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._start_flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.cache.close()
+
+def create_embedding_service() -> EmbeddingService:
+    """Crear el servicio de embeddings segn la configuracin"""
+    if settings.embedding_backend == "local":
+        backend = LocalEmbeddingBackend()
+    elif settings.embedding_backend == "openai":
+        backend = OpenAIEmbeddingBackend()
+    else:
+        raise ValueError(f"Backend de embeddings no soportado: {settings.embedding_backend}")
+    
+    if settings.embedding_cache_backend == "redis":
+        cache = RedisEmbeddingCache(
+            settings.redis_url,
+            settings.embedding_cache_dtype,
+            settings.embedding_cache_ttl_hours * 3600
+        )
+    elif settings.embedding_cache_backend == "disk":
+        cache = DiskEmbeddingCache(settings.embedding_cache_path, settings.embedding_cache_dtype)
+    elif settings.embedding_cache_backend == "memory":
+        cache = MemoryEmbeddingCache()
+    else:
+        raise ValueError(f"Cache de embeddings no soportado: {settings.embedding_cache_backend}")
+    
+    return EmbeddingService(backend, cache)
+
+# Instancia compartida por agentes y memoria
+_embedding_service: Optional[EmbeddingService] = None
+
+def get_embedding_service() -> EmbeddingService:
+    """Obtener la instancia compartida del servicio de embeddings"""
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = create_embedding_service()
+    return _embedding_service
+
+async def cleanup_embedding_service():
+    """Cerrar la instancia compartida si fue creada"""
+    global _embedding_service
+    if _embedding_service is not None:
+        await _embedding_service.cleanup()
+        _embedding_service = None
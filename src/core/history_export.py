@@ -0,0 +1,166 @@
+from typing import Dict, Any, Optional, AsyncIterator
+from datetime import datetime
+import asyncio
+import time
+import zlib
+
+from sqlalchemy import select, tuple_
+
+from src.core.config import settings
+from src.core.serialization import dumps
+from src.models.database import ConversationHistory
+
+# Columnas exportadas (mismo formato que los archivos fros de la retencin)
+EXPORT_COLUMNS = (
+    ConversationHistory.id,
+    ConversationHistory.session_id,
+    ConversationHistory.user_id,
+    ConversationHistory.user_message,
+    ConversationHistory.agent_response,
+    ConversationHistory.agent_used,
+    ConversationHistory.metadata_,
+    ConversationHistory.timestamp
+)
+
+def encode_rows(rows) -> bytes:
+    """Filas de EXPORT_COLUMNS en NDJSON"""
+    return b"".join(
+        dumps({
+            "id": str(row.id),
+            "session_id": row.session_id,
+            "user_id": row.user_id,
+            "user_message": row.user_message,
+            "agent_response": row.agent_response,
+            "agent_used": row.agent_used,
+            "metadata": row.metadata_,
+            "timestamp": row.timestamp.isoformat()
+        }) + b"\n"
+        for row in rows
+    )
+
+class HistoryExporter:
+    """Exportacin en streaming de conversation_history a NDJSON (opcionalmente gzip)
+    
+    Las filas se leen por keyset sobre (timestamp, id) en lotes de HISTORY_EXPORT_BATCH_SIZE,
+    cada lote con su propia sesin y transaccin corta, y se codifica y se enva antes de pedir
+    el siguiente: la memoria del worker no depende del nmero de filas exportadas, y una
+    descarga lenta no retiene una conexin ni un snapshot (que bloqueara el DETACH de la
+    retencin). Cada lnea tiene el mismo formato que los archivos fros de la retencin
+    (ver history_retention.py).
+    """
+    
+    def __init__(self, db_session):
+        self.db_session = db_session
+        self.active = 0
+        self.stats = {
+            "started": 0,
+            "completed": 0,
+            "failed": 0,
+            "cancelled": 0,
+            "rows": 0,
+            "bytes": 0,
+            "last_export": None
+        }
+    
+    @staticmethod
+    def _query(
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        agent_used: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None
+    ):
+        query = select(*EXPORT_COLUMNS)
+        if user_id:
+            query = query.where(ConversationHistory.user_id == user_id)
+        if session_id:
+            query = query.where(ConversationHistory.session_id == session_id)
+        if agent_used:
+            query = query.where(ConversationHistory.agent_used == agent_used)
+        # Con rango de fechas slo se leen las particiones mensuales afectadas
+        if start:
+            query = query.where(ConversationHistory.timestamp >= start)
+        if end:
+            query = query.where(ConversationHistory.timestamp < end)
+        return query.order_by(ConversationHistory.timestamp, ConversationHistory.id)
+    
+    async def export(
+        self,
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        agent_used: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+        compress: bool = False
+    ) -> AsyncIterator[bytes]:
+        """Generar el NDJSON por bloques (un bloque por lote de filas)"""
+        if start and end and start >= end:
+            raise ValueError("start debe ser anterior a end")
+        
+        query = self._query(user_id, session_id, agent_used, start, end).limit(settings.history_export_batch_size)
+        # wbits=31: flujo gzip completo (cabecera y CRC), descomprimible con gunzip
+        compressor = zlib.compressobj(settings.response_gzip_level, zlib.DEFLATED, 31) if compress else None
+        
+        async def generate() -> AsyncIterator[bytes]:
+            started = time.perf_counter()
+            rows = 0
+            sent = 0
+            self.active += 1
+            self.stats["started"] += 1
+            try:
+                last = None
+                while True:
+                    page = query
+                    if last is not None:
+                        page = page.where(
+                            tuple_(ConversationHistory.timestamp, ConversationHistory.id) > tuple_(*last)
+                        )
+                    async with self.db_session() as session:
+                        batch = (await session.execute(page)).all()
+                    if not batch:
+                        break
+                    last = (batch[-1].timestamp, batch[-1].id)
+                    
+                    chunk = encode_rows(batch)
+                    if compressor:
+                        # Compresin fuera del event loop: los lotes son de varios MB
+                        chunk = await asyncio.to_thread(compressor.compress, chunk)
+                    rows += len(batch)
+                    if chunk:
+                        sent += len(chunk)
+                        yield chunk
+                    if len(batch) < settings.history_export_batch_size:
+                        break
+                if compressor:
+                    chunk = compressor.flush()
+                    sent += len(chunk)
+                    yield chunk
+                self.stats["completed"] += 1
+            except (asyncio.CancelledError, GeneratorExit):
+                # El cliente cerr la conexin entre lotes: no queda ninguna sesin abierta
+                self.stats["cancelled"] += 1
+                raise
+            except Exception as e:
+                # Las cabeceras ya se enviaron: se corta la respuesta y el cliente la ve incompleta
+                self.stats["failed"] += 1
+                print(f"Error exportando historial tras {rows} filas: {e}")
+                raise
+            finally:
+                self.active -= 1
+                self.stats["rows"] += rows
+                self.stats["bytes"] += sent
+                self.stats["last_export"] = {
+                    "rows": rows,
+                    "bytes": sent,
+                    "compressed": compress,
+                    "duration_ms": round((time.perf_counter() - started) * 1000, 1)
+                }
+        
+        return generate()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "active": self.active,
+            "batch_size": settings.history_export_batch_size
+        }
@@ -0,0 +1,254 @@
+from typing import Dict, Any, List, Tuple
+from datetime import date, datetime
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import re
+
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+
+from src.core.config import settings
+
+# Particiones mensuales creadas por la migracin 004 y por este servicio
+_PARTITION_NAME = re.compile(r"^conversation_history_y(\d{4})m(\d{2})$")
+
+# Clave del advisory lock de sesin: una sola rplica mantiene las particiones a la vez
+RETENTION_LOCK_KEY = 7_410_034
+
+# SQLSTATE lock_not_available: se agot lock_timeout esperando el lock de conversation_history
+_LOCK_NOT_AVAILABLE = "55P03"
+
+def _is_lock_timeout(error: DBAPIError) -> bool:
+    return getattr(error.orig, "sqlstate", None) == _LOCK_NOT_AVAILABLE
+
+def _month_start(value: date, offset: int = 0) -> date:
+    month = value.year * 12 + value.month - 1 + offset
+    return date(month // 12, month % 12 + 1, 1)
+
+def partition_name(month: date) -> str:
+    return f"conversation_history_y{month.year:04d}m{month.month:02d}"
+
+class HistoryRetentionService:
+    """Mantenimiento de particiones de conversation_history: creacin anticipada y archivo en fro"""
+    
+    def __init__(self, db_session):
+        self.db_session = db_session
+        self._task = None
+        self.last_run: Dict[str, Any] = {}
+    
+    async def initialize(self) -> bool:
+        """Arrancar el job peridico (slo si conversation_history ya est particionada, migracin 004)"""
+        async with self.db_session() as session:
+            relkind = (await session.execute(text(
+                "SELECT relkind FROM pg_class WHERE relname = 'conversation_history'"
+            ))).scalar()
+        if relkind != "p":
+            print(" conversation_history no est particionada: retencin desactivada (aplica las migraciones)")
+            return False
+        
+        if settings.history_retention_interval_hours > 0:
+            self._task = asyncio.create_task(self._run_periodically())
+        return True
+    
+    async def _run_periodically(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error en la retencin de historial: {e}")
+            await asyncio.sleep(settings.history_retention_interval_hours * 3600)
+    
+    async def _partitions(self, session) -> List[Tuple[str, date, bool]]:
+        """Particiones mensuales: (nombre, mes, adjunta). Incluye las desacopladas pendientes de archivar"""
+        result = await session.execute(text(
+            "SELECT c.relname, EXISTS (SELECT 1 FROM pg_inherits i WHERE i.inhrelid = c.oid) "
+            "FROM pg_class c "
+            "WHERE c.relname LIKE 'conversation_history\\_y%' AND c.relkind = 'r'"
+        ))
+        partitions = []
+        for name, attached in result:
+            match = _PARTITION_NAME.match(name)
+            if match:
+                partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1), attached))
+        return sorted(partitions, key=lambda p: p[1])
+    
+    async def _set_lock_timeout(self, session):
+        """CREATE ... PARTITION OF y DETACH piden ACCESS EXCLUSIVE sobre conversation_history: sin lmite,
+        la espera encola detrs todas las lecturas y escrituras del historial"""
+        await session.execute(text(f"SET LOCAL lock_timeout = {int(settings.history_lock_timeout_ms)}"))
+    
+    async def ensure_partitions(self) -> List[str]:
+        """Crear las particiones del mes actual y de los siguientes (la DEFAULT debe quedar vaca)"""
+        created = []
+        this_month = _month_start(date.today())
+        async with self.db_session() as session:
+            existing = {name for name, _, _ in await self._partitions(session)}
+        
+        for offset in range(settings.history_partitions_ahead + 1):
+            month = _month_start(this_month, offset)
+            name = partition_name(month)
+            if name in existing:
+                continue
+            # Una transaccin corta por particin; si no se obtiene el lock se reintenta en la prxima ejecucin
+            try:
+                async with self.db_session() as session:
+                    await self._set_lock_timeout(session)
+                    await session.execute(text(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF conversation_history "
+                        f"FOR VALUES FROM ('{month.isoformat()}') TO ('{_month_start(month, 1).isoformat()}')"
+                    ))
+                    await session.commit()
+            except DBAPIError as e:
+                if not _is_lock_timeout(e):
+                    raise
+                print(f" Particin {name} no creada (conversation_history ocupada): se reintentar")
+                break
+            created.append(name)
+        return created
+    
+    async def _archive_partition(self, name: str, month: date) -> Dict[str, Any]:
+        """Exportar una particin desacoplada a NDJSON comprimido (gzip) y verificar el recuento"""
+        archive_dir = os.path.join(settings.history_archive_dir, "conversation_history")
+        os.makedirs(archive_dir, exist_ok=True)
+        path = os.path.join(archive_dir, f"{month.strftime('%Y-%m')}.ndjson.gz")
+        temp_path = f"{path}.tmp"
+        
+        rows = 0
+        digest = hashlib.sha256()
+        archive = gzip.open(temp_path, "wt", encoding="utf-8", compresslevel=settings.history_archive_compression)
+        try:
+            async with self.db_session() as session:
+                stream = await session.stream(
+                    text(
+                        f"SELECT id, session_id, user_id, user_message, agent_response, agent_used, metadata, timestamp "
+                        f"FROM {name} ORDER BY timestamp"
+                    ).execution_options(yield_per=settings.history_archive_batch_size)
+                )
+                async for batch in stream.partitions():
+                    lines = "".join(
+                        json.dumps({
+                            "id": str(row.id),
+                            "session_id": row.session_id,
+                            "user_id": row.user_id,
+                            "user_message": row.user_message,
+                            "agent_response": row.agent_response,
+                            "agent_used": row.agent_used,
+                            "metadata": row.metadata,
+                            "timestamp": row.timestamp.isoformat()
+                        }, ensure_ascii=False) + "\n"
+                        for row in batch
+                    )
+                    digest.update(lines.encode("utf-8"))
+                    # Compresin y escritura fuera del event loop
+                    await asyncio.to_thread(archive.write, lines)
+                    rows += len(batch)
+                
+                expected = (await session.execute(text(f"SELECT count(*) FROM {name}"))).scalar()
+        finally:
+            await asyncio.to_thread(archive.close)
+        
+        if rows != expected:
+            os.remove(temp_path)
+            raise RuntimeError(f"Archivo incompleto de {name}: {rows} de {expected} filas")
+        
+        os.replace(temp_path, path)
+        manifest = {
+            "partition": name,
+            "month": month.strftime("%Y-%m"),
+            "rows": rows,
+            "sha256": digest.hexdigest(),
+            "file": os.path.basename(path),
+            "bytes": os.path.getsize(path),
+            "archived_at": datetime.now().isoformat()
+        }
+        with open(f"{path}.manifest.json", "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        return manifest
+    
+    async def archive_expired(self) -> List[Dict[str, Any]]:
+        """Desacoplar, archivar y eliminar las particiones ms antiguas que la retencin"""
+        if settings.history_retention_months <= 0:
+            return []
+        
+        cutoff = _month_start(date.today(), -settings.history_retention_months)
+        async with self.db_session() as session:
+            expired = [p for p in await self._partitions(session) if p[1] < cutoff]
+        
+        archived = []
+        for name, month, attached in expired:
+            # DETACH primero: la particin deja de ser visible para las lecturas y escrituras en caliente.
+            # Si un archivo anterior fall, la tabla ya est desacoplada y se reintenta slo el archivo.
+            # DETACH ... CONCURRENTLY no est permitido con particin DEFAULT (migracin 004), as que el
+            # DETACH normal se acota con lock_timeout y, si no obtiene el lock, se deja para la prxima ejecucin.
+            if attached:
+                try:
+                    async with self.db_session() as session:
+                        await self._set_lock_timeout(session)
+                        await session.execute(text(f"ALTER TABLE conversation_history DETACH PARTITION {name}"))
+                        await session.commit()
+                except DBAPIError as e:
+                    if not _is_lock_timeout(e):
+                        raise
+                    print(f" Particin {name} no desacoplada (conversation_history ocupada): se reintentar")
+                    break
+            
+            manifest = await self._archive_partition(name, month)
+            
+            async with self.db_session() as session:
+                await session.execute(text(f"DROP TABLE {name}"))
+                await session.commit()
+            
+            archived.append(manifest)
+            print(f" Particin {name} archivada: {manifest['rows']} filas, {manifest['bytes']} bytes")
+        return archived
+    
+    async def run_once(self) -> Dict[str, Any]:
+        """Una ejecucin de mantenimiento, slo en la rplica que obtiene el advisory lock"""
+        started = datetime.now()
+        async with self.db_session() as lock_session:
+            # Lock de sesin sobre una conexin en autocommit: se mantiene durante toda la ejecucin
+            # sin dejar una transaccin abierta mientras se archiva
+            connection = await lock_session.connection(execution_options={"isolation_level": "AUTOCOMMIT"})
+            locked = (await connection.execute(
+                text("SELECT pg_try_advisory_lock(:key)"), {"key": RETENTION_LOCK_KEY}
+            )).scalar()
+            if not locked:
+                self.last_run = {"skipped": "otra rplica est ejecutando la retencin", "started_at": started.isoformat()}
+                return self.last_run
+            try:
+                created = await self.ensure_partitions()
+                archived = await self.archive_expired()
+            finally:
+                await connection.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RETENTION_LOCK_KEY})
+        
+        self.last_run = {
+            "created_partitions": created,
+            "archived_partitions": [m["partition"] for m in archived],
+            "archived_rows": sum(m["rows"] for m in archived),
+            "duration_ms": round((datetime.now() - started).total_seconds() * 1000, 1)
+        }
+        return self.last_run
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        async with self.db_session() as session:
+            partitions = [p for p in await self._partitions(session) if p[2]]
+        return {
+            "partitions": len(partitions),
+            "oldest_month": partitions[0][1].strftime("%Y-%m") if partitions else None,
+            "newest_month": partitions[-1][1].strftime("%Y-%m") if partitions else None,
+            "retention_months": settings.history_retention_months,
+            "last_run": self.last_run
+        }
+    
+    async def cleanup(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
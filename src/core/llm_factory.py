@@ -1,18 +1,138 @@
-from typing import Optional
-from langchain_openai import ChatOpenAI
-from langchain_community.llms import Ollama
-from langchain_community.chat_models import ChatAnthropic
+from typing import Optional, Callable
+import time
 
 from src.core.config import settings
+from src.core.token_accounting import token_accounting
+from src.core.circuit_breaker import get_breaker
+from src.core.shadow_traffic import shadow_traffic
+from src.core.structured_output import native_json_kwargs
+
+class AccountedLLM:
+    """LLM con contabilidad de tokens, degradacin por presupuesto y circuit breaker
+    
+    Cada `ainvoke` registra el uso que informa el proveedor (ver token_accounting) y pasa por
+    el circuito del backend (`llm:{proveedor}:{modelo}`): con el circuito abierto falla al
+    instante con CircuitOpenError. Si el request en curso est degradado por cuota agotada,
+    la llamada se hace con el modelo de TOKEN_BUDGET_FALLBACK_MODEL, creado la primera vez
+    que se necesita. En los requests muestreados por el trfico sombra, cada llamada
+    terminada se repite en background contra el modelo sombra (ver shadow_traffic).
+    Con `json_mode=True` se pide el modo JSON nativo del backend elegido, si lo tiene.
+    """
+    
+    def __init__(
+        self,
+        llm,
+        backend: str,
+        fallback_factory: Optional[Callable[[], object]] = None,
+        fallback_backend: Optional[str] = None
+    ):
+        self.llm = llm
+        self.backend = backend
+        self._fallback_factory = fallback_factory
+        self._fallback_backend = fallback_backend
+        self._fallback = None
+    
+    def _select(self):
+        usage = token_accounting.current()
+        if usage is not None and usage.downgraded and self._fallback_factory:
+            if self._fallback is None:
+                self._fallback = self._fallback_factory()
+            return self._fallback, self._fallback_backend
+        return self.llm, self.backend
+    
+    @staticmethod
+    def _config(config, capture):
+        config = dict(config or {})
+        config["callbacks"] = [*(config.get("callbacks") or []), token_accounting.callback]
+        if capture:
+            config["callbacks"].append(capture)
+        return config
+    
+    async def ainvoke(self, input, config=None, json_mode: bool = False, **kwargs):
+        capture = shadow_traffic.capture()
+        config = self._config(config, capture)
+        llm, backend = self._select()
+        options = dict(kwargs)
+        if json_mode:
+            kwargs.update(native_json_kwargs(backend))
+        started = time.perf_counter()
+        async with get_breaker(f"llm:{backend}").guard():
+            response = await llm.ainvoke(input, config=config, **kwargs)
+        if capture:
+            shadow_traffic.mirror(
+                input, capture, (time.perf_counter() - started) * 1000,
+                getattr(response, "content", response), json_mode, options
+            )
+        return response
+    
+    async def astream(self, input, config=None, json_mode: bool = False, **kwargs):
+        """Streaming de tokens con la misma contabilidad, circuito y trfico sombra que `ainvoke`"""
+        capture = shadow_traffic.capture()
+        config = self._config(config, capture)
+        llm, backend = self._select()
+        options = dict(kwargs)
+        if json_mode:
+            kwargs.update(native_json_kwargs(backend))
+        parts = []
+        closed_early = False
+        started = time.perf_counter()
+        stream = llm.astream(input, config=config, **kwargs)
+        async with get_breaker(f"llm:{backend}").guard():
+            try:
+                async for chunk in stream:
+                    if capture:
+                        parts.append(chunk.content)
+                    try:
+                        yield chunk
+                    except GeneratorExit:
+                        # El consumidor cort el stream tras recibir al menos un chunk (p.ej. la
+                        # salida anticipada de astream_json): la llamada funcion y el circuito
+                        # la cuenta como xito en lugar de liberarla sin resultado
+                        closed_early = True
+                        break
+            finally:
+                # Cerrar el stream del modelo ya: si el consumidor lo corta (aclose), su callback
+                # on_llm_error registra el uso consumido en este request y no al recogerlo el GC
+                await stream.aclose()
+        if capture:
+            # Tambin los streams cortados (intencin, decisin de herramientas): con el prompt y
+            # las opciones de la llamada y el uso estimado hasta el corte
+            shadow_traffic.mirror(
+                input, capture, (time.perf_counter() - started) * 1000,
+                "".join(parts), json_mode, options, truncated=closed_early
+            )
+    
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
 
 class LLMFactory:
     """Factory para crear instancias de LLM"""
     
     @staticmethod
-    def create_llm(provider: str = "openai", model: str = "gpt-4", **kwargs):
-        """Crear instancia de LLM segn el proveedor"""
+    def create_llm(provider: Optional[str] = None, model: Optional[str] = None, **kwargs):
+        """Crear instancia de LLM segn el proveedor, con contabilidad de tokens
+        
+        Sin argumentos se usa DEFAULT_LLM_PROVIDER con DEFAULT_MODEL (OLLAMA_MODEL para ollama).
+        """
+        provider = provider or settings.default_llm_provider
+        model = model or (settings.ollama_model if provider == "ollama" else settings.default_model)
+        llm = LLMFactory._create_llm(provider, model, **kwargs)
+        if provider == "ollama":
+            return AccountedLLM(llm, f"ollama:{model}")
         
+        fallback_model = settings.token_budget_fallback_model
+        fallback_factory = None
+        if fallback_model and fallback_model != model:
+            fallback_factory = lambda: LLMFactory._create_llm(provider, fallback_model, **kwargs)
+        return AccountedLLM(llm, f"{provider}:{model}", fallback_factory, f"{provider}:{fallback_model}")
+    
+    @staticmethod
+    def _create_llm(provider: str, model: str, **kwargs):
+        # Las integraciones se importan al seleccionar el proveedor: importar
+        # los tres SDKs en cada arranque domina el cold start de los pods
         if provider == "openai":
+            from langchain_openai import ChatOpenAI
+            
             return ChatOpenAI(
                 model=model,
                 api_key=settings.openai_api_key,
@@ -21,6 +141,8 @@ class LLMFactory:
             )
         
         elif provider == "anthropic":
+            from langchain_community.chat_models import ChatAnthropic
+            
             return ChatAnthropic(
                 model=model,
                 api_key=settings.anthropic_api_key,
@@ -29,15 +151,31 @@ class LLMFactory:
             )
         
         elif provider == "ollama":
-            return Ollama(
-                model=settings.ollama_model,
+            from src.core.ollama_chat import ChatOllamaLocal
+            
+            return ChatOllamaLocal(
+                model=model,
                 base_url=settings.ollama_base_url,
+                keep_alive=settings.ollama_keep_alive,
+                num_ctx=settings.ollama_num_ctx,
+                temperature=0.7,
                 **kwargs
             )
         
         else:
             raise ValueError(f"Proveedor LLM no soportado: {provider}")
     
+    @staticmethod
+    def create_embeddings(model: Optional[str] = None, **kwargs):
+        """Crear modelo de embeddings"""
+        from langchain_openai import OpenAIEmbeddings
+        
+        return OpenAIEmbeddings(
+            model=model or settings.embedding_model,
+            api_key=settings.openai_api_key,
+            **kwargs
+        )
+    
     @staticmethod
     def get_available_providers() -> list:
         """Obtener lista de proveedores disponibles"""
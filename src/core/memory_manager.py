@@ -1,38 +1,53 @@
 from typing import Dict, Any, List, Optional
 from datetime import datetime, timedelta
-import json
 import asyncio
-import aioredis
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy import select, delete
 
 from src.core.config import settings
-from src.models.database import ConversationHistory, SessionMemory
+from src.core.connection_pools import create_database_engine, create_redis_client, warm_up_database, warm_up_redis
+from src.core.semantic_memory import SemanticMemory
+from src.core.usage_rollups import usage_rollups
+from src.core.token_accounting import token_accounting
+from src.core.migrations import MigrationRunner
+from src.core.history_retention import HistoryRetentionService
+from src.core.history_export import HistoryExporter
+from src.core.session_purge import SessionPurgeWorker
+from src.core.session_store import TieredSessionStore
+from src.core.session_cache import SessionCache
+from src.core.serialization import encode_value
+from src.models.database import ConversationHistory
 
 class MemoryManager:
     """Gestor de memoria para conversaciones y sesiones"""
     
     def __init__(self):
         self.redis_client = None
+        self.redis_values = None
         self.db_engine = None
         self.db_session = None
+        self.semantic_memory = None
+        self.history_retention = None
+        self.history_export = None
+        self.session_purge = None
+        self.session_store = None
+        self.session_cache = None
         
     async def initialize(self):
         """Inicializar conexiones a Redis y PostgreSQL"""
         try:
-            # Conexin a Redis
-            self.redis_client = aioredis.from_url(
-                settings.redis_url,
-                encoding="utf-8",
-                decode_responses=True
-            )
+            # Conexin a Redis (pool bloqueante dimensionado y monitorizado)
+            self.redis_client = create_redis_client(settings.redis_url, name="redis")
             
-            # Conexin a PostgreSQL
-            self.db_engine = create_async_engine(
-                settings.database_url,
-                echo=settings.debug
-            )
+            # Valores en MessagePack: requieren un cliente que no decodifique las respuestas
+            if settings.redis_value_format == "msgpack":
+                self.redis_values = create_redis_client(settings.redis_url, name="redis_values", decode_responses=False)
+            else:
+                self.redis_values = self.redis_client
+            
+            # Conexin a PostgreSQL (pool dimensionado y monitorizado)
+            self.db_engine = create_database_engine(settings.database_url, name="postgres")
             
             self.db_session = sessionmaker(
                 self.db_engine,
@@ -40,6 +55,55 @@ class MemoryManager:
                 expire_on_commit=False
             )
             
+            # Abrir el mnimo de los pools antes del primer request
+            if settings.pool_warmup:
+                opened = await asyncio.gather(
+                    warm_up_database(self.db_engine),
+                    warm_up_redis(self.redis_client)
+                )
+                print(f" Pools calentados: {opened[0]} conexiones PostgreSQL, {opened[1]} Redis")
+            
+            # Esquema de historial (ndices, JSONB, particionado mensual)
+            if settings.run_migrations_on_startup:
+                await MigrationRunner(self.db_engine).upgrade()
+            
+            # Creacin de particiones futuras y archivo en fro de las antiguas
+            self.history_retention = HistoryRetentionService(self.db_session)
+            if not await self.history_retention.initialize():
+                self.history_retention = None
+            
+            # Exportacin en streaming del historial (cursor de servidor)
+            self.history_export = HistoryExporter(self.db_session)
+            
+            # Memoria de sesin: Redis (caliente) + session_memory (fra, durable)
+            self.session_store = TieredSessionStore(self.redis_values, self.db_session)
+            await self.session_store.initialize()
+            
+            # Copia en proceso de las sesiones calientes, invalidada entre workers por pub/sub
+            if settings.session_cache_enabled:
+                self.session_cache = SessionCache(self.redis_client)
+                await self.session_cache.initialize()
+            
+            # Purgas masivas de sesiones en background, con ritmo limitado
+            self.session_purge = SessionPurgeWorker(self.redis_values, self.db_session, self.session_cache)
+            await self.session_purge.initialize()
+            
+            # Rollups de uso sobre conversation_history
+            await usage_rollups.initialize(self.db_session)
+            
+            # Contabilidad de tokens y presupuestos por usuario
+            await token_accounting.initialize(self.redis_client, self.db_session)
+            
+            # Memoria semntica a largo plazo
+            if settings.semantic_memory_enabled:
+                semantic_memory = SemanticMemory(self.db_session)
+                try:
+                    await semantic_memory.initialize()
+                    self.semantic_memory = semantic_memory
+                except Exception as e:
+                    # Sin pgvector o sin backend de embeddings se sigue sin contexto histrico
+                    print(f" Memoria semntica desactivada: {e}")
+            
             print(" Memory Manager inicializado")
             
         except Exception as e:
@@ -52,22 +116,35 @@ class MemoryManager:
         user_message: str,
         agent_response: str,
         agent_used: str,
-        metadata: Optional[Dict[str, Any]] = None
+        metadata: Optional[Dict[str, Any]] = None,
+        user_id: Optional[str] = None
     ):
         """Guardar conversacin en base de datos"""
         try:
             async with self.db_session() as session:
                 conversation = ConversationHistory(
                     session_id=session_id,
+                    user_id=user_id,
                     user_message=user_message,
                     agent_response=agent_response,
                     agent_used=agent_used,
-                    metadata=metadata or {},
+                    metadata_=metadata or {},
                     timestamp=datetime.now()
                 )
                 
                 session.add(conversation)
                 await session.commit()
+            
+            # Indexar el turno para recuperacin semntica por usuario
+            if self.semantic_memory and user_id:
+                self.semantic_memory.schedule_add_turn(
+                    conversation_id=str(conversation.id),
+                    session_id=session_id,
+                    user_id=user_id,
+                    user_message=user_message,
+                    agent_response=agent_response,
+                    timestamp=conversation.timestamp
+                )
                 
             # Tambin guardar en Redis para acceso rpido
             await self._cache_conversation(session_id, {
@@ -104,7 +181,7 @@ class MemoryManager:
                         "agent_response": conv.agent_response,
                         "agent_used": conv.agent_used,
                         "timestamp": conv.timestamp.isoformat(),
-                        "metadata": conv.metadata
+                        "metadata": conv.metadata_
                     }
                     for conv in reversed(conversations)
                 ]
@@ -113,29 +190,47 @@ class MemoryManager:
             print(f"Error obteniendo historial: {e}")
             return []
     
-    async def get_session_memory(self, session_id: str) -> Dict[str, Any]:
-        """Obtener memoria de sesin desde Redis"""
+    async def get_relevant_history(
+        self,
+        user_id: str,
+        query: str,
+        top_k: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Obtener intercambios pasados del usuario relevantes para la consulta"""
+        if not self.semantic_memory or not user_id:
+            return []
+        return await self.semantic_memory.search(user_id, query, top_k)
+    
+    async def get_session_memory(self, session_id: str, user_id: Optional[str] = None) -> Dict[str, Any]:
+        """Obtener memoria de sesin (cache en proceso, Redis y, si expir, PostgreSQL)
+        
+        Con `user_id`, la sesin queda asociada al usuario (session_memory.user_id y los cambios
+        pendientes de volcado), que es como la encuentra la purga por usuario.
+        """
         try:
-            memory_key = f"session:{session_id}:memory"
-            memory_data = await self.redis_client.get(memory_key)
+            if self.session_cache:
+                memory = await self.session_cache.get(session_id, lambda: self.session_store.get(session_id))
+            else:
+                memory = await self.session_store.get(session_id)
             
-            if memory_data:
-                return json.loads(memory_data)
+            if memory:
+                if user_id and not memory.get("user_id"):
+                    # Sesin creada antes de conocer al usuario
+                    memory = {**memory, "user_id": user_id}
+                    await self._put_session(session_id, memory)
+                return memory
             else:
                 # Crear nueva memoria de sesin
                 new_memory = {
                     "session_id": session_id,
+                    "user_id": user_id,
                     "created_at": datetime.now().isoformat(),
                     "last_activity": datetime.now().isoformat(),
                     "context": {},
                     "preferences": {}
                 }
                 
-                await self.redis_client.setex(
-                    memory_key,
-                    timedelta(minutes=settings.session_timeout_minutes),
-                    json.dumps(new_memory)
-                )
+                await self._put_session(session_id, new_memory)
                 
                 return new_memory
                 
@@ -154,12 +249,7 @@ class MemoryManager:
             memory.update(updates)
             memory["last_activity"] = datetime.now().isoformat()
             
-            memory_key = f"session:{session_id}:memory"
-            await self.redis_client.setex(
-                memory_key,
-                timedelta(minutes=settings.session_timeout_minutes),
-                json.dumps(memory)
-            )
+            await self._put_session(session_id, memory)
             
         except Exception as e:
             print(f"Error actualizando memoria de sesin: {e}")
@@ -167,12 +257,10 @@ class MemoryManager:
     async def clear_session(self, session_id: str):
         """Limpiar sesin de Redis y base de datos"""
         try:
-            # Limpiar de Redis
-            memory_key = f"session:{session_id}:memory"
-            cache_key = f"session:{session_id}:cache"
-            
-            await self.redis_client.delete(memory_key)
-            await self.redis_client.delete(cache_key)
+            # Limpiar memoria de sesin (Redis y session_memory) y cache de Redis: un nico UNLINK
+            await self.session_store.delete(session_id, extra_keys=[TieredSessionStore.cache_key(session_id)])
+            if self.session_cache:
+                await self.session_cache.invalidate(session_id)
             
             # Opcionalmente limpiar de base de datos
             # (comentado para preservar historial)
@@ -186,25 +274,25 @@ class MemoryManager:
         except Exception as e:
             print(f"Error limpiando sesin: {e}")
     
+    async def _put_session(self, session_id: str, memory: Dict[str, Any]):
+        await self.session_store.put(session_id, memory)
+        if self.session_cache:
+            await self.session_cache.put(session_id, memory)
+    
     async def _cache_conversation(self, session_id: str, conversation: Dict[str, Any]):
         """Cachear conversacin en Redis para acceso rpido"""
         try:
-            cache_key = f"session:{session_id}:cache"
-            
-            # Obtener cache existente
-            cached_conversations = await self.redis_client.lrange(cache_key, 0, -1)
-            
-            # Agregar nueva conversacin
-            await self.redis_client.lpush(cache_key, json.dumps(conversation))
-            
-            # Mantener solo las ltimas 20 conversaciones en cache
-            await self.redis_client.ltrim(cache_key, 0, 19)
+            cache_key = TieredSessionStore.cache_key(session_id)
             
-            # Establecer expiracin
-            await self.redis_client.expire(
-                cache_key, 
-                timedelta(minutes=settings.session_timeout_minutes)
-            )
+            # Agregar, recortar y renovar la expiracin en un solo round-trip
+            async with self.redis_values.pipeline(transaction=False) as pipe:
+                pipe.lpush(cache_key, encode_value(conversation))
+                
+                # Mantener solo las ltimas 20 conversaciones en cache
+                pipe.ltrim(cache_key, 0, 19)
+                
+                pipe.expire(cache_key, timedelta(minutes=settings.session_timeout_minutes))
+                await pipe.execute()
             
         except Exception as e:
             print(f"Error cacheando conversacin: {e}")
@@ -228,6 +316,28 @@ class MemoryManager:
     async def cleanup(self):
         """Limpieza de conexiones"""
         try:
+            await usage_rollups.cleanup()
+            await token_accounting.cleanup()
+            
+            if self.history_retention:
+                await self.history_retention.cleanup()
+            
+            if self.session_purge:
+                await self.session_purge.cleanup()
+            
+            if self.session_cache:
+                await self.session_cache.cleanup()
+            
+            # Antes de cerrar Redis: volcar las sesiones pendientes
+            if self.session_store:
+                await self.session_store.cleanup()
+            
+            if self.semantic_memory:
+                await self.semantic_memory.cleanup()
+            
+            if self.redis_values and self.redis_values is not self.redis_client:
+                await self.redis_values.close()
+            
             if self.redis_client:
                 await self.redis_client.close()
             
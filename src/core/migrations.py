@@ -0,0 +1,126 @@
+from typing import List, Optional, Tuple
+from datetime import datetime
+import asyncio
+import os
+import re
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.core.config import settings
+
+# Directorio de migraciones SQL numeradas (NNN_descripcion.sql)
+MIGRATIONS_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "migrations")
+
+_MIGRATION_NAME = re.compile(r"^(\d+)_[\w-]+\.sql$")
+
+# Sentencia que se repite (una transaccin por ejecucin) hasta que no afecta a ninguna fila: copias por lotes.
+# Slo en migraciones `-- migrate: no-transaction`
+REPEAT_DIRECTIVE = "-- migrate: repeat"
+
+def split_statements(sql: str) -> List[str]:
+    """Separar un script en sentencias por ';' de fin de lnea, respetando bloques $$ ... $$"""
+    statements, current, in_dollar = [], [], False
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not current and (not stripped or stripped.startswith("--")) and stripped != REPEAT_DIRECTIVE:
+            continue
+        current.append(line)
+        if line.count("$$") % 2 == 1:
+            in_dollar = not in_dollar
+        if not in_dollar and stripped.endswith(";"):
+            statements.append("\n".join(current).rstrip().rstrip(";"))
+            current = []
+    if current and "\n".join(current).strip():
+        statements.append("\n".join(current).strip().rstrip(";"))
+    return statements
+
+def load_migrations(directory: Optional[str] = None) -> List[Tuple[int, str, str]]:
+    """Migraciones disponibles ordenadas: (versin, nombre, sql)"""
+    directory = directory or MIGRATIONS_DIR
+    migrations = []
+    for name in sorted(os.listdir(directory)):
+        match = _MIGRATION_NAME.match(name)
+        if match:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                migrations.append((int(match.group(1)), name, f.read()))
+    return sorted(migrations)
+
+class MigrationRunner:
+    """Aplicar migraciones SQL pendientes y registrarlas en schema_migrations"""
+    
+    def __init__(self, db_engine, directory: Optional[str] = None):
+        self.db_engine = db_engine
+        self.directory = directory
+    
+    async def _applied_versions(self) -> set:
+        async with self.db_engine.begin() as connection:
+            await connection.execute(text(
+                "CREATE TABLE IF NOT EXISTS schema_migrations ("
+                "version INTEGER PRIMARY KEY, name VARCHAR(255) NOT NULL, applied_at TIMESTAMP NOT NULL)"
+            ))
+            result = await connection.execute(text("SELECT version FROM schema_migrations"))
+            return {row[0] for row in result}
+    
+    async def _record(self, connection, version: int, name: str):
+        await connection.execute(
+            text("INSERT INTO schema_migrations (version, name, applied_at) VALUES (:version, :name, :applied_at)"),
+            {"version": version, "name": name, "applied_at": datetime.now()}
+        )
+    
+    async def pending(self) -> List[Tuple[int, str, str]]:
+        applied = await self._applied_versions()
+        return [m for m in load_migrations(self.directory) if m[0] not in applied]
+    
+    async def _repeat(self, connection, statement: str):
+        """Ejecutar un lote tras otro en autocommit: cada lote confirma y libera sus locks"""
+        batches = 0
+        while True:
+            result = await connection.exec_driver_sql(statement)
+            if not result.rowcount:
+                break
+            batches += 1
+            if batches % 100 == 0:
+                print(f" Migracin: {batches} lotes aplicados")
+    
+    async def upgrade(self, target: Optional[int] = None) -> List[str]:
+        """Aplicar en orden las migraciones pendientes (hasta `target` si se indica)"""
+        applied = []
+        for version, name, sql in await self.pending():
+            if target is not None and version > target:
+                break
+            
+            started = datetime.now()
+            statements = split_statements(sql)
+            if "-- migrate: no-transaction" in sql:
+                # CREATE/DROP INDEX CONCURRENTLY no puede ejecutarse dentro de una transaccin
+                async with self.db_engine.connect() as connection:
+                    connection = await connection.execution_options(isolation_level="AUTOCOMMIT")
+                    for statement in statements:
+                        if statement.startswith(REPEAT_DIRECTIVE):
+                            await self._repeat(connection, statement)
+                        else:
+                            await connection.exec_driver_sql(statement)
+                    await self._record(connection, version, name)
+            else:
+                async with self.db_engine.begin() as connection:
+                    for statement in statements:
+                        await connection.exec_driver_sql(statement)
+                    await self._record(connection, version, name)
+            
+            applied.append(name)
+            print(f" Migracin aplicada: {name} ({(datetime.now() - started).total_seconds():.1f}s)")
+        return applied
+
+async def run_migrations(database_url: Optional[str] = None, target: Optional[int] = None) -> List[str]:
+    """Aplicar migraciones con un engine propio (CLI, despliegues y benchmarks)"""
+    db_engine = create_async_engine(database_url or settings.database_url, echo=settings.debug)
+    try:
+        return await MigrationRunner(db_engine).upgrade(target)
+    finally:
+        await db_engine.dispose()
+
+if __name__ == "__main__":
+    # python -m src.core.migrations [versin_objetivo]
+    import sys
+    asyncio.run(run_migrations(target=int(sys.argv[1]) if len(sys.argv) > 1 else None))
@@ -0,0 +1,203 @@
+from typing import Dict, Any, List, Optional, AsyncIterator, Iterator
+from contextlib import asynccontextmanager
+import asyncio
+import json
+import time
+
+import httpx
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, SystemMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from src.core.config import settings
+from src.core.semantic_memory import LatencyStats
+
+# Campos de la respuesta de /api/chat que se conservan en generation_info (uso y tiempos)
+USAGE_FIELDS = ("model", "prompt_eval_count", "eval_count", "total_duration", "load_duration", "eval_duration")
+
+class OllamaServer:
+    """Conexin compartida con un servidor Ollama: cliente HTTP y lmite de concurrencia
+    
+    Todos los LLM que apuntan al mismo servidor comparten el semforo: como mximo
+    OLLAMA_MAX_CONCURRENCY peticiones a la vez (el OLLAMA_NUM_PARALLEL del servidor). El
+    resto espera aqu en lugar de encolarse en el servidor, donde no se puede medir.
+    """
+    
+    def __init__(self, base_url: str):
+        self.base_url = base_url.rstrip("/")
+        self.max_concurrency = settings.ollama_max_concurrency
+        self.client = httpx.AsyncClient(
+            base_url=self.base_url,
+            timeout=httpx.Timeout(settings.ollama_request_timeout_seconds, connect=5.0),
+            limits=httpx.Limits(max_connections=self.max_concurrency, max_keepalive_connections=self.max_concurrency)
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+        self.warm_models: Dict[str, float] = {}  # modelo -> segundos de carga
+        self.latency = LatencyStats()
+        self.queue_time = LatencyStats()
+    
+    @asynccontextmanager
+    async def slot(self):
+        started = time.perf_counter()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.queue_time.record((time.perf_counter() - started) * 1000)
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.latency.errors += 1
+            raise
+        finally:
+            self.in_flight -= 1
+            self._semaphore.release()
+        self.latency.record((time.perf_counter() - started) * 1000)
+    
+    async def warm_up(self, model: str):
+        """Cargar el modelo en memoria (un chat sin mensajes) para que la primera peticin no pague la carga"""
+        started = time.perf_counter()
+        response = await self.client.post(
+            "/api/chat",
+            json={"model": model, "messages": [], "keep_alive": settings.ollama_keep_alive}
+        )
+        response.raise_for_status()
+        self.warm_models[model] = round(time.perf_counter() - started, 3)
+        print(f" Modelo local {model} cargado en {self.warm_models[model]:.1f}s")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "warm_models": self.warm_models,
+            "latency": self.latency.snapshot(),
+            "queue_time": self.queue_time.snapshot()
+        }
+
+# Servidores Ollama en uso, por URL
+_servers: Dict[str, OllamaServer] = {}
+
+def get_ollama_server(base_url: Optional[str] = None) -> OllamaServer:
+    base_url = (base_url or settings.ollama_base_url).rstrip("/")
+    server = _servers.get(base_url)
+    if server is None:
+        server = _servers[base_url] = OllamaServer(base_url)
+    return server
+
+def get_ollama_stats() -> Dict[str, Any]:
+    return {base_url: server.get_stats() for base_url, server in _servers.items()}
+
+async def close_ollama_servers():
+    for server in _servers.values():
+        await server.client.aclose()
+    _servers.clear()
+
+class ChatOllamaLocal(BaseChatModel):
+    """Modelo de chat local sobre /api/chat de Ollama
+    
+    Devuelve mensajes (`response.content`, como los proveedores remotos), informa del uso de
+    tokens (prompt_eval_count/eval_count) y admite streaming de tokens con `astream`.
+    """
+    
+    model: str
+    base_url: str = "http://localhost:11434"
+    keep_alive: str = "30m"
+    temperature: Optional[float] = None
+    num_ctx: Optional[int] = None
+    
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-chat"
+    
+    @property
+    def _identifying_params(self) -> Dict[str, Any]:
+        return {"model": self.model, "base_url": self.base_url}
+    
+    @staticmethod
+    def _convert_message(message: BaseMessage) -> Dict[str, str]:
+        if isinstance(message, SystemMessage):
+            role = "system"
+        elif isinstance(message, AIMessage):
+            role = "assistant"
+        else:
+            role = "user"
+        return {"role": role, "content": message.content}
+    
+    def _payload(self, messages: List[BaseMessage], stream: bool, stop: Optional[List[str]], format: Optional[str] = None) -> Dict[str, Any]:
+        options = {"temperature": self.temperature, "num_ctx": self.num_ctx, "stop": stop}
+        payload = {
+            "model": self.model,
+            "messages": [self._convert_message(message) for message in messages],
+            "stream": stream,
+            "keep_alive": self.keep_alive,
+            "options": {key: value for key, value in options.items() if value is not None}
+        }
+        if format:
+            # format="json": el servidor restringe la salida a JSON vlido
+            payload["format"] = format
+        return payload
+    
+    def _result(self, data: Dict[str, Any]) -> ChatResult:
+        if data.get("error"):
+            raise ValueError(f"Ollama: {data['error']}")
+        info = {field: data.get(field) for field in USAGE_FIELDS if field in data}
+        return ChatResult(
+            generations=[ChatGeneration(message=AIMessage(content=data["message"]["content"]), generation_info=info)],
+            llm_output={
+                "token_usage": {
+                    "prompt_tokens": data.get("prompt_eval_count", 0),
+                    "completion_tokens": data.get("eval_count", 0)
+                },
+                "model_name": self.model
+            }
+        )
+    
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        server = get_ollama_server(self.base_url)
+        async with server.slot():
+            response = await server.client.post("/api/chat", json=self._payload(messages, False, stop, kwargs.get("format")))
+            response.raise_for_status()
+            return self._result(response.json())
+    
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> ChatResult:
+        # Llamadas sncronas (scripts): sin el lmite de concurrencia compartido
+        response = httpx.post(
+            f"{self.base_url.rstrip('/')}/api/chat",
+            json=self._payload(messages, False, stop, kwargs.get("format")),
+            timeout=settings.ollama_request_timeout_seconds
+        )
+        response.raise_for_status()
+        return self._result(response.json())
+    
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> AsyncIterator[ChatGenerationChunk]:
+        server = get_ollama_server(self.base_url)
+        async with server.slot():
+            async with server.client.stream("POST", "/api/chat", json=self._payload(messages, True, stop, kwargs.get("format"))) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json.loads(line)
+                    if data.get("error"):
+                        raise ValueError(f"Ollama: {data['error']}")
+                    if data.get("done"):
+                        # ltimo mensaje: sin texto, con el uso de tokens para la contabilidad
+                        info = {field: data.get(field) for field in USAGE_FIELDS if field in data}
+                        yield ChatGenerationChunk(message=AIMessageChunk(content=""), generation_info=info)
+                        return
+                    chunk = ChatGenerationChunk(message=AIMessageChunk(content=data["message"]["content"]))
+                    if run_manager:
+                        await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                    yield chunk
+    
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        # Sin streaming sncrono: una nica respuesta completa
+        result = self._generate(messages, stop=stop, **kwargs)
+        generation = result.generations[0]
+        yield ChatGenerationChunk(message=AIMessageChunk(content=generation.message.content), generation_info=generation.generation_info)
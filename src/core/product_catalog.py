@@ -0,0 +1,430 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import Counter
+import asyncio
+import csv
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import time
+import unicodedata
+
+import numpy as np
+
+from src.core.config import settings
+
+_token_pattern = re.compile(r"\w+", re.UNICODE)
+
+def tokenize(text: str) -> List[str]:
+    """Tokenizar en minsculas y sin acentos ("campaa" y "campana" coinciden)"""
+    normalized = unicodedata.normalize("NFKD", text.lower())
+    normalized = "".join(c for c in normalized if not unicodedata.combining(c))
+    return _token_pattern.findall(normalized)
+
+def load_catalog(path: str) -> List[Dict[str, Any]]:
+    """Cargar catlogo de productos desde JSON, CSV o Parquet"""
+    extension = os.path.splitext(path)[1].lower()
+    
+    if extension == ".json":
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        return data["products"] if isinstance(data, dict) else data
+    
+    elif extension == ".csv":
+        with open(path, encoding="utf-8", newline="") as f:
+            return list(csv.DictReader(f))
+    
+    elif extension == ".parquet":
+        try:
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("pyarrow es necesario para catlogos Parquet: pip install pyarrow")
+        return pq.read_table(path, memory_map=True).to_pylist()
+    
+    else:
+        raise ValueError(f"Formato de catlogo no soportado: {extension}")
+
+def record_id(record: Dict[str, Any]) -> str:
+    return str(record.get("id") or record.get("sku") or record.get("name"))
+
+def record_hash(record: Dict[str, Any]) -> str:
+    return hashlib.sha1(json.dumps(record, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def record_text(record: Dict[str, Any]) -> str:
+    """Texto indexable de un producto (todos los campos de texto y listas)"""
+    parts = []
+    for value in record.values():
+        if isinstance(value, str):
+            parts.append(value)
+        elif isinstance(value, (list, tuple)):
+            parts.extend(str(v) for v in value)
+    return " ".join(parts)
+
+class BM25Segment:
+    """Segmento inmutable de ndice invertido BM25 en arrays NumPy (mapeables en memoria)"""
+    
+    def __init__(
+        self,
+        vocabulary: Dict[str, int],
+        term_offsets: np.ndarray,
+        postings_docs: np.ndarray,
+        postings_tf: np.ndarray,
+        doc_lengths: np.ndarray,
+        doc_ids: List[str],
+        doc_hashes: List[str],
+        records: Optional[List[Dict[str, Any]]] = None,
+        record_store: Optional[Tuple[mmap.mmap, np.ndarray]] = None,
+        vectors: Optional[np.ndarray] = None
+    ):
+        self.vocabulary = vocabulary
+        self.term_offsets = term_offsets
+        self.postings_docs = postings_docs
+        self.postings_tf = postings_tf
+        self.doc_lengths = doc_lengths
+        self.doc_ids = doc_ids
+        self.doc_hashes = doc_hashes
+        self.records = records
+        self.record_store = record_store
+        self.vectors = vectors
+    
+    @property
+    def num_docs(self) -> int:
+        return len(self.doc_ids)
+    
+    @classmethod
+    def build(cls, records: List[Dict[str, Any]]) -> "BM25Segment":
+        """Construir un segmento en memoria a partir de registros"""
+        vocabulary: Dict[str, int] = {}
+        term_rows, doc_rows, tf_rows = [], [], []
+        doc_lengths = np.zeros(len(records), dtype=np.float32)
+        
+        for doc_index, record in enumerate(records):
+            tokens = tokenize(record_text(record))
+            doc_lengths[doc_index] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                term_rows.append(vocabulary.setdefault(term, len(vocabulary)))
+                doc_rows.append(doc_index)
+                tf_rows.append(tf)
+        
+        # Postings agrupados por trmino (CSR): term_offsets[t]:term_offsets[t+1]
+        terms = np.asarray(term_rows, dtype=np.int64)
+        order = np.argsort(terms, kind="stable")
+        term_offsets = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(vocabulary)), out=term_offsets[1:])
+        
+        return cls(
+            vocabulary=vocabulary,
+            term_offsets=term_offsets,
+            postings_docs=np.asarray(doc_rows, dtype=np.int32)[order],
+            postings_tf=np.asarray(tf_rows, dtype=np.float32)[order],
+            doc_lengths=doc_lengths,
+            doc_ids=[record_id(r) for r in records],
+            doc_hashes=[record_hash(r) for r in records],
+            records=records
+        )
+    
+    def save(self, directory: str):
+        """Persistir el segmento; los arrays se abren luego con mmap"""
+        os.makedirs(directory, exist_ok=True)
+        np.save(os.path.join(directory, "term_offsets.npy"), self.term_offsets)
+        np.save(os.path.join(directory, "postings_docs.npy"), self.postings_docs)
+        np.save(os.path.join(directory, "postings_tf.npy"), self.postings_tf)
+        np.save(os.path.join(directory, "doc_lengths.npy"), self.doc_lengths)
+        if self.vectors is not None:
+            np.save(os.path.join(directory, "vectors.npy"), self.vectors)
+        
+        # Registros como JSON concatenado con offsets, para leer slo los top-k
+        offsets = [0]
+        with open(os.path.join(directory, "records.bin"), "wb") as f:
+            for record in self.records:
+                data = json.dumps(record, ensure_ascii=False, default=str).encode("utf-8")
+                f.write(data)
+                offsets.append(offsets[-1] + len(data))
+        np.save(os.path.join(directory, "record_offsets.npy"), np.asarray(offsets, dtype=np.int64))
+        
+        with open(os.path.join(directory, "manifest.json"), "w", encoding="utf-8") as f:
+            json.dump({
+                "vocabulary": self.vocabulary,
+                "doc_ids": self.doc_ids,
+                "doc_hashes": self.doc_hashes
+            }, f)
+    
+    @classmethod
+    def load(cls, directory: str) -> "BM25Segment":
+        """Abrir un segmento persistido con arrays mapeados en memoria (compartidos entre workers)"""
+        def _array(name):
+            return np.load(os.path.join(directory, name), mmap_mode="r")
+        
+        with open(os.path.join(directory, "manifest.json"), encoding="utf-8") as f:
+            manifest = json.load(f)
+        
+        vectors_path = os.path.join(directory, "vectors.npy")
+        with open(os.path.join(directory, "records.bin"), "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            records_map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        
+        return cls(
+            vocabulary=manifest["vocabulary"],
+            term_offsets=_array("term_offsets.npy"),
+            postings_docs=_array("postings_docs.npy"),
+            postings_tf=_array("postings_tf.npy"),
+            doc_lengths=_array("doc_lengths.npy"),
+            doc_ids=manifest["doc_ids"],
+            doc_hashes=manifest["doc_hashes"],
+            record_store=(records_map, _array("record_offsets.npy")),
+            vectors=np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+        )
+    
+    def get_record(self, doc_index: int) -> Dict[str, Any]:
+        if self.records is not None:
+            return self.records[doc_index]
+        records_map, offsets = self.record_store
+        return json.loads(records_map[int(offsets[doc_index]):int(offsets[doc_index + 1])])
+    
+    def document_frequency(self, term: str) -> int:
+        term_id = self.vocabulary.get(term)
+        if term_id is None:
+            return 0
+        return int(self.term_offsets[term_id + 1] - self.term_offsets[term_id])
+    
+    def score(self, terms: List[str], idf: Dict[str, float], avg_doc_length: float) -> np.ndarray:
+        """Puntuacin BM25 de todos los documentos del segmento para los trminos dados"""
+        k1, b = settings.product_bm25_k1, settings.product_bm25_b
+        scores = np.zeros(self.num_docs, dtype=np.float32)
+        for term in terms:
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            docs = self.postings_docs[start:end]
+            tf = self.postings_tf[start:end]
+            norm = k1 * (1 - b + b * self.doc_lengths[docs] / avg_doc_length)
+            # Cada documento aparece una vez por trmino: la suma indexada es segura
+            scores[docs] += idf[term] * tf * (k1 + 1) / (tf + norm)
+        return scores
+
+class ProductCatalogIndex:
+    """ndice de catlogo: segmento base en disco + segmento delta incremental en memoria"""
+    
+    def __init__(
+        self,
+        catalog_path: str,
+        index_dir: str,
+        embedding_service=None
+    ):
+        self.catalog_path = catalog_path
+        self.index_dir = index_dir
+        self.embedding_service = embedding_service
+        self.base: Optional[BM25Segment] = None
+        self.base_name: Optional[str] = None
+        self.delta: Optional[BM25Segment] = None
+        self.tombstones = np.zeros(0, dtype=bool)  # Docs del base borrados o reemplazados
+        self._catalog_signature = None
+        self._last_refresh_check = 0.0
+        self._refresh_lock = asyncio.Lock()
+    
+    @property
+    def _current_pointer(self) -> str:
+        return os.path.join(self.index_dir, "CURRENT")
+    
+    def _read_current(self) -> Optional[str]:
+        try:
+            with open(self._current_pointer, encoding="utf-8") as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+    
+    def _catalog_file_signature(self) -> Tuple[float, int]:
+        stat = os.stat(self.catalog_path)
+        return (stat.st_mtime, stat.st_size)
+    
+    async def initialize(self):
+        """Abrir el segmento publicado (o construirlo) y aplicar cambios pendientes del catlogo"""
+        os.makedirs(self.index_dir, exist_ok=True)
+        current = self._read_current()
+        if current and os.path.isdir(os.path.join(self.index_dir, current)):
+            self.base = await asyncio.to_thread(BM25Segment.load, os.path.join(self.index_dir, current))
+            self.base_name = current
+            self.tombstones = np.zeros(self.base.num_docs, dtype=bool)
+        await self.refresh(force=True)
+    
+    async def refresh(self, force: bool = False):
+        """Incorporar cambios del catlogo o de un segmento publicado por otro worker"""
+        now = time.monotonic()
+        if not force and now - self._last_refresh_check < settings.product_index_refresh_seconds:
+            return
+        self._last_refresh_check = now
+        
+        async with self._refresh_lock:
+            current = self._read_current()
+            if current and current != self.base_name:
+                # Otro worker public un segmento nuevo: abrirlo y recalcular el delta
+                self.base = await asyncio.to_thread(BM25Segment.load, os.path.join(self.index_dir, current))
+                self.base_name = current
+                self.tombstones = np.zeros(self.base.num_docs, dtype=bool)
+                self._catalog_signature = None
+            
+            signature = self._catalog_file_signature()
+            if signature == self._catalog_signature:
+                return
+            
+            records = await asyncio.to_thread(load_catalog, self.catalog_path)
+            await self._apply_catalog(records)
+            self._catalog_signature = signature
+    
+    async def _apply_catalog(self, records: List[Dict[str, Any]]):
+        """Calcular el delta frente al segmento base; fusionar si el delta crece demasiado"""
+        if self.base is None:
+            await self._rebuild(records)
+            return
+        
+        base_positions = {doc_id: i for i, doc_id in enumerate(self.base.doc_ids)}
+        tombstones = np.ones(self.base.num_docs, dtype=bool)
+        changed = []
+        
+        for record in records:
+            position = base_positions.get(record_id(record))
+            if position is not None and self.base.doc_hashes[position] == record_hash(record):
+                tombstones[position] = False
+            else:
+                changed.append(record)
+        
+        pending = len(changed) + int(tombstones.sum())
+        if pending > settings.product_index_merge_ratio * max(self.base.num_docs, 1):
+            await self._rebuild(records)
+            return
+        
+        delta = BM25Segment.build(changed) if changed else None
+        if delta is not None and self.embedding_service:
+            delta.vectors = await self._embed_records(changed)
+        
+        self.delta = delta
+        self.tombstones = tombstones
+        print(f" Catlogo actualizado: {len(changed)} productos en delta, {int(tombstones.sum())} retirados")
+    
+    async def _rebuild(self, records: List[Dict[str, Any]]):
+        """Construir y publicar un segmento base nuevo de forma atmica"""
+        segment = await asyncio.to_thread(BM25Segment.build, records)
+        if self.embedding_service and records:
+            segment.vectors = await self._embed_records(records)
+        
+        digest = hashlib.sha1("".join(segment.doc_hashes).encode("utf-8")).hexdigest()[:16]
+        name = f"segment_{digest}"
+        directory = os.path.join(self.index_dir, name)
+        if not os.path.isdir(directory):
+            tmp_directory = f"{directory}.tmp{os.getpid()}"
+            await asyncio.to_thread(segment.save, tmp_directory)
+            try:
+                os.rename(tmp_directory, directory)
+            except OSError:
+                # Otro worker public el mismo segmento en paralelo
+                shutil.rmtree(tmp_directory, ignore_errors=True)
+        
+        tmp_pointer = f"{self._current_pointer}.tmp{os.getpid()}"
+        with open(tmp_pointer, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp_pointer, self._current_pointer)
+        
+        self.base = await asyncio.to_thread(BM25Segment.load, directory)
+        self.base_name = name
+        self.delta = None
+        self.tombstones = np.zeros(self.base.num_docs, dtype=bool)
+        print(f" ndice de catlogo reconstruido: {self.base.num_docs} productos")
+    
+    async def _embed_records(self, records: List[Dict[str, Any]]) -> np.ndarray:
+        vectors = await self.embedding_service.embed_many([record_text(r) for r in records])
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        return (vectors / np.where(norms > 0, norms, 1)).astype(np.float32)
+    
+    def _segments(self) -> List[Tuple[BM25Segment, Optional[np.ndarray]]]:
+        segments = []
+        if self.base is not None:
+            segments.append((self.base, self.tombstones))
+        if self.delta is not None:
+            segments.append((self.delta, None))
+        return segments
+    
+    def _bm25_ranking(self, query: str, limit: int) -> List[Tuple[float, BM25Segment, int]]:
+        terms = list(dict.fromkeys(tokenize(query)))
+        segments = self._segments()
+        if not terms or not segments:
+            return []
+        
+        # Estadsticas globales (todos los segmentos) para que las puntuaciones sean comparables
+        num_docs = sum(s.num_docs for s, _ in segments)
+        total_length = sum(float(np.sum(s.doc_lengths)) for s, _ in segments)
+        avg_doc_length = total_length / max(num_docs, 1) or 1.0
+        idf = {}
+        for term in terms:
+            df = sum(s.document_frequency(term) for s, _ in segments)
+            idf[term] = math.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+        
+        ranking = []
+        for segment, deleted in segments:
+            scores = segment.score(terms, idf, avg_doc_length)
+            if deleted is not None and deleted.size:
+                scores[deleted] = 0
+            k = min(limit, segment.num_docs)
+            if k == 0:
+                continue
+            top = np.argpartition(-scores, k - 1)[:k]
+            ranking.extend((float(scores[i]), segment, int(i)) for i in top if scores[i] > 0)
+        
+        ranking.sort(key=lambda item: item[0], reverse=True)
+        return ranking[:limit]
+    
+    async def _vector_ranking(self, query: str, limit: int) -> List[Tuple[float, BM25Segment, int]]:
+        query_vector = await self.embedding_service.embed(query)
+        norm = np.linalg.norm(query_vector)
+        query_vector = query_vector / norm if norm > 0 else query_vector
+        
+        ranking = []
+        for segment, deleted in self._segments():
+            if segment.vectors is None or segment.num_docs == 0:
+                continue
+            scores = np.asarray(segment.vectors @ query_vector, dtype=np.float32)
+            if deleted is not None and deleted.size:
+                scores[deleted] = -1
+            k = min(limit, segment.num_docs)
+            top = np.argpartition(-scores, k - 1)[:k]
+            ranking.extend((float(scores[i]), segment, int(i)) for i in top if scores[i] > -1)
+        
+        ranking.sort(key=lambda item: item[0], reverse=True)
+        return ranking[:limit]
+    
+    async def search(self, query: str, top_k: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Buscar los productos ms relevantes (BM25, fusionado con vectores si est activo)"""
+        top_k = top_k or settings.product_top_k
+        await self.refresh()
+        
+        candidates = top_k * 4
+        rankings = [self._bm25_ranking(query, candidates)]
+        if self.embedding_service:
+            rankings.append(await self._vector_ranking(query, candidates))
+        
+        # Reciprocal Rank Fusion: combina rankings sin calibrar escalas de puntuacin
+        fused: Dict[Tuple[int, int], float] = {}
+        entries = {}
+        for ranking in rankings:
+            for rank, (_, segment, doc_index) in enumerate(ranking):
+                key = (id(segment), doc_index)
+                fused[key] = fused.get(key, 0.0) + 1.0 / (60 + rank + 1)
+                entries[key] = (segment, doc_index)
+        
+        best = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top_k]
+        return [
+            {**entries[key][0].get_record(entries[key][1]), "_score": round(score, 4)}
+            for key, score in best
+        ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "segment": self.base_name,
+            "base_documents": self.base.num_docs if self.base else 0,
+            "delta_documents": self.delta.num_docs if self.delta else 0,
+            "deleted_documents": int(self.tombstones.sum()),
+            "vector_search": self.embedding_service is not None
+        }
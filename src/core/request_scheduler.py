@@ -0,0 +1,171 @@
+from typing import Dict, Any, Optional
+from collections import deque
+from contextlib import asynccontextmanager
+import asyncio
+import time
+
+from src.core.config import settings
+from src.core.semantic_memory import LatencyStats
+
+# Clases de prioridad, de mayor a menor: stream interactivo, /chat sncrono, trfico batch
+PRIORITIES = ("stream", "sync", "batch")
+
+class SchedulerRejected(Exception):
+    """El request no se admite: cola llena o espera mxima superada"""
+    
+    def __init__(self, message: str, status_code: int = 503):
+        super().__init__(message)
+        self.status_code = status_code
+
+class _Ticket:
+    __slots__ = ("user", "priority", "tag", "enqueued_at", "future")
+    
+    def __init__(self, user: str, priority: str, tag: float):
+        self.user = user
+        self.priority = priority
+        self.tag = tag
+        self.enqueued_at = time.perf_counter()
+        self.future = asyncio.get_running_loop().create_future()
+
+class RequestScheduler:
+    """Control de admisin delante de MainAgent: colas justas por usuario y prioridades
+    
+    Como mximo SCHEDULER_MAX_IN_FLIGHT requests se procesan a la vez en cada worker; el resto
+    espera. Al liberarse un hueco se atiende primero la clase de mayor prioridad y, dentro de
+    ella, el usuario con menor etiqueta de inicio virtual (start-time fair queuing): cada
+    request avanza la etiqueta de su usuario en 1/peso, as que un usuario con cientos de
+    requests en cola no retrasa ms de uno por turno a los dems.
+    """
+    
+    def __init__(self, max_in_flight: Optional[int] = None):
+        self.max_in_flight = max_in_flight or settings.scheduler_max_in_flight
+        self._in_flight = 0
+        self._queues: Dict[str, Dict[str, deque]] = {priority: {} for priority in PRIORITIES}
+        self._finish_tags: Dict[str, Dict[str, float]] = {priority: {} for priority in PRIORITIES}
+        self._virtual_time: Dict[str, float] = {priority: 0.0 for priority in PRIORITIES}
+        self._queued = 0
+        self.queue_time = {priority: LatencyStats() for priority in PRIORITIES}
+        self.stats = {
+            "admitted": 0,
+            "queued": 0,
+            "rejected_queue_full": 0,
+            "rejected_user_limit": 0,
+            "timeouts": 0,
+            "cancelled": 0
+        }
+    
+    @staticmethod
+    def _weight(user: str) -> float:
+        return max(settings.scheduler_user_weights.get(user, 1.0), 0.01)
+    
+    @asynccontextmanager
+    async def slot(self, user_id: Optional[str], priority: str = "sync"):
+        """Esperar turno y ocupar un hueco mientras dura el bloque"""
+        await self.acquire(user_id, priority)
+        try:
+            yield
+        finally:
+            self.release()
+    
+    async def acquire(self, user_id: Optional[str], priority: str = "sync"):
+        if priority not in PRIORITIES:
+            raise ValueError(f"Prioridad no soportada: {priority}")
+        user = user_id or "anonymous"
+        
+        if self._in_flight < self.max_in_flight and self._queued == 0:
+            self._in_flight += 1
+            self.stats["admitted"] += 1
+            self.queue_time[priority].record(0.0)
+            return
+        
+        if self._queued >= settings.scheduler_max_queued:
+            self.stats["rejected_queue_full"] += 1
+            raise SchedulerRejected("Servicio saturado, reintntalo en unos segundos")
+        if len(self._queues[priority].get(user, ())) >= settings.scheduler_max_queued_per_user:
+            self.stats["rejected_user_limit"] += 1
+            raise SchedulerRejected(f"Demasiados requests en cola para el usuario {user}", status_code=429)
+        
+        # Etiqueta de inicio: no antes del tiempo virtual actual ni del ltimo request del usuario
+        finish_tags = self._finish_tags[priority]
+        tag = max(self._virtual_time[priority], finish_tags.get(user, 0.0))
+        finish_tags[user] = tag + 1.0 / self._weight(user)
+        ticket = _Ticket(user, priority, tag)
+        self._queues[priority].setdefault(user, deque()).append(ticket)
+        self._queued += 1
+        self.stats["queued"] += 1
+        
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout=settings.scheduler_queue_timeout_seconds)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            if ticket.future.done():
+                # Admitido justo al expirar: devolver el hueco
+                self.release()
+            else:
+                ticket.future.cancel()
+                self._remove(ticket)
+            if isinstance(e, asyncio.CancelledError):
+                self.stats["cancelled"] += 1
+                raise
+            self.stats["timeouts"] += 1
+            self.queue_time[priority].timeouts += 1
+            raise SchedulerRejected("Tiempo de espera en cola agotado, reintntalo en unos segundos")
+        
+        self.queue_time[priority].record((time.perf_counter() - ticket.enqueued_at) * 1000)
+    
+    @property
+    def saturated(self) -> bool:
+        """Sin huecos libres o con requests esperando: el trabajo opcional debe descartarse"""
+        return self._queued > 0 or self._in_flight >= self.max_in_flight
+    
+    def release(self):
+        self._in_flight -= 1
+        self._dispatch()
+    
+    def _remove(self, ticket: _Ticket):
+        queues = self._queues[ticket.priority]
+        user_queue = queues.get(ticket.user)
+        if user_queue is not None and ticket in user_queue:
+            user_queue.remove(ticket)
+            self._queued -= 1
+            if not user_queue:
+                del queues[ticket.user]
+    
+    def _dispatch(self):
+        while self._in_flight < self.max_in_flight and self._queued:
+            priority = next(priority for priority in PRIORITIES if self._queues[priority])
+            queues = self._queues[priority]
+            user = min(queues, key=lambda candidate: queues[candidate][0].tag)
+            ticket = queues[user].popleft()
+            if not queues[user]:
+                del queues[user]
+            self._queued -= 1
+            self._virtual_time[priority] = ticket.tag
+            if not queues:
+                # Clase vaca: las etiquetas antiguas ya no importan
+                self._finish_tags[priority].clear()
+                self._virtual_time[priority] = 0.0
+            self._in_flight += 1
+            self.stats["admitted"] += 1
+            ticket.future.set_result(True)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        waiting_by_user: Dict[str, int] = {}
+        for queues in self._queues.values():
+            for user, user_queue in queues.items():
+                waiting_by_user[user] = waiting_by_user.get(user, 0) + len(user_queue)
+        top_users = sorted(waiting_by_user.items(), key=lambda item: item[1], reverse=True)[:10]
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": self._queued,
+            "waiting_by_priority": {
+                priority: sum(len(user_queue) for user_queue in queues.values())
+                for priority, queues in self._queues.items()
+            },
+            "top_waiting_users": dict(top_users),
+            "queue_time": {priority: stats.snapshot() for priority, stats in self.queue_time.items()}
+        }
+
+# Instancia global (una por worker)
+request_scheduler = RequestScheduler()
@@ -0,0 +1,284 @@
+from typing import Dict, Any, List, Optional
+from collections import deque
+from datetime import datetime
+import asyncio
+import time
+
+import numpy as np
+from sqlalchemy import select, text
+
+from src.core.config import settings
+from src.core.embedding_service import get_embedding_service
+from src.models.database import Base, ConversationEmbedding
+
+class LatencyStats:
+    """Ventana deslizante de latencias (ms) para reportar percentiles"""
+    
+    def __init__(self, window: int = 1000):
+        self.samples = deque(maxlen=window)
+        self.timeouts = 0
+        self.errors = 0
+    
+    def record(self, latency_ms: float):
+        self.samples.append(latency_ms)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        if not self.samples:
+            return {"count": 0, "p50_ms": None, "p95_ms": None, "max_ms": None,
+                    "timeouts": self.timeouts, "errors": self.errors}
+        values = np.fromiter(self.samples, dtype=np.float64)
+        return {
+            "count": int(values.size),
+            "p50_ms": round(float(np.percentile(values, 50)), 2),
+            "p95_ms": round(float(np.percentile(values, 95)), 2),
+            "max_ms": round(float(values.max()), 2),
+            "timeouts": self.timeouts,
+            "errors": self.errors
+        }
+
+class NumpyVectorIndex:
+    """ndice vectorial en proceso (bsqueda exacta por coseno) para uso local y tests"""
+    
+    def __init__(self, dimensions: int, initial_capacity: int = 1024):
+        self.dimensions = dimensions
+        self.initial_capacity = initial_capacity
+        self._vectors: Dict[str, np.ndarray] = {}
+        self._sizes: Dict[str, int] = {}
+        self._payloads: Dict[str, List[Dict[str, Any]]] = {}
+    
+    async def initialize(self):
+        pass
+    
+    async def add(self, user_id: str, embedding: List[float], payload: Dict[str, Any]):
+        """Agregar un vector normalizado a la particin del usuario"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector = vector / norm
+        
+        matrix = self._vectors.get(user_id)
+        size = self._sizes.get(user_id, 0)
+        if matrix is None:
+            matrix = np.empty((self.initial_capacity, self.dimensions), dtype=np.float32)
+            self._payloads[user_id] = []
+        elif size == matrix.shape[0]:
+            # Crecimiento geomtrico para mantener inserciones O(1) amortizado
+            grown = np.empty((matrix.shape[0] * 2, self.dimensions), dtype=np.float32)
+            grown[:size] = matrix[:size]
+            matrix = grown
+        
+        matrix[size] = vector
+        self._vectors[user_id] = matrix
+        self._sizes[user_id] = size + 1
+        self._payloads[user_id].append(payload)
+    
+    async def search(self, user_id: str, embedding: List[float], top_k: int) -> List[Dict[str, Any]]:
+        """Obtener los top-k turnos ms similares del usuario"""
+        size = self._sizes.get(user_id, 0)
+        if size == 0:
+            return []
+        
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(query)
+        if norm > 0:
+            query = query / norm
+        
+        scores = self._vectors[user_id][:size] @ query
+        k = min(top_k, size)
+        # argpartition es O(n); slo se ordenan los k candidatos
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        ordered = candidates[np.argsort(-scores[candidates])]
+        
+        payloads = self._payloads[user_id]
+        return [{**payloads[i], "score": float(scores[i])} for i in ordered]
+    
+    async def cleanup(self):
+        self._vectors.clear()
+        self._sizes.clear()
+        self._payloads.clear()
+
+class PgVectorIndex:
+    """ndice vectorial en PostgreSQL con pgvector (HNSW o IVFFlat)"""
+    
+    def __init__(self, db_session):
+        self.db_session = db_session
+    
+    async def initialize(self):
+        """Crear la extensin, la tabla de embeddings y su ndice ANN"""
+        async with self.db_session() as session:
+            await session.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+            connection = await session.connection()
+            await connection.run_sync(
+                lambda sync_conn: Base.metadata.create_all(
+                    sync_conn, tables=[ConversationEmbedding.__table__]
+                )
+            )
+            await session.commit()
+    
+    async def add(self, user_id: str, embedding: List[float], payload: Dict[str, Any]):
+        async with self.db_session() as session:
+            session.add(ConversationEmbedding(
+                conversation_id=payload["conversation_id"],
+                session_id=payload["session_id"],
+                user_id=user_id,
+                content=payload["content"],
+                embedding=embedding,
+                timestamp=datetime.fromisoformat(payload["timestamp"])
+            ))
+            await session.commit()
+    
+    async def search(self, user_id: str, embedding: List[float], top_k: int) -> List[Dict[str, Any]]:
+        distance = ConversationEmbedding.embedding.cosine_distance(embedding)
+        async with self.db_session() as session:
+            # Parmetros de bsqueda del ndice ANN (recall vs latencia), slo para esta transaccin
+            if settings.vector_index_type == "ivfflat":
+                await session.execute(text(f"SET LOCAL ivfflat.probes = {int(settings.vector_search_probes)}"))
+            else:
+                await session.execute(text(f"SET LOCAL hnsw.ef_search = {int(settings.vector_search_ef)}"))
+            
+            result = await session.execute(
+                select(ConversationEmbedding, distance.label("distance"))
+                .where(ConversationEmbedding.user_id == user_id)
+                .order_by(distance)
+                .limit(top_k)
+            )
+            
+            return [
+                {
+                    "conversation_id": str(row.ConversationEmbedding.conversation_id),
+                    "session_id": row.ConversationEmbedding.session_id,
+                    "content": row.ConversationEmbedding.content,
+                    "timestamp": row.ConversationEmbedding.timestamp.isoformat(),
+                    "score": 1.0 - float(row.distance)
+                }
+                for row in result
+            ]
+    
+    async def cleanup(self):
+        pass
+
+class SemanticMemory:
+    """Memoria semntica a largo plazo: embeddings de turnos y recuperacin top-k por usuario"""
+    
+    def __init__(self, db_session=None):
+        self.db_session = db_session
+        self.embeddings = None
+        self.index = None
+        self.search_latency = LatencyStats()
+        self.embedding_latency = LatencyStats()
+        self._pending_tasks = set()
+    
+    async def initialize(self):
+        """Inicializar el modelo de embeddings y el backend del ndice"""
+        self.embeddings = get_embedding_service()
+        
+        if settings.vector_store_type == "pgvector":
+            self.index = PgVectorIndex(self.db_session)
+        elif settings.vector_store_type == "numpy":
+            self.index = NumpyVectorIndex(settings.embedding_dimensions)
+        else:
+            raise ValueError(f"Vector store no soportado: {settings.vector_store_type}")
+        
+        await self.index.initialize()
+        print(f" Memoria semntica inicializada ({settings.vector_store_type})")
+    
+    @staticmethod
+    def format_turn(user_message: str, agent_response: str) -> str:
+        """Texto indexado para un turno de conversacin"""
+        return f"Usuario: {user_message}\nAgente: {agent_response}"
+    
+    async def add_turn(
+        self,
+        conversation_id: str,
+        session_id: str,
+        user_id: str,
+        user_message: str,
+        agent_response: str,
+        timestamp: datetime
+    ):
+        """Calcular el embedding de un turno y agregarlo al ndice"""
+        content = self.format_turn(user_message, agent_response)
+        try:
+            embedding = await self.embeddings.aembed_query(content)
+            await self.index.add(user_id, embedding, {
+                "conversation_id": conversation_id,
+                "session_id": session_id,
+                "content": content,
+                "timestamp": timestamp.isoformat()
+            })
+        except Exception as e:
+            print(f"Error indexando turno en memoria semntica: {e}")
+    
+    def schedule_add_turn(self, **turn):
+        """Indexar un turno en background para no sumar el embedding a la latencia del turno"""
+        task = asyncio.create_task(self.add_turn(**turn))
+        self._pending_tasks.add(task)
+        task.add_done_callback(self._pending_tasks.discard)
+    
+    async def search(
+        self,
+        user_id: str,
+        query: str,
+        top_k: Optional[int] = None
+    ) -> List[Dict[str, Any]]:
+        """Recuperar los intercambios pasados ms relevantes, acotado por timeout
+        
+        El embedding de la consulta (servicio remoto) y la bsqueda en el ndice tienen cada uno
+        su plazo y sus mtricas: un backend de embeddings lento no cuenta como fallo del ndice.
+        """
+        embedding = await self._timed(
+            self.embedding_latency,
+            self.embeddings.aembed_query(query),
+            settings.semantic_memory_embedding_timeout_ms,
+            "calculando el embedding de la consulta"
+        )
+        if embedding is None:
+            return []
+        
+        results = await self._timed(
+            self.search_latency,
+            self.index.search(user_id, embedding, top_k or settings.semantic_memory_top_k),
+            settings.semantic_memory_timeout_ms,
+            "buscando en memoria semntica"
+        )
+        return [r for r in results or [] if r["score"] >= settings.semantic_memory_min_score]
+    
+    @staticmethod
+    async def _timed(stats: LatencyStats, call, timeout_ms: int, action: str):
+        start = time.perf_counter()
+        try:
+            return await asyncio.wait_for(call, timeout=timeout_ms / 1000)
+        except asyncio.TimeoutError:
+            # Mejor responder sin contexto que retrasar todo el turno
+            stats.timeouts += 1
+            return None
+        except Exception as e:
+            stats.errors += 1
+            print(f"Error {action}: {e}")
+            return None
+        finally:
+            stats.record((time.perf_counter() - start) * 1000)
+    
+    @staticmethod
+    def format_context(results: List[Dict[str, Any]]) -> str:
+        """Formatear resultados para incluirlos en el prompt"""
+        return "\n\n".join(
+            f"[{r['timestamp']}]\n{r['content']}" for r in results
+        )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Estadsticas de latencia de recuperacin"""
+        return {
+            "backend": settings.vector_store_type,
+            "timeout_ms": settings.semantic_memory_timeout_ms,
+            "search_latency": self.search_latency.snapshot(),
+            "embedding_timeout_ms": settings.semantic_memory_embedding_timeout_ms,
+            "embedding_latency": self.embedding_latency.snapshot(),
+            "pending_index_tasks": len(self._pending_tasks)
+        }
+    
+    async def cleanup(self):
+        if self._pending_tasks:
+            await asyncio.gather(*self._pending_tasks, return_exceptions=True)
+        if self.index:
+            await self.index.cleanup()
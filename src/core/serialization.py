@@ -0,0 +1,75 @@
+from typing import Dict, Any, Optional, Tuple, Union
+import gzip
+import json
+
+from src.core.config import settings
+
+try:
+    import msgspec
+except ImportError:
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Backend ms rpido disponible: msgspec, orjson o json estndar
+# Los payloads del hot path (ChatResponse, eventos SSE, turnos cacheados) se codifican como dict:
+# pasarlos antes a un Struct tipado de msgspec es ms lento que codificar el dict directamente
+BACKEND = "msgspec" if msgspec else "orjson" if orjson else "json"
+
+if msgspec:
+    _encoder = msgspec.json.Encoder()
+    _decoder = msgspec.json.Decoder()
+    _msgpack_encoder = msgspec.msgpack.Encoder()
+    _msgpack_decoder = msgspec.msgpack.Decoder()
+
+def dumps(obj: Any) -> bytes:
+    """JSON compacto en bytes (UTF-8)"""
+    if msgspec:
+        return _encoder.encode(obj)
+    if orjson:
+        return orjson.dumps(obj)
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode("utf-8")
+
+def dumps_str(obj: Any) -> str:
+    return dumps(obj).decode("utf-8")
+
+def loads(data: Union[bytes, str]) -> Any:
+    if msgspec:
+        return _decoder.decode(data)
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def encode_value(obj: Any) -> bytes:
+    """Valor para Redis: MessagePack si REDIS_VALUE_FORMAT=msgpack y msgspec est disponible, si no JSON"""
+    if settings.redis_value_format == "msgpack" and msgspec:
+        return _msgpack_encoder.encode(obj)
+    return dumps(obj)
+
+def decode_value(data: Union[bytes, str]) -> Any:
+    """Leer un valor escrito por encode_value en cualquiera de los dos formatos
+    
+    Los valores guardados son objetos o listas: en JSON empiezan por '{' o '[', mientras que
+    un map/array de MessagePack empieza por un byte de tipo distinto. As conviven los valores
+    antiguos en JSON con los nuevos al cambiar de formato.
+    """
+    if isinstance(data, str) or data[:1] in (b"{", b"["):
+        return loads(data)
+    if not msgspec:
+        raise ValueError("Valor MessagePack en Redis pero msgspec no est instalado")
+    return _msgpack_decoder.decode(data)
+
+def negotiate_gzip(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Dict[str, str]]:
+    """Comprimir con gzip si el cliente lo acepta y el payload supera el umbral configurado"""
+    headers = {"Vary": "Accept-Encoding"}
+    if (
+        settings.response_gzip_min_bytes > 0
+        and len(body) >= settings.response_gzip_min_bytes
+        and "gzip" in (accept_encoding or "").lower()
+    ):
+        body = gzip.compress(body, compresslevel=settings.response_gzip_level)
+        headers["Content-Encoding"] = "gzip"
+    return body, headers
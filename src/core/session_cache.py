@@ -0,0 +1,155 @@
+from typing import Dict, Any, Optional, Awaitable, Callable
+from collections import OrderedDict
+import asyncio
+import json
+import time
+import uuid
+
+from src.core.config import settings
+from src.core.semantic_memory import LatencyStats
+from src.core.serialization import dumps, loads
+
+class SessionCache:
+    """LRU en proceso de la memoria de sesin caliente, coherente entre workers va Redis pub/sub
+    
+    Cada escritura o borrado publica un mensaje en `sessions:invalidate`; el resto de workers
+    descartan su copia al recibirlo. Las entradas se guardan serializadas: se decodifican en
+    cada lectura (los llamadores pueden modificar el dict sin afectar a la cache) y su tamao
+    es el footprint real. Si la suscripcin se cae, la cache se vaca hasta reconectar, y
+    cada entrada caduca igualmente tras SESSION_CACHE_TTL_SECONDS.
+    """
+    
+    CHANNEL = "sessions:invalidate"
+    
+    def __init__(self, redis_client, max_entries: Optional[int] = None):
+        self.redis_client = redis_client
+        self.max_entries = max_entries or settings.session_cache_max_entries
+        self.worker_id = uuid.uuid4().hex
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()  # session_id -> (datos, expira)
+        self._generations: Dict[str, int] = {}
+        self._bytes = 0
+        self._listener = None
+        self._subscribed = asyncio.Event()
+        self.invalidation_lag = LatencyStats()
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "invalidations_sent": 0,
+            "invalidations_received": 0,
+            "resubscriptions": 0
+        }
+    
+    async def initialize(self):
+        self._listener = asyncio.create_task(self._listen())
+    
+    async def get(self, session_id: str, loader: Callable[[], Awaitable[Optional[Dict[str, Any]]]]) -> Optional[Dict[str, Any]]:
+        """Leer de la cache o, si no est, cargar con `loader` y guardar"""
+        entry = self._entries.get(session_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self._entries.move_to_end(session_id)
+            self.stats["hits"] += 1
+            return loads(entry[0])
+        
+        self.stats["misses"] += 1
+        # Si llega una invalidacin durante la carga, el valor cargado puede estar obsoleto
+        generation = self._generations.get(session_id, 0)
+        memory = await loader()
+        if memory is not None and self._subscribed.is_set() and self._generations.get(session_id, 0) == generation:
+            self._store(session_id, dumps(memory))
+        return memory
+    
+    async def put(self, session_id: str, memory: Dict[str, Any]):
+        """Guardar el valor recin escrito y avisar al resto de workers"""
+        self._bump(session_id)
+        if self._subscribed.is_set():
+            self._store(session_id, dumps(memory))
+        await self._publish(session_id)
+    
+    async def invalidate(self, session_id: str):
+        self._drop(session_id)
+        self._bump(session_id)
+        await self._publish(session_id)
+    
+    def _store(self, session_id: str, data: bytes):
+        self._drop(session_id)
+        self._entries[session_id] = (data, time.monotonic() + settings.session_cache_ttl_seconds)
+        self._bytes += len(data)
+        while len(self._entries) > self.max_entries:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted)
+            self.stats["evictions"] += 1
+    
+    def _drop(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= len(entry[0])
+    
+    def _bump(self, session_id: str):
+        if len(self._generations) > self.max_entries * 2:
+            # Slo importan las generaciones de cargas en curso: reiniciar el contador es seguro
+            self._generations.clear()
+        self._generations[session_id] = self._generations.get(session_id, 0) + 1
+    
+    async def _publish(self, session_id: str):
+        message = json.dumps({"session_id": session_id, "origin": self.worker_id, "sent_at": time.time()})
+        try:
+            await self.redis_client.publish(self.CHANNEL, message)
+            self.stats["invalidations_sent"] += 1
+        except Exception as e:
+            print(f"Error publicando invalidacin de sesin: {e}")
+    
+    async def _listen(self):
+        """Aplicar invalidaciones de otros workers; reconectar si la suscripcin se pierde"""
+        while True:
+            pubsub = self.redis_client.pubsub()
+            try:
+                await pubsub.subscribe(self.CHANNEL)
+                self._subscribed.set()
+                async for message in pubsub.listen():
+                    if message.get("type") != "message":
+                        continue
+                    payload = json.loads(message["data"])
+                    if payload["origin"] == self.worker_id:
+                        continue
+                    self._drop(payload["session_id"])
+                    self._bump(payload["session_id"])
+                    self.stats["invalidations_received"] += 1
+                    # Retraso entre la escritura y la invalidacin (incluye desfase de relojes entre pods)
+                    self.invalidation_lag.record(max(time.time() - payload["sent_at"], 0.0) * 1000)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Suscripcin de invalidaciones de sesin perdida: {e}")
+            finally:
+                # Sin suscripcin no hay coherencia: vaciar y dejar de cachear hasta reconectar
+                self._subscribed.clear()
+                self._entries.clear()
+                self._bytes = 0
+                try:
+                    await pubsub.close()
+                except Exception:
+                    pass
+            self.stats["resubscriptions"] += 1
+            await asyncio.sleep(1.0)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        reads = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "worker_id": self.worker_id,
+            "subscribed": self._subscribed.is_set(),
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "bytes": self._bytes,
+            "hit_rate": round(self.stats["hits"] / reads, 4) if reads else None,
+            "invalidation_lag": self.invalidation_lag.snapshot()
+        }
+    
+    async def cleanup(self):
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
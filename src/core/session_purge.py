@@ -0,0 +1,454 @@
+from typing import Dict, Any, List, Optional, Set
+from datetime import datetime, timedelta
+import asyncio
+import gzip
+import os
+import time
+import uuid
+
+from sqlalchemy import select, delete, union
+
+from src.core.config import settings
+from src.core.serialization import dumps, loads, decode_value
+from src.core.session_store import TieredSessionStore
+from src.core.history_export import EXPORT_COLUMNS, encode_rows
+from src.models.database import ConversationHistory, ConversationEmbedding, SessionMemory
+
+def session_keys(session_id: str) -> List[str]:
+    """Claves de Redis de una sesin: memoria caliente y turnos cacheados"""
+    return [TieredSessionStore.memory_key(session_id), TieredSessionStore.cache_key(session_id)]
+
+class PurgeCancelled(Exception):
+    pass
+
+class PurgeJob:
+    """Purga en curso o terminada; su estado se guarda en Redis para consultarlo desde cualquier worker"""
+    
+    def __init__(
+        self,
+        user_id: Optional[str] = None,
+        session_ids: Optional[List[str]] = None,
+        older_than_days: Optional[int] = None,
+        archive: bool = False
+    ):
+        self.job_id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.session_ids = session_ids or []
+        self.older_than_days = older_than_days
+        self.archive = archive
+        self.status = "queued"
+        self.cancel_requested = False
+        self.worker_id = None
+        self.error = None
+        self.created_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        self.counts = {
+            "sessions": 0,
+            "redis_keys": 0,
+            "checkpoints": 0,
+            "history_rows": 0,
+            "archived_rows": 0,
+            "embedding_rows": 0,
+            "session_rows": 0
+        }
+    
+    @property
+    def mode(self) -> str:
+        if self.user_id:
+            return "user"
+        return "sessions" if self.session_ids else "age"
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.job_id,
+            "mode": self.mode,
+            "user_id": self.user_id,
+            "session_ids": len(self.session_ids),
+            "older_than_days": self.older_than_days,
+            "archive": self.archive,
+            "status": self.status,
+            "worker_id": self.worker_id,
+            "counts": self.counts,
+            "error": self.error,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class SessionPurgeWorker:
+    """Purga masiva de sesiones (por usuario, lista de sesiones o antigedad) en background
+    
+    Los jobs se ejecutan de uno en uno en cada worker y por lotes de PURGE_BATCH_SIZE:
+    - Redis: UNLINK (liberacin de memoria fuera del hilo principal de Redis) de las claves de
+      cada sesin en pipelines, HDEL de sus cambios pendientes de volcado para que el volcado
+      no las resucite, y SCAN de los checkpoints de esas sesiones.
+    - PostgreSQL: DELETE de conversation_history, conversation_embeddings y session_memory por
+      lotes, cada uno en su propia transaccin; con archive, cada lote de historial se aade
+      antes a un NDJSON gzip en HISTORY_ARCHIVE_DIR/purge.
+    
+    Entre lotes se espera lo necesario para no superar PURGE_RATE_LIMIT_PER_SECOND elementos
+    borrados por segundo, de modo que una purga grande no compite con el trfico de requests.
+    
+    Las sesiones reciben una marca de borrado antes de empezar y sus claves de Redis se borran
+    otra vez al terminar PostgreSQL: una lectura entre medias pudo recalentarlas desde
+    session_memory. La cola es del proceso: cada worker renueva una clave de vida y, al
+    arrancar, los jobs sin terminar de un worker que ya no existe se marcan como fallidos.
+    """
+    
+    JOB_KEY = "purge:job:{}"
+    WORKER_KEY = "purge:worker:{}"
+    WORKER_TTL_SECONDS = 60
+    
+    def __init__(self, redis_client, db_session, session_cache=None):
+        self.redis_client = redis_client
+        self.db_session = db_session
+        self.session_cache = session_cache
+        self._queue: "asyncio.Queue[PurgeJob]" = asyncio.Queue()
+        self._jobs: Dict[str, PurgeJob] = {}
+        self._task = None
+        self._heartbeat_task = None
+        self.worker_id = uuid.uuid4().hex
+        self.stats = {
+            "jobs_submitted": 0,
+            "jobs_completed": 0,
+            "jobs_failed": 0,
+            "jobs_cancelled": 0,
+            "jobs_orphaned": 0,
+            "throttled_seconds": 0.0
+        }
+    
+    async def initialize(self):
+        await self._heartbeat()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat_periodically())
+        await self._fail_orphaned()
+        self._task = asyncio.create_task(self._run_jobs())
+    
+    async def _heartbeat(self):
+        await self.redis_client.set(self.WORKER_KEY.format(self.worker_id), "1", ex=self.WORKER_TTL_SECONDS)
+    
+    async def _heartbeat_periodically(self):
+        while True:
+            await asyncio.sleep(self.WORKER_TTL_SECONDS / 3)
+            try:
+                await self._heartbeat()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error renovando el worker de purgas: {e}")
+    
+    async def _fail_orphaned(self) -> int:
+        """Marcar como fallidos los jobs encolados o en curso de workers que ya no existen (reinicio)"""
+        orphaned = 0
+        async for key in self.redis_client.scan_iter(match=self.JOB_KEY.format("*"), count=settings.purge_scan_count):
+            data = await self.redis_client.get(key)
+            if not data:
+                continue
+            job = loads(data)
+            if job.get("status") not in ("queued", "running"):
+                continue
+            worker_id = job.get("worker_id")
+            if worker_id and await self.redis_client.exists(self.WORKER_KEY.format(worker_id)):
+                continue
+            job.update({
+                "status": "failed",
+                "error": "El worker que ejecutaba la purga se reinici; vuelve a enviarla",
+                "finished_at": datetime.now().isoformat()
+            })
+            await self.redis_client.set(key, dumps(job), ex=settings.purge_job_ttl_hours * 3600)
+            orphaned += 1
+        if orphaned:
+            self.stats["jobs_orphaned"] += orphaned
+            print(f" {orphaned} purgas interrumpidas por un reinicio marcadas como fallidas")
+        return orphaned
+    
+    async def submit(
+        self,
+        user_id: Optional[str] = None,
+        session_ids: Optional[List[str]] = None,
+        older_than_days: Optional[int] = None,
+        archive: bool = False
+    ) -> PurgeJob:
+        """Encolar una purga; exactamente un criterio: user_id, session_ids u older_than_days"""
+        criteria = [value for value in (user_id, session_ids or None, older_than_days) if value is not None]
+        if len(criteria) != 1:
+            raise ValueError("Indica exactamente un criterio: user_id, session_ids u older_than_days")
+        if older_than_days is not None and older_than_days < 1:
+            raise ValueError("older_than_days debe ser al menos 1")
+        
+        job = PurgeJob(user_id, session_ids, older_than_days, archive)
+        job.worker_id = self.worker_id
+        self._jobs[job.job_id] = job
+        self.stats["jobs_submitted"] += 1
+        await self._save(job)
+        await self._queue.put(job)
+        return job
+    
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._jobs.get(job_id)
+        if job:
+            return job.to_dict()
+        data = await self.redis_client.get(self.JOB_KEY.format(job_id))
+        return loads(data) if data else None
+    
+    async def cancel(self, job_id: str) -> bool:
+        """Pedir la cancelacin: se detiene al terminar el lote en curso (slo en el worker que la ejecuta)"""
+        job = self._jobs.get(job_id)
+        if not job or job.status not in ("queued", "running"):
+            return False
+        job.cancel_requested = True
+        return True
+    
+    async def _save(self, job: PurgeJob):
+        try:
+            await self.redis_client.set(
+                self.JOB_KEY.format(job.job_id),
+                dumps(job.to_dict()),
+                ex=settings.purge_job_ttl_hours * 3600
+            )
+        except Exception as e:
+            print(f"Error guardando el estado de la purga {job.job_id}: {e}")
+    
+    async def _run_jobs(self):
+        while True:
+            job = await self._queue.get()
+            job.started_at = datetime.now()
+            job.status = "running"
+            await self._save(job)
+            try:
+                await self._purge(job)
+                job.status = "completed"
+                self.stats["jobs_completed"] += 1
+                print(f" Purga {job.job_id} ({job.mode}) completada: {job.counts}")
+            except asyncio.CancelledError:
+                job.status = "cancelled"
+                await self._save(job)
+                raise
+            except PurgeCancelled:
+                job.status = "cancelled"
+                self.stats["jobs_cancelled"] += 1
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e)
+                self.stats["jobs_failed"] += 1
+                print(f"Error en la purga {job.job_id}: {e}")
+            job.finished_at = datetime.now()
+            await self._save(job)
+            self._forget_finished()
+    
+    def _forget_finished(self):
+        # El estado de los jobs terminados sigue en Redis hasta PURGE_JOB_TTL_HOURS
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished_at]
+        for job_id in finished[:-100]:
+            del self._jobs[job_id]
+    
+    async def _between_batches(self, job: PurgeJob, deleted: int, started: float):
+        """Entre lotes: guardar el progreso, atender la cancelacin y limitar el ritmo"""
+        await self._save(job)
+        if job.cancel_requested:
+            raise PurgeCancelled()
+        rate = settings.purge_rate_limit_per_second
+        if rate > 0 and deleted:
+            delay = deleted / rate - (time.perf_counter() - started)
+            if delay > 0:
+                self.stats["throttled_seconds"] += delay
+                await asyncio.sleep(delay)
+    
+    async def _purge(self, job: PurgeJob):
+        if job.cancel_requested:
+            raise PurgeCancelled()
+        cutoff = datetime.now() - timedelta(days=job.older_than_days) if job.older_than_days else None
+        sessions = await self._resolve_sessions(job, cutoff)
+        job.counts["sessions"] = len(sessions)
+        
+        ordered = sorted(sessions)
+        await self._purge_redis_batches(job, ordered)
+        
+        job.counts["checkpoints"] = await self._purge_checkpoints(job, sessions)
+        
+        if job.mode == "user":
+            await self._purge_history(job, ConversationHistory.user_id == job.user_id)
+            job.counts["embedding_rows"] = await self._delete_batches(
+                job, ConversationEmbedding, ConversationEmbedding.user_id == job.user_id
+            )
+            # session_memory de sesiones creadas sin usuario y turnos guardados sin user_id:
+            # slo se identifican por las sesiones resueltas
+            await self._purge_by_sessions(job, ordered)
+        else:
+            if job.mode == "sessions":
+                history = ConversationHistory.session_id.in_(job.session_ids)
+                embeddings = ConversationEmbedding.session_id.in_(job.session_ids)
+                memory = SessionMemory.session_id.in_(job.session_ids)
+            else:
+                history = ConversationHistory.timestamp < cutoff
+                embeddings = ConversationEmbedding.timestamp < cutoff
+                memory = SessionMemory.updated_at < cutoff
+            await self._purge_history(job, history)
+            job.counts["embedding_rows"] = await self._delete_batches(job, ConversationEmbedding, embeddings)
+            job.counts["session_rows"] = await self._delete_batches(job, SessionMemory, memory)
+        
+        # Segunda pasada: session_store.get pudo recargar una sesin desde session_memory antes de su DELETE
+        await self._purge_redis_batches(job, ordered)
+    
+    async def _purge_by_sessions(self, job: PurgeJob, ordered: List[str]):
+        """Historial y session_memory de las sesiones indicadas, por lotes de sesiones"""
+        batch_size = settings.purge_batch_size
+        for offset in range(0, len(ordered), batch_size):
+            batch = ordered[offset:offset + batch_size]
+            await self._purge_history(job, ConversationHistory.session_id.in_(batch))
+            job.counts["session_rows"] += await self._delete_batches(
+                job, SessionMemory, SessionMemory.session_id.in_(batch)
+            )
+    
+    async def _purge_redis_batches(self, job: PurgeJob, ordered: List[str]):
+        batch_size = settings.purge_batch_size
+        for offset in range(0, len(ordered), batch_size):
+            started = time.perf_counter()
+            batch = ordered[offset:offset + batch_size]
+            deleted = await self._purge_redis(batch)
+            job.counts["redis_keys"] += deleted
+            if self.session_cache:
+                for session_id in batch:
+                    await self.session_cache.invalidate(session_id)
+            await self._between_batches(job, deleted, started)
+    
+    async def _resolve_sessions(self, job: PurgeJob, cutoff: Optional[datetime]) -> Set[str]:
+        """Sesiones afectadas, para borrar sus claves de Redis e invalidar las caches"""
+        if job.mode == "sessions":
+            return set(job.session_ids)
+        
+        if job.mode == "user":
+            query = union(
+                select(SessionMemory.session_id).where(SessionMemory.user_id == job.user_id),
+                select(ConversationHistory.session_id).where(ConversationHistory.user_id == job.user_id)
+            )
+        else:
+            query = select(SessionMemory.session_id).where(SessionMemory.updated_at < cutoff)
+        
+        sessions = set()
+        async with self.db_session() as session:
+            stream = await session.stream(query.execution_options(yield_per=settings.purge_batch_size))
+            async for batch in stream.partitions():
+                sessions.update(row[0] for row in batch)
+        
+        if job.mode == "user":
+            # Sesiones con cambios an sin volcar a session_memory
+            cursor = 0
+            while True:
+                cursor, pending = await self.redis_client.hscan(
+                    TieredSessionStore.PENDING_KEY, cursor, count=settings.purge_scan_count
+                )
+                for session_id, data in pending.items():
+                    if decode_value(data).get("user_id") == job.user_id:
+                        sessions.add(session_id.decode() if isinstance(session_id, bytes) else session_id)
+                if cursor == 0:
+                    break
+        return sessions
+    
+    async def _purge_redis(self, session_ids: List[str]) -> int:
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            for session_id in session_ids:
+                # La marca impide que un volcado en curso vuelva a escribir la sesin en session_memory
+                pipe.setex(TieredSessionStore.tombstone_key(session_id), TieredSessionStore.TOMBSTONE_SECONDS, "1")
+                pipe.unlink(*session_keys(session_id))
+            pipe.hdel(TieredSessionStore.PENDING_KEY, *session_ids)
+            results = await pipe.execute()
+        # Resultados de UNLINK: posiciones impares (cada SETEX va antes de su UNLINK), sin el HDEL final
+        return sum(results[1:-1:2])
+    
+    async def _purge_checkpoints(self, job: PurgeJob, sessions: Set[str]) -> int:
+        """SCAN de checkpoint:* (id = "{session_id}:{idempotency_key}") y UNLINK por lotes"""
+        if not sessions:
+            return 0
+        deleted = 0
+        matched = []
+        async for key in self.redis_client.scan_iter(match="checkpoint:*", count=settings.purge_scan_count):
+            key = key.decode() if isinstance(key, bytes) else key
+            if key[len("checkpoint:"):].split(":", 1)[0] in sessions:
+                matched.append(key)
+            if len(matched) >= settings.purge_batch_size:
+                started = time.perf_counter()
+                deleted += await self.redis_client.unlink(*matched)
+                await self._between_batches(job, len(matched), started)
+                matched = []
+        if matched:
+            deleted += await self.redis_client.unlink(*matched)
+        return deleted
+    
+    def _archive_path(self, job: PurgeJob) -> str:
+        archive_dir = os.path.join(settings.history_archive_dir, "purge")
+        os.makedirs(archive_dir, exist_ok=True)
+        return os.path.join(archive_dir, f"{job.job_id}.ndjson.gz")
+    
+    async def _purge_history(self, job: PurgeJob, condition):
+        """Borrar el historial por lotes (leyendo cada lote antes para archivarlo si se pide)"""
+        archive = None
+        if job.archive:
+            archive = gzip.open(self._archive_path(job), "ab", compresslevel=settings.history_archive_compression)
+        try:
+            while True:
+                started = time.perf_counter()
+                async with self.db_session() as session:
+                    rows = (await session.execute(
+                        select(*EXPORT_COLUMNS).where(condition).limit(settings.purge_batch_size)
+                    )).all()
+                    if not rows:
+                        break
+                    if archive:
+                        # Se escribe antes de borrar: un fallo deja filas archivadas de ms, nunca de menos
+                        await asyncio.to_thread(archive.write, encode_rows(rows))
+                        await asyncio.to_thread(archive.flush)
+                        job.counts["archived_rows"] += len(rows)
+                    # El rango de timestamp permite descartar particiones mensuales
+                    result = await session.execute(
+                        delete(ConversationHistory).where(
+                            ConversationHistory.id.in_([row.id for row in rows]),
+                            ConversationHistory.timestamp.between(
+                                min(row.timestamp for row in rows),
+                                max(row.timestamp for row in rows)
+                            )
+                        )
+                    )
+                    await session.commit()
+                job.counts["history_rows"] += result.rowcount
+                await self._between_batches(job, result.rowcount, started)
+        finally:
+            if archive:
+                await asyncio.to_thread(archive.close)
+    
+    async def _delete_batches(self, job: PurgeJob, model, condition) -> int:
+        deleted = 0
+        while True:
+            started = time.perf_counter()
+            async with self.db_session() as session:
+                ids = (await session.execute(
+                    select(model.id).where(condition).limit(settings.purge_batch_size)
+                )).scalars().all()
+                if not ids:
+                    break
+                result = await session.execute(delete(model).where(model.id.in_(ids)))
+                await session.commit()
+            deleted += result.rowcount
+            await self._between_batches(job, result.rowcount, started)
+        return deleted
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "queued": self._queue.qsize(),
+            "running": [job.job_id for job in self._jobs.values() if job.status == "running"]
+        }
+    
+    async def cleanup(self):
+        for task in (self._task, self._heartbeat_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        # Sin clave de vida, el siguiente arranque marca como fallidos los jobs que quedaron en cola
+        try:
+            await self.redis_client.delete(self.WORKER_KEY.format(self.worker_id))
+        except Exception as e:
+            print(f"Error retirando el worker de purgas: {e}")
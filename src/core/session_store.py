@@ -0,0 +1,331 @@
+from typing import Dict, Any, List, Optional
+from datetime import datetime, timedelta
+import asyncio
+import uuid
+
+from sqlalchemy import select, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from src.core.config import settings
+from src.core.serialization import encode_value, decode_value
+from src.models.database import Base, SessionMemory
+
+# Borrar un campo del hash de pendientes slo si no cambi desde que se ley
+_COMPARE_AND_DELETE = """
+local deleted = 0
+for i, field in ipairs(ARGV) do
+    if i % 2 == 1 and redis.call('HGET', KEYS[1], field) == ARGV[i + 1] then
+        deleted = deleted + redis.call('HDEL', KEYS[1], field)
+    end
+end
+return deleted
+"""
+
+# Campos de la memoria que tienen columna propia en session_memory
+_RESERVED_FIELDS = ("session_id", "user_id", "created_at", "preferences")
+
+class TieredSessionStore:
+    """Memoria de sesin en dos niveles: Redis (caliente, con TTL) y PostgreSQL (fro, durable)
+    
+    Cada cambio se escribe en la clave caliente y en el hash `sessions:pending`, que no expira.
+    Un worker vuelca los pendientes a session_memory por lotes; si una clave caliente expira
+    antes del volcado, el evento de expiracin de Redis fuerza su escritura inmediata. Ante un
+    fallo en Redis la sesin se recarga desde PostgreSQL de forma transparente.
+    
+    Los valores se codifican con encode_value (JSON o MessagePack segn REDIS_VALUE_FORMAT);
+    con MessagePack el cliente debe crearse con decode_responses=False.
+    """
+    
+    PENDING_KEY = "sessions:pending"
+    # Vida de la marca de borrado: ms que cualquier volcado en curso
+    TOMBSTONE_SECONDS = 600
+    
+    def __init__(self, redis_client, db_session):
+        self.redis_client = redis_client
+        self.db_session = db_session
+        self._flush_task = None
+        self._expiry_task = None
+        self._flush_requested = asyncio.Event()
+        self._compare_and_delete = None
+        self.stats = {
+            "hot_hits": 0,
+            "pending_hits": 0,
+            "cold_hits": 0,
+            "misses": 0,
+            "writes": 0,
+            "flushed": 0,
+            "flush_batches": 0,
+            "expiry_flushes": 0,
+            "flush_errors": 0
+        }
+    
+    @staticmethod
+    def memory_key(session_id: str) -> str:
+        return f"session:{session_id}:memory"
+    
+    @staticmethod
+    def cache_key(session_id: str) -> str:
+        """ltimos turnos cacheados por MemoryManager (misma sesin, misma vida en Redis)"""
+        return f"session:{session_id}:cache"
+    
+    @staticmethod
+    def tombstone_key(session_id: str) -> str:
+        """Marca de sesin borrada: impide que un volcado en curso la vuelva a escribir en session_memory"""
+        return f"session:{session_id}:deleted"
+    
+    async def initialize(self):
+        """Crear la tabla fra si no existe y arrancar el volcado y la escucha de expiraciones"""
+        async with self.db_session() as session:
+            connection = await session.connection()
+            await connection.run_sync(
+                lambda sync_conn: Base.metadata.create_all(sync_conn, tables=[SessionMemory.__table__])
+            )
+            await session.commit()
+        
+        self._compare_and_delete = self.redis_client.register_script(_COMPARE_AND_DELETE)
+        self._flush_task = asyncio.create_task(self._flush_periodically())
+        if settings.session_expiry_events:
+            self._expiry_task = asyncio.create_task(self._listen_expirations())
+    
+    async def get(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """Leer la memoria: Redis, pendientes sin volcar y, si no, PostgreSQL (recalentando Redis)"""
+        data = await self.redis_client.get(self.memory_key(session_id))
+        if data:
+            self.stats["hot_hits"] += 1
+            return decode_value(data)
+        
+        # Expir en Redis pero su ltimo cambio an no lleg a PostgreSQL
+        data = await self.redis_client.hget(self.PENDING_KEY, session_id)
+        if data:
+            self.stats["pending_hits"] += 1
+            await self._set_hot(session_id, data)
+            return decode_value(data)
+        
+        async with self.db_session() as session:
+            row = (await session.execute(
+                select(SessionMemory).where(SessionMemory.session_id == session_id)
+            )).scalar_one_or_none()
+        
+        if row is None or (row.expires_at and row.expires_at < datetime.now()):
+            self.stats["misses"] += 1
+            return None
+        
+        self.stats["cold_hits"] += 1
+        memory = self._from_row(row)
+        await self._set_hot(session_id, encode_value(memory))
+        return memory
+    
+    async def put(self, session_id: str, memory: Dict[str, Any]):
+        """Escribir en Redis y marcar la sesin como pendiente de volcado"""
+        data = encode_value(memory)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.setex(self.memory_key(session_id), timedelta(minutes=settings.session_timeout_minutes), data)
+            pipe.hset(self.PENDING_KEY, session_id, data)
+            # Una escritura nueva tras un borrado vuelve a ser vlida
+            pipe.delete(self.tombstone_key(session_id))
+            pipe.hlen(self.PENDING_KEY)
+            *_, pending = await pipe.execute()
+        
+        self.stats["writes"] += 1
+        if pending >= settings.session_writeback_batch_size:
+            self._flush_requested.set()
+    
+    async def delete(self, session_id: str, extra_keys: Optional[List[str]] = None):
+        """Eliminar la sesin de ambos niveles (y extra_keys de Redis en el mismo UNLINK)
+        
+        La marca de borrado se escribe antes del DELETE en PostgreSQL: un volcado que ya haba ledo
+        la sesin de `sessions:pending` la ve al confirmar su upsert y deshace la escritura.
+        """
+        async with self.redis_client.pipeline(transaction=False) as pipe:
+            pipe.setex(self.tombstone_key(session_id), self.TOMBSTONE_SECONDS, "1")
+            pipe.unlink(self.memory_key(session_id), *(extra_keys or []))
+            pipe.hdel(self.PENDING_KEY, session_id)
+            await pipe.execute()
+        async with self.db_session() as session:
+            await session.execute(delete(SessionMemory).where(SessionMemory.session_id == session_id))
+            await session.commit()
+    
+    async def _set_hot(self, session_id: str, data):
+        await self.redis_client.setex(
+            self.memory_key(session_id),
+            timedelta(minutes=settings.session_timeout_minutes),
+            data
+        )
+    
+    @staticmethod
+    def _to_row(session_id: str, memory: Dict[str, Any]) -> Dict[str, Any]:
+        now = datetime.now()
+        created_at = memory.get("created_at")
+        return {
+            "id": uuid.uuid4(),
+            "session_id": session_id,
+            "user_id": memory.get("user_id"),
+            # El resto de campos (context, last_activity, etc.) viaja en la columna context
+            "context": {k: v for k, v in memory.items() if k not in _RESERVED_FIELDS},
+            "preferences": memory.get("preferences") or {},
+            "created_at": datetime.fromisoformat(created_at) if created_at else now,
+            "updated_at": now,
+            "expires_at": now + timedelta(days=settings.session_cold_ttl_days)
+        }
+    
+    @staticmethod
+    def _from_row(row: SessionMemory) -> Dict[str, Any]:
+        memory = dict(row.context or {})
+        memory.update({
+            "session_id": row.session_id,
+            "created_at": row.created_at.isoformat(),
+            "preferences": row.preferences or {}
+        })
+        if row.user_id:
+            memory["user_id"] = row.user_id
+        return memory
+    
+    async def _tombstoned(self, session_ids: List[str]) -> set:
+        if not session_ids:
+            return set()
+        marks = await self.redis_client.mget([self.tombstone_key(session_id) for session_id in session_ids])
+        return {session_id for session_id, mark in zip(session_ids, marks) if mark}
+    
+    async def _write_cold(self, pending: Dict[Any, Any]):
+        """Upsert de un lote de sesiones en session_memory (una sentencia, executemany)"""
+        # Con un cliente binario las claves del hash llegan como bytes
+        decoded = {
+            session_id.decode() if isinstance(session_id, bytes) else session_id: data
+            for session_id, data in pending.items()
+        }
+        deleted = await self._tombstoned(list(decoded))
+        rows = [
+            self._to_row(session_id, decode_value(data))
+            for session_id, data in decoded.items()
+            if session_id not in deleted
+        ]
+        if rows:
+            statement = insert(SessionMemory)
+            statement = statement.on_conflict_do_update(
+                index_elements=[SessionMemory.session_id],
+                set_={
+                    "user_id": statement.excluded.user_id,
+                    "context": statement.excluded.context,
+                    "preferences": statement.excluded.preferences,
+                    "updated_at": statement.excluded.updated_at,
+                    "expires_at": statement.excluded.expires_at
+                }
+            )
+            async with self.db_session() as session:
+                await session.execute(statement, rows)
+                await session.commit()
+        
+            # Un borrado que lleg durante el upsert: su DELETE pudo ejecutarse antes que esta escritura
+            deleted = await self._tombstoned([row["session_id"] for row in rows])
+            if deleted:
+                async with self.db_session() as session:
+                    await session.execute(delete(SessionMemory).where(SessionMemory.session_id.in_(deleted)))
+                    await session.commit()
+        
+        # Slo se retiran los pendientes que no cambiaron mientras se escriba el lote
+        arguments = [item for pair in pending.items() for item in pair]
+        await self._compare_and_delete(keys=[self.PENDING_KEY], args=arguments)
+    
+    async def flush(self) -> int:
+        """Volcar a PostgreSQL todas las sesiones pendientes, en lotes"""
+        flushed = 0
+        cursor = 0
+        while True:
+            cursor, batch = await self.redis_client.hscan(
+                self.PENDING_KEY, cursor, count=settings.session_writeback_batch_size
+            )
+            if batch:
+                await self._write_cold(batch)
+                flushed += len(batch)
+                self.stats["flush_batches"] += 1
+            if cursor == 0:
+                break
+        self.stats["flushed"] += flushed
+        return flushed
+    
+    async def flush_session(self, session_id: str) -> bool:
+        data = await self.redis_client.hget(self.PENDING_KEY, session_id)
+        if not data:
+            return False
+        await self._write_cold({session_id: data})
+        self.stats["flushed"] += 1
+        return True
+    
+    async def _flush_periodically(self):
+        while True:
+            try:
+                await asyncio.wait_for(
+                    self._flush_requested.wait(),
+                    timeout=settings.session_writeback_interval_seconds
+                )
+            except asyncio.TimeoutError:
+                pass
+            self._flush_requested.clear()
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["flush_errors"] += 1
+                print(f"Error volcando memoria de sesin: {e}")
+    
+    async def _listen_expirations(self):
+        """Volcar inmediatamente las sesiones cuya clave caliente expira con cambios pendientes"""
+        try:
+            # Se aaden E y x a la configuracin del servidor sin retirar otros eventos que ya use alguien.
+            # Puede estar prohibido en Redis gestionado; entonces debe configurarse en el servidor
+            current = next(iter((await self.redis_client.config_get("notify-keyspace-events")).values()), "")
+            if isinstance(current, bytes):
+                current = current.decode()
+            missing = "".join(
+                flag for flag in "Ex"
+                if flag not in current and not (flag == "x" and "A" in current)
+            )
+            if missing:
+                await self.redis_client.config_set("notify-keyspace-events", current + missing)
+        except Exception as e:
+            print(f" No se pudieron activar los eventos de expiracin de Redis: {e}")
+        
+        pubsub = self.redis_client.pubsub()
+        await pubsub.psubscribe("__keyevent@*__:expired")
+        try:
+            async for message in pubsub.listen():
+                key = message.get("data")
+                if isinstance(key, bytes):
+                    key = key.decode()
+                if message.get("type") != "pmessage" or not isinstance(key, str):
+                    continue
+                if not (key.startswith("session:") and key.endswith(":memory")):
+                    continue
+                try:
+                    if await self.flush_session(key[len("session:"):-len(":memory")]):
+                        self.stats["expiry_flushes"] += 1
+                except Exception as e:
+                    self.stats["flush_errors"] += 1
+                    print(f"Error volcando sesin expirada {key}: {e}")
+        finally:
+            await pubsub.close()
+    
+    async def get_stats(self) -> Dict[str, Any]:
+        reads = self.stats["hot_hits"] + self.stats["pending_hits"] + self.stats["cold_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "pending": await self.redis_client.hlen(self.PENDING_KEY),
+            "hot_hit_rate": round(self.stats["hot_hits"] / reads, 4) if reads else None,
+            "hot_ttl_minutes": settings.session_timeout_minutes,
+            "cold_ttl_days": settings.session_cold_ttl_days
+        }
+    
+    async def cleanup(self):
+        """Detener los workers y volcar lo pendiente antes de cerrar"""
+        for task in (self._expiry_task, self._flush_task):
+            if task:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        try:
+            await self.flush()
+        except Exception as e:
+            print(f"Error en el volcado final de sesiones: {e}")
@@ -0,0 +1,278 @@
+from typing import Dict, Any, Optional
+from datetime import date, datetime
+import asyncio
+import re
+import time
+
+from src.core.config import settings
+from src.core.token_accounting import token_accounting, UsageCallbackHandler
+from src.core.structured_output import native_json_kwargs
+from src.core.request_scheduler import request_scheduler
+from src.core.semantic_memory import LatencyStats
+
+_WORDS = re.compile(r"\w+")
+
+class UsageCapture(UsageCallbackHandler):
+    """Uso de tokens de una nica llamada (para comparar la llamada real con su sombra)
+    
+    Con la misma estimacin que la contabilidad cuando el proveedor no informa del uso (streaming),
+    para que las llamadas en streaming no cuenten como 0 tokens en la comparacin.
+    """
+    
+    def __init__(self):
+        super().__init__(None)
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+    
+    async def on_llm_end(self, response, **kwargs):
+        _, prompt, completion, _ = self._usage(response, kwargs.get("run_id"))
+        self.prompt_tokens = int(prompt or 0)
+        self.completion_tokens = int(completion or 0)
+    
+    async def on_llm_error(self, error, **kwargs):
+        # Stream cortado por el consumidor (salida anticipada): el prompt y lo recibido hasta el
+        # corte. Una llamada fallida no llega a reflejarse, as que su uso no importa
+        usage = self._interrupted(kwargs.get("run_id"))
+        if usage is not None:
+            _, self.prompt_tokens, self.completion_tokens = usage
+
+def word_overlap(a: str, b: str) -> float:
+    """Solapamiento de vocabulario (Jaccard): indicador barato de cunto divergen dos respuestas"""
+    words_a, words_b = set(_WORDS.findall(a.lower())), set(_WORDS.findall(b.lower()))
+    if not words_a and not words_b:
+        return 1.0
+    return len(words_a & words_b) / len(words_a | words_b)
+
+def _delta_pct(primary: float, shadow: float) -> Optional[float]:
+    return round((shadow - primary) / primary * 100, 1) if primary else None
+
+class NodeComparison:
+    """Acumulado por agente y nodo: latencia, tokens y longitud de la llamada real frente a la sombra"""
+    
+    def __init__(self):
+        self.primary_latency = LatencyStats()
+        self.shadow_latency = LatencyStats()
+        self.calls = 0
+        self.primary_truncated = 0
+        self.sums = {
+            "primary_prompt_tokens": 0,
+            "primary_completion_tokens": 0,
+            "shadow_prompt_tokens": 0,
+            "shadow_completion_tokens": 0,
+            "primary_chars": 0,
+            "shadow_chars": 0,
+            "overlap": 0.0
+        }
+    
+    def add(self, primary: Dict[str, Any], shadow: Dict[str, Any]):
+        self.calls += 1
+        self.primary_truncated += primary.get("truncated", False)
+        self.primary_latency.record(primary["latency_ms"])
+        self.shadow_latency.record(shadow["latency_ms"])
+        for side, values in (("primary", primary), ("shadow", shadow)):
+            self.sums[f"{side}_prompt_tokens"] += values["prompt_tokens"]
+            self.sums[f"{side}_completion_tokens"] += values["completion_tokens"]
+            self.sums[f"{side}_chars"] += len(values["content"])
+        self.sums["overlap"] += word_overlap(primary["content"], shadow["content"])
+    
+    def report(self) -> Dict[str, Any]:
+        primary, shadow = self.primary_latency.snapshot(), self.shadow_latency.snapshot()
+        calls = max(self.calls, 1)
+        averages = {name: value / calls for name, value in self.sums.items()}
+        return {
+            "calls": self.calls,
+            # Llamadas reales cortadas en cuanto tuvieron los campos necesarios (la sombra se
+            # completa): en esos nodos la salida y los tokens de completion no son comparables
+            "primary_truncated": self.primary_truncated,
+            "latency": {
+                "primary": primary,
+                "shadow": shadow,
+                "p50_delta_pct": _delta_pct(primary["p50_ms"] or 0, shadow["p50_ms"] or 0),
+                "p95_delta_pct": _delta_pct(primary["p95_ms"] or 0, shadow["p95_ms"] or 0)
+            },
+            "tokens": {
+                "primary_avg": {
+                    "prompt": round(averages["primary_prompt_tokens"], 1),
+                    "completion": round(averages["primary_completion_tokens"], 1)
+                },
+                "shadow_avg": {
+                    "prompt": round(averages["shadow_prompt_tokens"], 1),
+                    "completion": round(averages["shadow_completion_tokens"], 1)
+                },
+                "completion_delta_pct": _delta_pct(
+                    averages["primary_completion_tokens"], averages["shadow_completion_tokens"]
+                )
+            },
+            "output_chars": {
+                "primary_avg": round(averages["primary_chars"], 1),
+                "shadow_avg": round(averages["shadow_chars"], 1),
+                "delta_pct": _delta_pct(averages["primary_chars"], averages["shadow_chars"])
+            },
+            "word_overlap_avg": round(averages["overlap"], 3) if self.calls else None
+        }
+
+class ShadowTraffic:
+    """Trfico sombra: repite una muestra de llamadas reales contra otro proveedor/modelo
+    
+    Con SHADOW_ENABLED, los requests elegidos (SHADOW_SAMPLE_RATE, decidido por request para
+    que se reflejen todos sus nodos) repiten cada llamada al LLM, ya terminada, contra
+    SHADOW_PROVIDER/SHADOW_MODEL en una tarea aparte; la respuesta al usuario nunca la espera
+    ni depende de ella. Las llamadas sombra no cuentan en la contabilidad de tokens del
+    usuario y son lo primero que se descarta: no se lanzan si el scheduler tiene requests en
+    cola, si ya hay SHADOW_MAX_CONCURRENCY en curso o si se agot SHADOW_DAILY_TOKEN_BUDGET.
+    """
+    
+    def __init__(self):
+        self._llm = None
+        self._tasks = set()
+        self._budget_day = date.today()
+        self._budget_used = 0
+        self.nodes: Dict[str, NodeComparison] = {}
+        self.since = datetime.now()
+        self.stats = {
+            "mirrored": 0,
+            "completed": 0,
+            "errors": 0,
+            "timeouts": 0,
+            "dropped_load": 0,
+            "dropped_concurrency": 0,
+            "dropped_budget": 0
+        }
+    
+    @staticmethod
+    def _sampled(request_id: str) -> bool:
+        # Decisin estable por request a partir de su id (hex aleatorio)
+        return int(request_id[:8], 16) / 0xFFFFFFFF < settings.shadow_sample_rate
+    
+    def capture(self) -> Optional[UsageCapture]:
+        """Captura de uso para la llamada real, o None si el request en curso no se refleja"""
+        if not settings.shadow_enabled or settings.shadow_sample_rate <= 0:
+            return None
+        usage = token_accounting.current()
+        if usage is None or usage.downgraded or not self._sampled(usage.request_id):
+            return None
+        return UsageCapture()
+    
+    def _budget_left(self) -> bool:
+        if date.today() != self._budget_day:
+            self._budget_day = date.today()
+            self._budget_used = 0
+        return not settings.shadow_daily_token_budget or self._budget_used < settings.shadow_daily_token_budget
+    
+    def mirror(
+        self,
+        input,
+        capture: UsageCapture,
+        latency_ms: float,
+        content: str,
+        json_mode: bool = False,
+        options: Optional[Dict[str, Any]] = None,
+        truncated: bool = False
+    ):
+        """Lanzar la llamada sombra de una llamada real ya terminada (sin esperarla)
+        
+        `json_mode` y `options` son los de la llamada real; el modo JSON nativo se resuelve
+        para el backend sombra, que puede ser otro proveedor. `truncated` indica que el
+        consumidor cort el stream real antes de terminar (salida anticipada de astream_json).
+        """
+        if request_scheduler.saturated:
+            self.stats["dropped_load"] += 1
+            return
+        if len(self._tasks) >= settings.shadow_max_concurrency:
+            self.stats["dropped_concurrency"] += 1
+            return
+        if not self._budget_left():
+            self.stats["dropped_budget"] += 1
+            return
+        
+        node, agent = token_accounting.attribution()
+        primary = {
+            "latency_ms": latency_ms,
+            "prompt_tokens": capture.prompt_tokens,
+            "completion_tokens": capture.completion_tokens,
+            "content": content if isinstance(content, str) else str(content),
+            "truncated": truncated
+        }
+        self.stats["mirrored"] += 1
+        task = asyncio.create_task(self._run(f"{agent}:{node}", input, primary, json_mode, dict(options or {})))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+    
+    @staticmethod
+    def _resolve(provider: Optional[str], model: Optional[str]):
+        """(proveedor, modelo) con los mismos valores por defecto que LLMFactory.create_llm"""
+        provider = provider or settings.default_llm_provider
+        return provider, model or (settings.ollama_model if provider == "ollama" else settings.default_model)
+    
+    def _get_llm(self):
+        if self._llm is None:
+            # Sin AccountedLLM: las llamadas sombra no cuentan en el presupuesto del usuario
+            from src.core.llm_factory import LLMFactory
+            self._llm = LLMFactory._create_llm(*self._resolve(settings.shadow_provider, settings.shadow_model))
+        return self._llm
+    
+    async def _run(self, key: str, input, primary: Dict[str, Any], json_mode: bool, options: Dict[str, Any]):
+        comparison = self.nodes.setdefault(key, NodeComparison())
+        if json_mode:
+            options.update(native_json_kwargs(":".join(self._resolve(settings.shadow_provider, settings.shadow_model))))
+        capture = UsageCapture()
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(
+                self._get_llm().ainvoke(input, config={"callbacks": [capture]}, **options),
+                timeout=settings.shadow_timeout_seconds
+            )
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            comparison.shadow_latency.timeouts += 1
+            return
+        except Exception as e:
+            self.stats["errors"] += 1
+            comparison.shadow_latency.errors += 1
+            print(f"Error en llamada sombra ({key}): {e}")
+            return
+        
+        self._budget_used += capture.prompt_tokens + capture.completion_tokens
+        content = getattr(response, "content", response)
+        comparison.add(primary, {
+            "latency_ms": (time.perf_counter() - started) * 1000,
+            "prompt_tokens": capture.prompt_tokens,
+            "completion_tokens": capture.completion_tokens,
+            "content": content if isinstance(content, str) else str(content)
+        })
+        self.stats["completed"] += 1
+    
+    def report(self) -> Dict[str, Any]:
+        primary_provider, primary_model = self._resolve(None, None)
+        shadow_provider, shadow_model = self._resolve(settings.shadow_provider, settings.shadow_model)
+        return {
+            "enabled": settings.shadow_enabled,
+            "primary": {"provider": primary_provider, "model": primary_model},
+            "shadow": {"provider": shadow_provider, "model": shadow_model},
+            "sample_rate": settings.shadow_sample_rate,
+            "since": self.since.isoformat(),
+            **self.stats,
+            "in_flight": len(self._tasks),
+            "budget": {
+                "day": self._budget_day.isoformat(),
+                "used_tokens": self._budget_used,
+                "daily_limit": settings.shadow_daily_token_budget
+            },
+            "nodes": {key: comparison.report() for key, comparison in sorted(self.nodes.items())}
+        }
+    
+    def reset(self):
+        """Empezar una comparacin nueva (p.ej. tras cambiar SHADOW_MODEL)"""
+        self._llm = None
+        self.nodes.clear()
+        self.since = datetime.now()
+        self.stats = {name: 0 for name in self.stats}
+    
+    async def cleanup(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+# Instancia global (una por worker)
+shadow_traffic = ShadowTraffic()
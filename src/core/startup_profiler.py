@@ -0,0 +1,66 @@
+from typing import Dict, Any, List, Optional
+from contextlib import contextmanager
+from datetime import datetime
+import importlib
+import time
+
+from src.core.config import settings
+
+class StartupProfiler:
+    """Medicin de tiempos de importacin y arranque frente a un presupuesto"""
+    
+    def __init__(self, budget_seconds: Optional[float] = None):
+        self.budget_seconds = budget_seconds or settings.startup_budget_seconds
+        self.started_at = time.perf_counter()
+        self.imports: Dict[str, float] = {}
+        self.phases: Dict[str, float] = {}
+        self.ready_at: Optional[float] = None
+    
+    @contextmanager
+    def measure(self, phase: str):
+        """Medir la duracin de una fase del arranque"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[phase] = self.phases.get(phase, 0.0) + (time.perf_counter() - start)
+    
+    def import_module(self, module_name: str):
+        """Importar un mdulo registrando su tiempo de importacin"""
+        start = time.perf_counter()
+        module = importlib.import_module(module_name)
+        self.imports[module_name] = time.perf_counter() - start
+        return module
+    
+    def mark_ready(self):
+        """Marcar el momento en que la aplicacin acepta requests"""
+        self.ready_at = time.perf_counter()
+        report = self.report()
+        status = "dentro" if report["within_budget"] else "FUERA"
+        print(
+            f" Arranque en {report['startup_seconds']:.3f}s "
+            f"({status} del presupuesto de {self.budget_seconds:.2f}s)"
+        )
+    
+    def report(self) -> Dict[str, Any]:
+        """Obtener el informe de importacin y arranque"""
+        end = self.ready_at if self.ready_at is not None else time.perf_counter()
+        startup_seconds = end - self.started_at
+        
+        slowest: List[Dict[str, Any]] = [
+            {"module": name, "seconds": round(seconds, 4)}
+            for name, seconds in sorted(self.imports.items(), key=lambda item: item[1], reverse=True)
+        ]
+        
+        return {
+            "ready": self.ready_at is not None,
+            "startup_seconds": round(startup_seconds, 4),
+            "budget_seconds": self.budget_seconds,
+            "within_budget": startup_seconds <= self.budget_seconds,
+            "imports": slowest,
+            "phases": {name: round(seconds, 4) for name, seconds in self.phases.items()},
+            "timestamp": datetime.now().isoformat()
+        }
+
+# Instancia global, creada lo antes posible para cubrir las importaciones
+startup_profiler = StartupProfiler()
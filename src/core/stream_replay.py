@@ -0,0 +1,234 @@
+from typing import Dict, Any, AsyncGenerator, AsyncIterator, Optional, Tuple
+from datetime import datetime
+import asyncio
+
+from src.core.config import settings
+from src.core.connection_pools import create_redis_client
+from src.core.serialization import dumps, dumps_str
+
+# Eventos que cierran un stream
+TERMINAL_EVENTS = ("end", "error")
+
+class ResumableStreamManager:
+    """Streams de chat reanudables: cada evento se aade a un stream de Redis por mensaje
+    
+    La generacin corre en una tarea de fondo independiente de la conexin HTTP. Los lectores
+    (en cualquier rplica) leen con XREAD desde su ltimo id, de modo que un cliente que se
+    reconecta con Last-Event-ID recibe los eventos perdidos y sigue la generacin en curso.
+    Mientras haya lectores se renueva una "lease"; si nadie la renueva durante el periodo de
+    gracia, la generacin se cancela.
+    
+    El stream se recorta a STREAM_REPLAY_MAX_EVENTS. Junto a l se guarda el texto acumulado de
+    los chunks y la secuencia hasta la que llega; un lector que encuentra un hueco recibe un
+    evento `reset` con ese estado completo y sigue desde ah.
+    """
+    
+    def __init__(self):
+        self.redis_client = None
+        # XREAD BLOCK ocupa su conexin mientras espera: los lectores usan un pool propio para no
+        # agotar el pool compartido del resto de operaciones de Redis
+        self.reader_client = None
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            "started": 0,
+            "completed": 0,
+            "cancelled_after_grace": 0,
+            "failed": 0,
+            "resumed": 0,
+            "replayed_events": 0,
+            "resets": 0
+        }
+    
+    def initialize(self, redis_client, reader_client=None):
+        self.redis_client = redis_client
+        self.reader_client = reader_client or create_redis_client(
+            settings.redis_url,
+            name="redis_stream_readers",
+            max_connections=settings.stream_reader_max_connections
+        )
+    
+    @staticmethod
+    def stream_key(message_id: str) -> str:
+        return f"chat:stream:{message_id}"
+    
+    @staticmethod
+    def lease_key(message_id: str) -> str:
+        return f"chat:stream:{message_id}:lease"
+    
+    @staticmethod
+    def content_key(message_id: str) -> str:
+        """Texto acumulado de los chunks (APPEND por evento)"""
+        return f"chat:stream:{message_id}:content"
+    
+    @staticmethod
+    def content_seq_key(message_id: str) -> str:
+        """Secuencia del ltimo evento incluido en content_key"""
+        return f"chat:stream:{message_id}:content_seq"
+    
+    @staticmethod
+    def parse_event_id(last_event_id: Optional[str]) -> int:
+        """Last-Event-ID es el nmero de secuencia del ltimo evento recibido (0 = desde el inicio)"""
+        try:
+            return max(int(last_event_id), 0) if last_event_id else 0
+        except ValueError:
+            return 0
+    
+    async def _append(self, message_id: str, seq: int, event: Dict[str, Any]):
+        key = self.stream_key(message_id)
+        # MULTI: el evento y el estado acumulado avanzan juntos (un reset nunca duplica ni pierde chunks)
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            # Id explcito 0-<seq>: el id SSE y el de Redis coinciden y son secuenciales
+            # El evento se guarda ya serializado: los lectores lo reenvan sin decodificarlo
+            pipe.xadd(
+                key,
+                {"type": event["type"], "data": dumps(event)},
+                id=f"0-{seq}",
+                maxlen=settings.stream_replay_max_events,
+                approximate=True
+            )
+            if event["type"] == "chunk" and event.get("content"):
+                pipe.append(self.content_key(message_id), event["content"])
+            pipe.set(self.content_seq_key(message_id), seq)
+            for state_key in (key, self.content_key(message_id), self.content_seq_key(message_id)):
+                pipe.expire(state_key, settings.stream_replay_ttl_seconds)
+            await pipe.execute()
+    
+    async def _reset_event(self, message_id: str) -> Tuple[int, str]:
+        """Estado completo hasta la ltima secuencia escrita, para un lector que perdi eventos recortados"""
+        async with self.redis_client.pipeline(transaction=True) as pipe:
+            pipe.get(self.content_key(message_id))
+            pipe.get(self.content_seq_key(message_id))
+            content, seq = await pipe.execute()
+        self.stats["resets"] += 1
+        return int(seq or 0), dumps_str({
+            "type": "reset",
+            "message_id": message_id,
+            "content": content or "",
+            "timestamp": datetime.now().isoformat()
+        })
+    
+    async def _renew_lease(self, message_id: str):
+        await self.redis_client.set(self.lease_key(message_id), "1", ex=settings.stream_grace_seconds)
+    
+    def start(self, message_id: str, events: AsyncIterator[Dict[str, Any]]) -> asyncio.Task:
+        """Lanzar la generacin en background; los eventos se publican en el stream del mensaje"""
+        task = asyncio.create_task(self._produce(message_id, events))
+        self._tasks[message_id] = task
+        self.stats["started"] += 1
+        return task
+    
+    async def _produce(self, message_id: str, events: AsyncIterator[Dict[str, Any]]):
+        await self._renew_lease(message_id)
+        generation = asyncio.create_task(self._publish(message_id, events))
+        try:
+            # Vigilar la lease: sin lectores durante el periodo de gracia se cancela la generacin
+            while not generation.done():
+                await asyncio.wait({generation}, timeout=1.0)
+                if not generation.done() and not await self.redis_client.exists(self.lease_key(message_id)):
+                    generation.cancel()
+                    self.stats["cancelled_after_grace"] += 1
+            await generation
+            self.stats["completed"] += 1
+        except asyncio.CancelledError:
+            generation.cancel()
+        except Exception as e:
+            self.stats["failed"] += 1
+            print(f"Error en la generacin del stream {message_id}: {e}")
+        finally:
+            self._tasks.pop(message_id, None)
+    
+    async def _publish(self, message_id: str, events: AsyncIterator[Dict[str, Any]]):
+        seq = 0
+        try:
+            async for event in events:
+                seq += 1
+                await self._append(message_id, seq, event)
+        except asyncio.CancelledError:
+            await self._append(message_id, seq + 1, {
+                "type": "error",
+                "message_id": message_id,
+                "error": "Generacin cancelada",
+                "timestamp": datetime.now().isoformat()
+            })
+            raise
+        except Exception as e:
+            # Sin evento final los lectores esperaran hasta STREAM_IDLE_TIMEOUT_SECONDS
+            await self._append(message_id, seq + 1, {
+                "type": "error",
+                "message_id": message_id,
+                "error": f"Error en la generacin: {e}",
+                "timestamp": datetime.now().isoformat()
+            })
+            raise
+    
+    async def exists(self, message_id: str) -> bool:
+        """Stream conocido: en curso en esta rplica, con eventos en Redis o con lease vigente"""
+        if message_id in self._tasks:
+            return True
+        return bool(await self.redis_client.exists(self.stream_key(message_id), self.lease_key(message_id)))
+    
+    async def subscribe(
+        self,
+        message_id: str,
+        last_event_id: int = 0
+    ) -> AsyncGenerator[Tuple[int, str], None]:
+        """Eventos (secuencia, JSON) con secuencia > last_event_id: primero los almacenados y despus los nuevos"""
+        if last_event_id:
+            self.stats["resumed"] += 1
+        key = self.stream_key(message_id)
+        last_id = f"0-{last_event_id}"
+        idle_since = asyncio.get_running_loop().time()
+        
+        while True:
+            await self._renew_lease(message_id)
+            result = await self.reader_client.xread({key: last_id}, count=100, block=1000)
+            
+            if not result:
+                # Sin eventos: el productor pudo morir sin evento final (p.ej. reinicio del pod)
+                if asyncio.get_running_loop().time() - idle_since > settings.stream_idle_timeout_seconds:
+                    yield int(last_id.split("-")[1]) + 1, dumps_str({
+                        "type": "error",
+                        "message_id": message_id,
+                        "error": "El stream no recibi eventos en el tiempo esperado",
+                        "timestamp": datetime.now().isoformat()
+                    })
+                    return
+                continue
+            
+            idle_since = asyncio.get_running_loop().time()
+            for _, entries in result:
+                for entry_id, fields in entries:
+                    seq = int(entry_id.split("-")[1])
+                    last_seq = int(last_id.split("-")[1])
+                    if seq > last_seq + 1:
+                        # XADD MAXLEN recort eventos que este lector no recibi
+                        reset_seq, reset = await self._reset_event(message_id)
+                        yield reset_seq, reset
+                        last_id = f"0-{reset_seq}"
+                        last_seq = reset_seq
+                    if seq <= last_seq:
+                        # Ya incluido en el reset; el evento final se reenva igualmente para cerrar el stream
+                        if fields["type"] in TERMINAL_EVENTS:
+                            yield seq, fields["data"]
+                            return
+                        continue
+                    last_id = entry_id
+                    if last_event_id:
+                        self.stats["replayed_events"] += 1
+                    yield seq, fields["data"]
+                    if fields["type"] in TERMINAL_EVENTS:
+                        return
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "running": len(self._tasks)}
+    
+    async def cleanup(self):
+        for task in list(self._tasks.values()):
+            task.cancel()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        if self.reader_client is not None:
+            await self.reader_client.close()
+
+# Instancia global (se inicializa con el cliente Redis del MemoryManager)
+stream_replay = ResumableStreamManager()
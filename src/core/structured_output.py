@@ -0,0 +1,240 @@
+from typing import Dict, Any, Optional, Tuple, Sequence
+import json
+import re
+
+from src.core.config import settings
+
+_FENCE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_TRAILING_COMMA = re.compile(r",\s*([}\]])")
+_decoder = json.JSONDecoder()
+
+def native_json_kwargs(backend: str) -> Dict[str, Any]:
+    """Argumentos del modo JSON nativo del proveedor ("proveedor:modelo"), si lo tiene"""
+    if not settings.structured_output_native:
+        return {}
+    provider, _, model = backend.partition(":")
+    if provider == "ollama":
+        return {"format": "json"}
+    if provider == "openai" and any(model.startswith(prefix) for prefix in settings.json_mode_models):
+        return {"response_format": {"type": "json_object"}}
+    # Anthropic y modelos de OpenAI anteriores: sin modo JSON, se extrae del texto
+    return {}
+
+def extract_json(text: str) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """(objeto, reparado): el primer objeto JSON del texto, tolerando bloques ```json, texto
+    alrededor y comas finales. reparado indica que json.loads directo no habra bastado."""
+    stripped = text.strip()
+    try:
+        value = json.loads(stripped)
+        if isinstance(value, dict):
+            return value, False
+    except ValueError:
+        pass
+    
+    candidates = [match.group(1) for match in _FENCE.finditer(text)] + [text]
+    for candidate in candidates:
+        for source in (candidate, _TRAILING_COMMA.sub(r"\1", candidate)):
+            start = source.find("{")
+            while start >= 0:
+                try:
+                    value, _ = _decoder.raw_decode(source, start)
+                    if isinstance(value, dict):
+                        return value, True
+                except ValueError:
+                    pass
+                start = source.find("{", start + 1)
+    return None, True
+
+class IncrementalJSONParser:
+    """Parser de un objeto JSON que llega por trozos (streaming)
+    
+    Cada campo de primer nivel queda disponible en `fields` en cuanto su valor est completo,
+    sin esperar al resto del objeto: la decisin de enrutado puede tomarse con los primeros
+    campos mientras el modelo sigue generando la explicacin. Ignora el texto anterior a la
+    primera llave (p.ej. "```json").
+    """
+    
+    _SCALAR_END = ",}] \t\r\n"
+    
+    def __init__(self):
+        self.buffer = ""
+        self.fields: Dict[str, Any] = {}
+        self.done = False
+        self.failed = False
+        self._pos: Optional[int] = None
+    
+    def feed(self, chunk: str) -> Dict[str, Any]:
+        """Aadir texto; devuelve los campos completados con este trozo"""
+        self.buffer += chunk
+        completed = {}
+        if self._pos is None:
+            start = self.buffer.find("{")
+            if start < 0:
+                return completed
+            self._pos = start + 1
+        
+        while not (self.done or self.failed):
+            i = self._skip(self._pos, " \t\r\n,")
+            if i >= len(self.buffer):
+                break
+            if self.buffer[i] == "}":
+                self.done = True
+                break
+            if self.buffer[i] != '"':
+                self.failed = True
+                break
+            key_end = self._string_end(i)
+            if key_end is None:
+                break
+            colon = self._skip(key_end, " \t\r\n")
+            if colon >= len(self.buffer):
+                break
+            if self.buffer[colon] != ":":
+                self.failed = True
+                break
+            value_start = self._skip(colon + 1, " \t\r\n")
+            value_end = self._value_end(value_start)
+            if value_end is None:
+                break
+            try:
+                key = json.loads(self.buffer[i:key_end])
+                value = json.loads(self.buffer[value_start:value_end])
+            except ValueError:
+                self.failed = True
+                break
+            self.fields[key] = value
+            completed[key] = value
+            self._pos = value_end
+        return completed
+    
+    def has(self, keys: Sequence[str]) -> bool:
+        return all(key in self.fields for key in keys)
+    
+    def _skip(self, i: int, characters: str) -> int:
+        while i < len(self.buffer) and self.buffer[i] in characters:
+            i += 1
+        return i
+    
+    def _string_end(self, i: int) -> Optional[int]:
+        """Fin (exclusivo) de la cadena que empieza en i, o None si an no ha llegado"""
+        j = i + 1
+        while j < len(self.buffer):
+            if self.buffer[j] == "\\":
+                j += 2
+                continue
+            if self.buffer[j] == '"':
+                return j + 1
+            j += 1
+        return None
+    
+    def _value_end(self, i: int) -> Optional[int]:
+        if i >= len(self.buffer):
+            return None
+        first = self.buffer[i]
+        if first == '"':
+            return self._string_end(i)
+        if first in "{[":
+            depth = 0
+            j = i
+            while j < len(self.buffer):
+                character = self.buffer[j]
+                if character == '"':
+                    end = self._string_end(j)
+                    if end is None:
+                        return None
+                    j = end
+                    continue
+                if character in "{[":
+                    depth += 1
+                elif character in "}]":
+                    depth -= 1
+                    if depth == 0:
+                        return j + 1
+                j += 1
+            return None
+        # Nmero, true, false o null: completo slo cuando llega su terminador
+        j = i
+        while j < len(self.buffer) and self.buffer[j] not in self._SCALAR_END:
+            j += 1
+        return j if j < len(self.buffer) else None
+
+class StructuredOutput:
+    """Salida estructurada de los LLM para decisiones de enrutado y de herramientas
+    
+    Pide el modo JSON nativo del proveedor cuando lo tiene (ver native_json_kwargs) y, si no,
+    extrae el objeto del texto de forma tolerante. Una respuesta que no se puede interpretar
+    o sin los campos requeridos cuenta como fallo en las mtricas por tipo de decisin.
+    """
+    
+    def __init__(self):
+        self.stats: Dict[str, Dict[str, int]] = {}
+    
+    def _stats(self, name: str) -> Dict[str, int]:
+        return self.stats.setdefault(name, {
+            "calls": 0,
+            "parsed": 0,
+            "repaired": 0,
+            "early_exit": 0,
+            "failures": 0
+        })
+    
+    def parse(self, name: str, text: str, required: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+        stats = self._stats(name)
+        stats["calls"] += 1
+        value, repaired = extract_json(text)
+        if value is None or any(key not in value for key in required):
+            stats["failures"] += 1
+            print(f"Salida estructurada no vlida ({name}): {text[:200]!r}")
+            return None
+        stats["parsed"] += 1
+        stats["repaired"] += repaired
+        return value
+    
+    async def ainvoke_json(self, llm, prompt, name: str, required: Sequence[str] = ()) -> Optional[Dict[str, Any]]:
+        """Llamar al LLM en modo JSON y devolver el objeto, o None si no se puede interpretar"""
+        response = await llm.ainvoke(prompt, json_mode=True)
+        return self.parse(name, response.content, required)
+    
+    async def astream_json(
+        self,
+        llm,
+        prompt,
+        name: str,
+        required: Sequence[str] = (),
+        ready: Sequence[str] = ()
+    ) -> Optional[Dict[str, Any]]:
+        """Como ainvoke_json, pero en streaming: con STRUCTURED_OUTPUT_EARLY_EXIT la generacin se
+        corta en cuanto llegan los campos de `ready` (el resto, p.ej. la explicacin, no se genera
+        ni se espera)"""
+        parser = IncrementalJSONParser()
+        stream = llm.astream(prompt, json_mode=True)
+        try:
+            async for chunk in stream:
+                parser.feed(chunk.content)
+                if settings.structured_output_early_exit and ready and parser.has(ready):
+                    stats = self._stats(name)
+                    stats["calls"] += 1
+                    stats["parsed"] += 1
+                    stats["early_exit"] += 1
+                    return dict(parser.fields)
+        finally:
+            await stream.aclose()
+        if parser.done and parser.has(required):
+            stats = self._stats(name)
+            stats["calls"] += 1
+            stats["parsed"] += 1
+            return dict(parser.fields)
+        return self.parse(name, parser.buffer, required)
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            name: {
+                **stats,
+                "failure_rate": round(stats["failures"] / stats["calls"], 4) if stats["calls"] else 0.0,
+                "repair_rate": round(stats["repaired"] / stats["calls"], 4) if stats["calls"] else 0.0
+            }
+            for name, stats in self.stats.items()
+        }
+
+# Instancia global
+structured_output = StructuredOutput()
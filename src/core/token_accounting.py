@@ -0,0 +1,545 @@
+from typing import Dict, Any, List, Optional, Tuple
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+import asyncio
+import contextvars
+import json
+import uuid
+
+from langchain_core.callbacks import AsyncCallbackHandler
+from sqlalchemy import select, and_, func, delete
+from sqlalchemy.dialects.postgresql import insert
+
+from src.core.config import settings
+from src.models.database import Base, TokenUsageDaily, TokenUsageFlush
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+class BudgetExceeded(Exception):
+    """La cuota de tokens del usuario est agotada"""
+
+# Dimensiones de cada llamada al LLM: request en curso, nodo del grafo y agente
+_request_usage: contextvars.ContextVar[Optional["RequestUsage"]] = contextvars.ContextVar("request_usage", default=None)
+_usage_node: contextvars.ContextVar[str] = contextvars.ContextVar("usage_node", default="answer")
+_usage_agent: contextvars.ContextVar[str] = contextvars.ContextVar("usage_agent", default="main")
+
+# Columnas de token_usage_daily por las que se puede agrupar
+GROUP_COLUMNS = ("day", "user_id", "session_id", "agent", "node", "model")
+
+# Liberar el lock de volcado slo si sigue siendo el nuestro (pudo expirar y tomarlo otro worker)
+_RELEASE_LOCK = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+# Das que se conservan los ids de lotes aplicados
+_APPLIED_BATCHES_DAYS = 7
+
+def model_cost(model: Optional[str], prompt_tokens: int, completion_tokens: int) -> float:
+    """Coste en USD segn MODEL_PRICES (precio por 1K tokens; gana el prefijo ms largo)"""
+    if not model:
+        return 0.0
+    matches = [prefix for prefix in settings.model_prices if model.startswith(prefix)]
+    if not matches:
+        return 0.0
+    prompt_price, completion_price = settings.model_prices[max(matches, key=len)]
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1000
+
+def extract_usage(response) -> Tuple[Optional[str], Optional[int], Optional[int]]:
+    """(modelo, tokens de entrada, tokens de salida) de un LLMResult, segn el proveedor"""
+    llm_output = response.llm_output or {}
+    usage = llm_output.get("token_usage") or llm_output.get("usage") or {}
+    model = llm_output.get("model_name") or llm_output.get("model")
+    prompt = usage.get("prompt_tokens", usage.get("input_tokens"))
+    completion = usage.get("completion_tokens", usage.get("output_tokens"))
+    
+    if prompt is None and response.generations and response.generations[0]:
+        generation = response.generations[0][0]
+        info = generation.generation_info or {}
+        # Ollama informa los tokens evaluados en generation_info
+        prompt = info.get("prompt_eval_count")
+        completion = info.get("eval_count")
+        model = model or info.get("model")
+        usage_metadata = getattr(getattr(generation, "message", None), "usage_metadata", None)
+        if prompt is None and usage_metadata:
+            prompt = usage_metadata.get("input_tokens")
+            completion = usage_metadata.get("output_tokens")
+    return model, prompt, completion
+
+# Tokens de formato por mensaje de chat que el texto no incluye (rol, separadores)
+_TOKENS_PER_MESSAGE = 4
+# Llamadas en curso que se recuerdan como mximo: una llamada sin on_llm_end ni on_llm_error
+# (p.ej. un callback perdido al cancelar la tarea) no debe retener su prompt indefinidamente
+_MAX_TRACKED_RUNS = 10_000
+
+@lru_cache(maxsize=32)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+def estimate_tokens(text: str, model: Optional[str] = None) -> int:
+    """Tokens de un texto cuando el proveedor no informa del uso: tiktoken o, sin l, ~4 caracteres por token"""
+    if not text:
+        return 0
+    if tiktoken is not None:
+        try:
+            return len(_encoding(model or "").encode(text))
+        except Exception:
+            pass
+    return max(1, len(text) // 4)
+
+class RequestUsage:
+    """Consumo de tokens de un request, desglosado por nodo y por agente"""
+    
+    def __init__(self, session_id: Optional[str], user_id: Optional[str]):
+        self.request_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.user_id = user_id
+        self.downgraded = False
+        self.totals = self._empty()
+        self.by_node: Dict[str, Dict[str, Any]] = {}
+        self.by_agent: Dict[str, Dict[str, Any]] = {}
+    
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost_usd": 0.0}
+    
+    def add(self, node: str, agent: str, prompt_tokens: int, completion_tokens: int, cost: float):
+        for bucket in (self.totals, self.by_node.setdefault(node, self._empty()), self.by_agent.setdefault(agent, self._empty())):
+            bucket["calls"] += 1
+            bucket["prompt_tokens"] += prompt_tokens
+            bucket["completion_tokens"] += completion_tokens
+            bucket["total_tokens"] += prompt_tokens + completion_tokens
+            bucket["cost_usd"] += cost
+    
+    def summary(self) -> Dict[str, Any]:
+        """Resumen para metadata["token_usage"] (total_tokens lo usan los rollups de uso)"""
+        def rounded(bucket):
+            return {**bucket, "cost_usd": round(bucket["cost_usd"], 6)}
+        return {
+            **rounded(self.totals),
+            "downgraded": self.downgraded,
+            "by_node": {name: rounded(bucket) for name, bucket in self.by_node.items()},
+            "by_agent": {name: rounded(bucket) for name, bucket in self.by_agent.items()}
+        }
+
+class UsageCallbackHandler(AsyncCallbackHandler):
+    """Captura el uso de tokens que devuelve el proveedor al terminar cada llamada
+    
+    En streaming, langchain-openai 0.0.2 no recibe usage (no admite stream_options); para esas
+    llamadas se estima con tiktoken a partir del prompt guardado al empezar y del texto generado.
+    Un stream cortado antes de terminar (p.ej. la salida anticipada de structured_output) no llega
+    a on_llm_end sino a on_llm_error: se registra el prompt ms los tokens recibidos hasta el corte.
+    """
+    
+    def __init__(self, accounting: "TokenAccounting"):
+        self.accounting = accounting
+        # Llamadas en curso: run_id -> (modelo, texto del prompt, mensajes)
+        self._prompts: Dict[Any, Tuple[Optional[str], str, int]] = {}
+        # Tokens recibidos en streaming por llamada en curso
+        self._streamed: Dict[Any, List[str]] = {}
+    
+    @staticmethod
+    def _model(kwargs: Dict[str, Any]) -> Optional[str]:
+        params = kwargs.get("invocation_params") or {}
+        return params.get("model_name") or params.get("model")
+    
+    def _track(self, run_id, started: Tuple[Optional[str], str, int]):
+        self._prompts[run_id] = started
+        while len(self._prompts) > _MAX_TRACKED_RUNS:
+            # Los dicts conservan el orden de insercin: se descarta la llamada ms antigua
+            oldest = next(iter(self._prompts))
+            del self._prompts[oldest]
+            self._streamed.pop(oldest, None)
+    
+    async def on_chat_model_start(self, serialized, messages, **kwargs):
+        texts = [m.content for m in (messages[0] if messages else []) if isinstance(m.content, str)]
+        self._track(kwargs.get("run_id"), (self._model(kwargs), "\n".join(texts), len(texts)))
+    
+    async def on_llm_start(self, serialized, prompts, **kwargs):
+        self._track(kwargs.get("run_id"), (self._model(kwargs), "\n".join(prompts), 0))
+    
+    async def on_llm_new_token(self, token: str, **kwargs):
+        run_id = kwargs.get("run_id")
+        if run_id in self._prompts:
+            self._streamed.setdefault(run_id, []).append(token)
+    
+    def _usage(self, response, run_id) -> Tuple[Optional[str], Optional[int], Optional[int], bool]:
+        """(modelo, prompt, completion, estimado): el uso informado o, si falta, el estimado"""
+        started = self._prompts.pop(run_id, None)
+        self._streamed.pop(run_id, None)
+        model, prompt, completion = extract_usage(response)
+        if prompt is None and completion is None and started is not None:
+            model = model or started[0]
+            generated = "".join(g.text for generations in response.generations for g in generations)
+            prompt = estimate_tokens(started[1], model) + _TOKENS_PER_MESSAGE * started[2]
+            return model, prompt, estimate_tokens(generated, model), True
+        return model, prompt, completion, False
+    
+    async def on_llm_end(self, response, **kwargs):
+        model, prompt, completion, estimated = self._usage(response, kwargs.get("run_id"))
+        if estimated:
+            self.accounting.stats["estimated_calls"] += 1
+        await self.accounting.record(model, prompt, completion)
+    
+    def _interrupted(self, run_id) -> Optional[Tuple[Optional[str], int, int]]:
+        """(modelo, prompt, completion) estimados de un stream cortado; None si no lleg a generar nada"""
+        started = self._prompts.pop(run_id, None)
+        tokens = self._streamed.pop(run_id, None)
+        if started is None or not tokens:
+            # Fallo antes de la respuesta: el proveedor no lleg a procesar la llamada
+            return None
+        model = started[0]
+        prompt = estimate_tokens(started[1], model) + _TOKENS_PER_MESSAGE * started[2]
+        return model, prompt, estimate_tokens("".join(tokens), model)
+    
+    async def on_llm_error(self, error, **kwargs):
+        usage = self._interrupted(kwargs.get("run_id"))
+        if usage is not None:
+            self.accounting.stats["interrupted_calls"] += 1
+            await self.accounting.record(*usage)
+
+class TokenAccounting:
+    """Contabilidad de tokens y coste por request, sesin, usuario, agente y nodo
+    
+    Cada llamada al LLM incrementa contadores en Redis (HINCRBY): el hash `usage:pending`,
+    volcado peridicamente a token_usage_daily, y el contador del usuario en el periodo de
+    presupuesto. Con USER_TOKEN_BUDGET, al agotar la cuota las llamadas pasan a
+    TOKEN_BUDGET_FALLBACK_MODEL y, por encima del lmite duro, los requests se rechazan.
+    """
+    
+    PENDING_KEY = "usage:pending"
+    FLUSHING_KEY = "usage:flushing"
+    LOCK_KEY = "usage:flush:lock"
+    # Campo de usage:flushing con el id del lote: se borra junto con los contadores
+    BATCH_FIELD = "__batch__"
+    
+    def __init__(self):
+        self.redis_client = None
+        self.db_session = None
+        self.callback = UsageCallbackHandler(self)
+        self._task = None
+        self._release_lock = None
+        self.stats = {
+            "calls": 0,
+            "calls_without_usage": 0,
+            "estimated_calls": 0,
+            "interrupted_calls": 0,
+            "flushed_rows": 0,
+            "flush_errors": 0,
+            "duplicate_batches": 0,
+            "downgrades": 0,
+            "rejections": 0
+        }
+    
+    async def initialize(self, redis_client, db_session):
+        """Crear token_usage_daily y arrancar el volcado peridico"""
+        self.redis_client = redis_client
+        self.db_session = db_session
+        async with self.db_session() as session:
+            connection = await session.connection()
+            await connection.run_sync(
+                lambda sync_conn: Base.metadata.create_all(
+                    sync_conn, tables=[TokenUsageDaily.__table__, TokenUsageFlush.__table__]
+                )
+            )
+            await session.commit()
+        
+        self._release_lock = self.redis_client.register_script(_RELEASE_LOCK)
+        if settings.token_flush_interval_seconds > 0:
+            self._task = asyncio.create_task(self._flush_periodically())
+    
+    # mbitos de atribucin
+    
+    @contextmanager
+    def request(self, session_id: Optional[str], user_id: Optional[str]):
+        usage = RequestUsage(session_id, user_id)
+        token = _request_usage.set(usage)
+        try:
+            yield usage
+        finally:
+            _request_usage.reset(token)
+    
+    @contextmanager
+    def node(self, name: str):
+        token = _usage_node.set(name)
+        try:
+            yield
+        finally:
+            _usage_node.reset(token)
+    
+    @contextmanager
+    def agent(self, name: str):
+        token = _usage_agent.set(name)
+        try:
+            yield
+        finally:
+            _usage_agent.reset(token)
+    
+    @staticmethod
+    def current() -> Optional[RequestUsage]:
+        return _request_usage.get()
+    
+    @staticmethod
+    def attribution() -> Tuple[str, str]:
+        """(nodo, agente) de la llamada en curso"""
+        return _usage_node.get(), _usage_agent.get()
+    
+    # Registro
+    
+    @staticmethod
+    def _budget_key(user_id: str) -> str:
+        bucket = date.today().strftime("%Y-%m-%d" if settings.token_budget_period == "day" else "%Y-%m")
+        return f"usage:user:{user_id}:{bucket}"
+    
+    async def record(self, model: Optional[str], prompt_tokens: Optional[int], completion_tokens: Optional[int]):
+        self.stats["calls"] += 1
+        if prompt_tokens is None and completion_tokens is None:
+            # El proveedor no inform del uso (p.ej. streaming sin usage)
+            self.stats["calls_without_usage"] += 1
+            return
+        prompt_tokens, completion_tokens = int(prompt_tokens or 0), int(completion_tokens or 0)
+        model = model or "unknown"
+        cost = model_cost(model, prompt_tokens, completion_tokens)
+        node, agent = _usage_node.get(), _usage_agent.get()
+        
+        usage = self.current()
+        if usage is not None:
+            usage.add(node, agent, prompt_tokens, completion_tokens, cost)
+        if self.redis_client is None:
+            return
+        
+        user_id = usage.user_id if usage else None
+        session_id = usage.session_id if usage else None
+        cell = json.dumps([date.today().isoformat(), user_id or "", session_id or "", agent, node, model])
+        try:
+            async with self.redis_client.pipeline(transaction=False) as pipe:
+                pipe.hincrby(self.PENDING_KEY, f"{cell}|calls", 1)
+                pipe.hincrby(self.PENDING_KEY, f"{cell}|prompt_tokens", prompt_tokens)
+                pipe.hincrby(self.PENDING_KEY, f"{cell}|completion_tokens", completion_tokens)
+                pipe.hincrbyfloat(self.PENDING_KEY, f"{cell}|cost_usd", cost)
+                if user_id:
+                    budget_key = self._budget_key(user_id)
+                    pipe.hincrby(budget_key, "total_tokens", prompt_tokens + completion_tokens)
+                    pipe.hincrbyfloat(budget_key, "cost_usd", cost)
+                    pipe.expire(budget_key, 62 * 86400)
+                await pipe.execute()
+        except Exception as e:
+            print(f"Error registrando uso de tokens: {e}")
+    
+    # Presupuestos
+    
+    async def get_user_usage(self, user_id: str) -> Dict[str, Any]:
+        """Consumo del usuario en el periodo de presupuesto actual"""
+        data = await self.redis_client.hgetall(self._budget_key(user_id)) if self.redis_client else {}
+        used = int(data.get("total_tokens", 0))
+        budget = settings.user_token_budget
+        return {
+            "user_id": user_id,
+            "period": settings.token_budget_period,
+            "total_tokens": used,
+            "cost_usd": round(float(data.get("cost_usd", 0.0)), 6),
+            "budget_tokens": budget or None,
+            "remaining_tokens": max(budget - used, 0) if budget else None,
+            "status": self._budget_status(used)
+        }
+    
+    @staticmethod
+    def _budget_status(used: int) -> str:
+        budget = settings.user_token_budget
+        if not budget or used < budget:
+            return "ok"
+        if settings.token_budget_fallback_model and used < budget * settings.token_budget_hard_limit_ratio:
+            return "downgrade"
+        return "reject"
+    
+    async def check_budget(self, user_id: Optional[str]) -> str:
+        """"ok", "downgrade" (usar el modelo barato) o "reject" (cuota agotada)"""
+        if not settings.user_token_budget or not user_id or self.redis_client is None:
+            return "ok"
+        try:
+            used = int(await self.redis_client.hget(self._budget_key(user_id), "total_tokens") or 0)
+        except Exception as e:
+            # Sin Redis no se bloquea al usuario: el presupuesto es best-effort
+            print(f"Error consultando presupuesto de tokens: {e}")
+            return "ok"
+        status = self._budget_status(used)
+        if status == "reject":
+            self.stats["rejections"] += 1
+        return status
+    
+    async def enforce_budget(self, usage: RequestUsage):
+        """Aplicar el presupuesto al request: marcarlo como degradado o rechazarlo"""
+        status = await self.check_budget(usage.user_id)
+        if status == "reject":
+            raise BudgetExceeded(f"Cuota de tokens agotada para el usuario {usage.user_id}")
+        if status == "downgrade":
+            self.stats["downgrades"] += 1
+            usage.downgraded = True
+    
+    # Volcado a PostgreSQL
+    
+    async def flush(self) -> int:
+        """Volcar los contadores pendientes a token_usage_daily (un nico worker a la vez)
+        
+        Cada lote lleva un id que se inserta en token_usage_flushes en la misma transaccin que
+        las sumas: si el commit lleg a PostgreSQL pero fall el borrado de usage:flushing, el
+        reintento encuentra el id ya aplicado y slo descarta el lote.
+        """
+        token = uuid.uuid4().hex
+        if not await self.redis_client.set(self.LOCK_KEY, token, nx=True, ex=60):
+            return 0
+        try:
+            # Un volcado anterior interrumpido deja usage:flushing: se reintenta antes de rotar
+            if not await self.redis_client.exists(self.FLUSHING_KEY):
+                if not await self.redis_client.exists(self.PENDING_KEY):
+                    return 0
+                await self.redis_client.rename(self.PENDING_KEY, self.FLUSHING_KEY)
+            # HSETNX: un lote reintentado conserva el id que recibi la primera vez
+            await self.redis_client.hsetnx(self.FLUSHING_KEY, self.BATCH_FIELD, uuid.uuid4().hex)
+            
+            batch_id = None
+            cells: Dict[str, Dict[str, Any]] = {}
+            for field, value in (await self.redis_client.hgetall(self.FLUSHING_KEY)).items():
+                if field == self.BATCH_FIELD:
+                    batch_id = value
+                    continue
+                cell, metric = field.rsplit("|", 1)
+                cells.setdefault(cell, {})[metric] = float(value) if metric == "cost_usd" else int(value)
+            
+            rows = []
+            for cell, metrics in cells.items():
+                day, user_id, session_id, agent, node, model = json.loads(cell)
+                rows.append({
+                    "day": date.fromisoformat(day),
+                    "user_id": user_id,
+                    "session_id": session_id,
+                    "agent": agent,
+                    "node": node,
+                    "model": model,
+                    "calls": metrics.get("calls", 0),
+                    "prompt_tokens": metrics.get("prompt_tokens", 0),
+                    "completion_tokens": metrics.get("completion_tokens", 0),
+                    "cost_usd": metrics.get("cost_usd", 0.0),
+                    "updated_at": datetime.now()
+                })
+            
+            applied = True
+            if rows:
+                statement = insert(TokenUsageDaily)
+                statement = statement.on_conflict_do_update(
+                    index_elements=[getattr(TokenUsageDaily, column) for column in GROUP_COLUMNS],
+                    set_={
+                        "calls": TokenUsageDaily.calls + statement.excluded.calls,
+                        "prompt_tokens": TokenUsageDaily.prompt_tokens + statement.excluded.prompt_tokens,
+                        "completion_tokens": TokenUsageDaily.completion_tokens + statement.excluded.completion_tokens,
+                        "cost_usd": TokenUsageDaily.cost_usd + statement.excluded.cost_usd,
+                        "updated_at": statement.excluded.updated_at
+                    }
+                )
+                async with self.db_session() as session:
+                    applied = (await session.execute(
+                        insert(TokenUsageFlush)
+                        .values(batch_id=batch_id, applied_at=datetime.now())
+                        .on_conflict_do_nothing()
+                        .returning(TokenUsageFlush.batch_id)
+                    )).scalar() is not None
+                    if applied:
+                        await session.execute(statement, rows)
+                        await session.execute(delete(TokenUsageFlush).where(
+                            TokenUsageFlush.applied_at < datetime.now() - timedelta(days=_APPLIED_BATCHES_DAYS)
+                        ))
+                        await session.commit()
+            
+            await self.redis_client.delete(self.FLUSHING_KEY)
+            if not applied:
+                self.stats["duplicate_batches"] += 1
+                return 0
+            self.stats["flushed_rows"] += len(rows)
+            return len(rows)
+        finally:
+            await self._release_lock(keys=[self.LOCK_KEY], args=[token])
+    
+    async def _flush_periodically(self):
+        while True:
+            await asyncio.sleep(settings.token_flush_interval_seconds)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["flush_errors"] += 1
+                print(f"Error volcando uso de tokens: {e}")
+    
+    async def query_usage(
+        self,
+        start: date,
+        end: date,
+        group_by: str = "user_id",
+        user_id: Optional[str] = None,
+        session_id: Optional[str] = None,
+        agent: Optional[str] = None
+    ) -> List[Dict[str, Any]]:
+        """Consumo agregado desde token_usage_daily (hasta el ltimo volcado)"""
+        if group_by not in GROUP_COLUMNS:
+            raise ValueError(f"Agrupacin no soportada: {group_by}")
+        column = getattr(TokenUsageDaily, group_by)
+        query = (
+            select(
+                column,
+                func.sum(TokenUsageDaily.calls),
+                func.sum(TokenUsageDaily.prompt_tokens),
+                func.sum(TokenUsageDaily.completion_tokens),
+                func.sum(TokenUsageDaily.cost_usd)
+            )
+            .where(and_(TokenUsageDaily.day >= start, TokenUsageDaily.day <= end))
+            .group_by(column)
+            .order_by(column)
+        )
+        if user_id:
+            query = query.where(TokenUsageDaily.user_id == user_id)
+        if session_id:
+            query = query.where(TokenUsageDaily.session_id == session_id)
+        if agent:
+            query = query.where(TokenUsageDaily.agent == agent)
+        
+        async with self.db_session() as session:
+            result = await session.execute(query)
+            return [
+                {
+                    group_by: key.isoformat() if isinstance(key, date) else key,
+                    "calls": int(calls),
+                    "prompt_tokens": int(prompt),
+                    "completion_tokens": int(completion),
+                    "total_tokens": int(prompt + completion),
+                    "cost_usd": round(float(cost), 6)
+                }
+                for key, calls, prompt, completion, cost in result
+            ]
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "budget_tokens": settings.user_token_budget or None, "budget_period": settings.token_budget_period}
+    
+    async def cleanup(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self.redis_client is not None and self.db_session is not None:
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error en el volcado final de uso de tokens: {e}")
+
+# Instancia global (se inicializa desde MemoryManager)
+token_accounting = TokenAccounting()
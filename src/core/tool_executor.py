@@ -0,0 +1,251 @@
+from typing import Dict, Any, Optional, Iterable
+from datetime import datetime
+import asyncio
+import hashlib
+import json
+import time
+
+from src.core.config import settings
+from src.core.connection_pools import create_redis_client
+from src.core.semantic_memory import LatencyStats
+
+# Event loop de la aplicacin: el de los pools de DB y Redis que usan las herramientas async
+_app_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def run_sync(coroutine):
+    """Ejecutar la versin async de una herramienta desde BaseTool._run
+    
+    Desde otro hilo (p.ej. un agente sncrono ejecutado en un executor) la corrutina se enva
+    al event loop de la aplicacin, donde viven sus conexiones, y se espera el resultado; sin
+    loop de aplicacin (scripts) se ejecuta con asyncio.run.
+    """
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if _app_loop is not None and _app_loop.is_running() and running is not _app_loop:
+        return asyncio.run_coroutine_threadsafe(coroutine, _app_loop).result()
+    if running is None:
+        return asyncio.run(coroutine)
+    # Bloquear el propio event loop esperando a la corrutina lo dejara colgado
+    coroutine.close()
+    raise RuntimeError("Dentro del event loop las herramientas se invocan con ainvoke/arun")
+
+def normalize_args(params: Dict[str, Any]) -> str:
+    """Forma cannica de los argumentos: claves ordenadas, sin valores None, compacta"""
+    def clean(value):
+        if isinstance(value, dict):
+            return {k: clean(v) for k, v in value.items() if v is not None}
+        if isinstance(value, (list, tuple)):
+            return [clean(v) for v in value]
+        if isinstance(value, str):
+            return value.strip()
+        return value
+    return json.dumps(clean(params), sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+
+class ToolStats:
+    """Contadores y latencia de una herramienta"""
+    
+    def __init__(self):
+        self.calls = 0
+        self.executions = 0
+        self.cache_hits = 0
+        self.idempotent_replays = 0
+        self.latency = LatencyStats()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "cache_hits": self.cache_hits,
+            "idempotent_replays": self.idempotent_replays,
+            "latency": self.latency.snapshot()
+        }
+
+class ToolExecutor:
+    """Capa de ejecucin de herramientas (cualquier BaseTool) de un agente
+    
+    - Herramientas de slo lectura: el resultado se cachea en Redis por (herramienta,
+      argumentos normalizados) durante TOOL_CACHE_TTL_SECONDS.
+    - Herramientas que modifican datos: si el cliente envi Idempotency-Key, cada ejecucin se
+      registra bajo esa clave y una repeticin devuelve el resultado original sin volver a
+      ejecutar. Sin clave se ejecutan siempre: repetir la misma modificacin puede ser legtimo.
+      Un resultado que la herramienta marca como fallido (`is_failure`) no se registra, para que
+      el reintento vuelva a ejecutarla.
+    - El resto se ejecuta tal cual. En todos los casos se mide la latencia por llamada.
+    
+    Si Redis no est disponible, las herramientas se ejecutan sin cache ni idempotencia.
+    """
+    
+    def __init__(
+        self,
+        namespace: str,
+        read_only: Iterable[str] = (),
+        mutating: Iterable[str] = (),
+        redis_client=None
+    ):
+        self.namespace = namespace
+        self.read_only = set(read_only)
+        self.mutating = set(mutating)
+        self.redis_client = redis_client
+        self._owns_client = redis_client is None
+        self.stats: Dict[str, ToolStats] = {}
+        self.store_errors = 0
+    
+    def initialize(self):
+        global _app_loop
+        try:
+            _app_loop = asyncio.get_running_loop()
+        except RuntimeError:
+            pass
+        if self.redis_client is None:
+            self.redis_client = create_redis_client(settings.redis_url, name="tools")
+        tool_executors[self.namespace] = self
+    
+    def _key(self, kind: str, tool_name: str, identity: str) -> str:
+        digest = hashlib.sha1(identity.encode("utf-8")).hexdigest()
+        return f"tool:{kind}:{self.namespace}:{tool_name}:{digest}"
+    
+    async def execute(
+        self,
+        tool,
+        params: Dict[str, Any],
+        idempotency_key: Optional[str] = None
+    ) -> str:
+        """Ejecutar `tool._arun(**params)` aplicando la poltica de la herramienta"""
+        stats = self.stats.setdefault(tool.name, ToolStats())
+        stats.calls += 1
+        
+        if self.redis_client is not None and tool.name in self.read_only:
+            return await self._execute_cached(tool, params, stats)
+        if self.redis_client is not None and tool.name in self.mutating:
+            return await self._execute_idempotent(tool, params, idempotency_key, stats)
+        return await self._run(tool, params, stats)
+    
+    async def _run(self, tool, params: Dict[str, Any], stats: ToolStats) -> str:
+        started = time.perf_counter()
+        try:
+            result = await tool._arun(**params)
+        except Exception:
+            stats.latency.errors += 1
+            raise
+        stats.executions += 1
+        stats.latency.record((time.perf_counter() - started) * 1000)
+        return result
+    
+    async def _execute_cached(self, tool, params: Dict[str, Any], stats: ToolStats) -> str:
+        key = self._key("cache", tool.name, normalize_args(params))
+        try:
+            cached = await self.redis_client.get(key)
+        except Exception as e:
+            self._store_error(e)
+            return await self._run(tool, params, stats)
+        if cached is not None:
+            stats.cache_hits += 1
+            return cached
+        
+        result = await self._run(tool, params, stats)
+        try:
+            await self.redis_client.set(key, result, ex=settings.tool_cache_ttl_seconds)
+        except Exception as e:
+            self._store_error(e)
+        return result
+    
+    async def _execute_idempotent(
+        self,
+        tool,
+        params: Dict[str, Any],
+        idempotency_key: Optional[str],
+        stats: ToolStats
+    ) -> str:
+        if not idempotency_key:
+            return await self._run(tool, params, stats)
+        # El propietario forma parte de la identidad: las claves de distintos usuarios no se comparten
+        key = self._key("idempotency", tool.name, f"{params.get('user_id')}:{idempotency_key}")
+        
+        try:
+            # Reservar la clave; slo quien la reserva ejecuta la herramienta
+            acquired = await self.redis_client.set(
+                key, json.dumps({"state": "pending"}), nx=True, ex=settings.tool_idempotency_lock_seconds
+            )
+        except Exception as e:
+            self._store_error(e)
+            return await self._run(tool, params, stats)
+        
+        if not acquired:
+            record = await self._wait_for_result(key)
+            if record is not None:
+                stats.idempotent_replays += 1
+                return record["result"]
+            return f"La operacin {tool.name} ya est en curso o no termin; reintntalo en unos segundos."
+        
+        try:
+            result = await self._run(tool, params, stats)
+        except BaseException:
+            # Una ejecucin fallida no debe bloquear los reintentos; si Redis falla al liberar
+            # la clave, se propaga el error original (la clave caduca con su TTL)
+            try:
+                await self.redis_client.delete(key)
+            except Exception as e:
+                self._store_error(e)
+            raise
+        
+        is_failure = getattr(tool, "is_failure", None)
+        try:
+            if is_failure is not None and is_failure(result):
+                # La herramienta inform del fallo en su resultado: liberar la clave como si hubiera lanzado
+                await self.redis_client.delete(key)
+                return result
+            await self.redis_client.set(
+                key,
+                json.dumps({"state": "done", "result": result, "executed_at": datetime.now().isoformat()}),
+                ex=settings.tool_idempotency_ttl_seconds
+            )
+        except Exception as e:
+            self._store_error(e)
+        return result
+    
+    async def _wait_for_result(self, key: str) -> Optional[Dict[str, Any]]:
+        """Esperar a que la ejecucin concurrente con la misma clave termine
+        
+        Si Redis falla durante la espera no se ejecuta la herramienta: la otra ejecucin puede
+        seguir en curso, as que se trata como no terminada y el cliente reintenta.
+        """
+        deadline = time.perf_counter() + settings.tool_idempotency_lock_seconds
+        while True:
+            try:
+                data = await self.redis_client.get(key)
+            except Exception as e:
+                self._store_error(e)
+                return None
+            if data is None:
+                return None
+            record = json.loads(data)
+            if record["state"] == "done":
+                return record
+            if time.perf_counter() >= deadline:
+                return None
+            await asyncio.sleep(0.2)
+    
+    def _store_error(self, error: Exception):
+        self.store_errors += 1
+        print(f" Cache de herramientas no disponible ({self.namespace}): {error}")
+    
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "read_only": sorted(self.read_only),
+            "mutating": sorted(self.mutating),
+            "store_errors": self.store_errors,
+            "tools": {name: stats.get_stats() for name, stats in self.stats.items()}
+        }
+    
+    async def cleanup(self):
+        tool_executors.pop(self.namespace, None)
+        if self._owns_client and self.redis_client is not None:
+            await self.redis_client.close()
+
+# Ejecutores de todos los agentes inicializados (expuestos en /metrics/tools)
+tool_executors: Dict[str, ToolExecutor] = {}
+
+def get_tool_stats() -> Dict[str, Any]:
+    return {namespace: executor.get_stats() for namespace, executor in tool_executors.items()}
@@ -0,0 +1,387 @@
+from typing import Dict, Any, List, Optional, Tuple
+from datetime import datetime, timedelta
+import asyncio
+import math
+import struct
+
+import numpy as np
+from sqlalchemy import select, and_, case, func, literal_column, Float
+
+from src.core.config import settings
+from src.models.database import Base, ConversationHistory, UsageRollupHourly, RollupWatermark
+
+class QuantileSketch:
+    """Sketch de cuantiles mergeable con error relativo acotado (buckets logartmicos, tipo DDSketch)"""
+    
+    _header = struct.Struct("<dqqdd")  # precisin, n_bins, ceros, mnimo, mximo
+    
+    def __init__(self, relative_accuracy: Optional[float] = None):
+        self.relative_accuracy = relative_accuracy or settings.rollup_sketch_accuracy
+        self.gamma = (1 + self.relative_accuracy) / (1 - self.relative_accuracy)
+        self.log_gamma = math.log(self.gamma)
+        self.bins: Dict[int, int] = {}
+        self.zero_count = 0
+        self.min = math.inf
+        self.max = -math.inf
+    
+    @property
+    def count(self) -> int:
+        return self.zero_count + sum(self.bins.values())
+    
+    def add_many(self, values) -> "QuantileSketch":
+        """Agregar valores (vectorizado)"""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if values.size == 0:
+            return self
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        
+        positive = values[values > 0]
+        self.zero_count += int(values.size - positive.size)
+        if positive.size:
+            keys, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+            for key, count in zip(keys.tolist(), counts.tolist()):
+                self.bins[key] = self.bins.get(key, 0) + count
+        return self
+    
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("No se pueden combinar sketches con distinta precisin")
+        for key, count in other.bins.items():
+            self.bins[key] = self.bins.get(key, 0) + count
+        self.zero_count += other.zero_count
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+    
+    def quantile(self, q: float) -> Optional[float]:
+        total = self.count
+        if total == 0:
+            return None
+        rank = q * (total - 1)
+        if rank < self.zero_count:
+            return 0.0
+        cumulative = self.zero_count
+        for key in sorted(self.bins):
+            cumulative += self.bins[key]
+            if cumulative > rank:
+                value = 2 * self.gamma ** key / (self.gamma + 1)
+                return float(min(max(value, self.min), self.max))
+        return float(self.max)
+    
+    def to_bytes(self) -> bytes:
+        keys = np.fromiter(self.bins.keys(), dtype=np.int32, count=len(self.bins))
+        counts = np.fromiter(self.bins.values(), dtype=np.int64, count=len(self.bins))
+        header = self._header.pack(self.relative_accuracy, len(self.bins), self.zero_count, self.min, self.max)
+        return header + keys.tobytes() + counts.tobytes()
+    
+    @classmethod
+    def from_bytes(cls, data: Optional[bytes]) -> "QuantileSketch":
+        if not data:
+            return cls()
+        accuracy, n_bins, zero_count, minimum, maximum = cls._header.unpack_from(data)
+        sketch = cls(accuracy)
+        offset = cls._header.size
+        keys = np.frombuffer(data, dtype=np.int32, count=n_bins, offset=offset)
+        counts = np.frombuffer(data, dtype=np.int64, count=n_bins, offset=offset + 4 * n_bins)
+        sketch.bins = dict(zip(keys.tolist(), counts.tolist()))
+        sketch.zero_count = zero_count
+        sketch.min, sketch.max = minimum, maximum
+        return sketch
+    
+    def summary(self) -> Dict[str, Optional[float]]:
+        return {
+            "p50": self.quantile(0.5),
+            "p90": self.quantile(0.9),
+            "p99": self.quantile(0.99),
+            "max": self.max if self.count else None
+        }
+
+class _Accumulator:
+    """Agregado parcial de una celda (hora, agente, usuario)"""
+    
+    def __init__(self, row):
+        self.turn_count = row.turn_count
+        self.tool_calls = int(row.tool_calls or 0)
+        self.latency_sum_ms = float(row.latency_sum_ms or 0.0)
+        self.tokens_sum = int(row.tokens_sum or 0)
+        self.latency = QuantileSketch()
+        self.tokens = QuantileSketch()
+        for sketch, minimum, maximum in (
+            (self.latency, row.latency_min, row.latency_max),
+            (self.tokens, row.tokens_min, row.tokens_max)
+        ):
+            if minimum is not None:
+                sketch.min, sketch.max = float(minimum), float(maximum)
+
+# Expresiones sobre conversation_history (JSONB en PostgreSQL, ver migrations/003)
+_HOUR = func.date_trunc(literal_column("'hour'"), ConversationHistory.timestamp)
+_USER = func.coalesce(ConversationHistory.user_id, literal_column("''"))
+_LATENCY = ConversationHistory.metadata_["latency_ms"].as_float()
+_TOKENS = ConversationHistory.metadata_[("token_usage", "total_tokens")].as_float()
+_TOOLS_USED = ConversationHistory.metadata_["tools_used"]
+_TOOL_CALLS = case(
+    (func.jsonb_typeof(_TOOLS_USED) == "array", func.jsonb_array_length(_TOOLS_USED)),
+    else_=0
+)
+
+class UsageRollupService:
+    """Rollups horarios incrementales de conversation_history a partir de una marca de agua"""
+    
+    WATERMARK_NAME = "usage_rollup_hourly"
+    
+    def __init__(self):
+        self.db_session = None
+        self._task = None
+        self.last_run: Dict[str, Any] = {}
+    
+    @property
+    def is_ready(self) -> bool:
+        return self.db_session is not None
+    
+    async def initialize(self, db_session):
+        """Crear las tablas de rollup y arrancar el worker peridico"""
+        self.db_session = db_session
+        async with self.db_session() as session:
+            connection = await session.connection()
+            await connection.run_sync(
+                lambda sync_conn: Base.metadata.create_all(
+                    sync_conn, tables=[UsageRollupHourly.__table__, RollupWatermark.__table__]
+                )
+            )
+            await session.commit()
+        
+        if settings.rollup_interval_seconds > 0:
+            self._task = asyncio.create_task(self._run_periodically())
+    
+    async def _run_periodically(self):
+        while True:
+            try:
+                await self.run_once()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error actualizando rollups de uso: {e}")
+            await asyncio.sleep(settings.rollup_interval_seconds)
+    
+    async def run_once(self) -> Dict[str, Any]:
+        """Agregar las filas nuevas desde la marca de agua, por ventanas de ROLLUP_WINDOW_HOURS
+        
+        Cada ventana se agrega en PostgreSQL y se confirma en su propia transaccin (rollups y
+        marca de agua juntos): una recuperacin larga, p.ej. la primera ejecucin sobre un
+        historial existente, no mantiene abierta una nica transaccin ni acumula filas en memoria.
+        """
+        started = datetime.now()
+        # Margen para turnos cuyo commit an no es visible
+        upper = started - timedelta(seconds=settings.rollup_lateness_seconds)
+        
+        rows = cells = windows = 0
+        while True:
+            window = await self._run_window(upper)
+            if window is None:
+                break
+            windows += 1
+            rows += window[0]
+            cells += window[1]
+        
+        self.last_run = {
+            "rows": rows,
+            "cells": cells,
+            "windows": windows,
+            "watermark": upper.isoformat(),
+            "duration_ms": round((datetime.now() - started).total_seconds() * 1000, 1)
+        }
+        return self.last_run
+    
+    async def _run_window(self, upper: datetime) -> Optional[Tuple[int, int]]:
+        """Procesar la siguiente ventana tras la marca de agua; None si ya est al da"""
+        async with self.db_session() as session:
+            # FOR UPDATE: un nico worker avanza la marca de agua aunque haya varios pods
+            watermark = (await session.execute(
+                select(RollupWatermark)
+                .where(RollupWatermark.name == self.WATERMARK_NAME)
+                .with_for_update()
+            )).scalar_one_or_none()
+            
+            if watermark is None:
+                # Primera ejecucin: se empieza en el turno ms antiguo, no en 1970
+                oldest = (await session.execute(select(func.min(ConversationHistory.timestamp)))).scalar()
+                start = oldest - timedelta(microseconds=1) if oldest else upper
+                watermark = RollupWatermark(name=self.WATERMARK_NAME, watermark=start)
+                session.add(watermark)
+            
+            lower = watermark.watermark
+            if upper <= lower:
+                await session.commit()
+                return None
+            
+            # Ventanas alineadas a la hora: cada celda se completa normalmente en una sola
+            end = min(
+                lower.replace(minute=0, second=0, microsecond=0) + timedelta(hours=settings.rollup_window_hours),
+                upper
+            )
+            cells = await self._aggregate_window(session, lower, end)
+            if cells:
+                await self._merge_cells(session, cells)
+            
+            watermark.watermark = end
+            await session.commit()
+        
+        return sum(cell.turn_count for cell in cells.values()), len(cells)
+    
+    async def _aggregate_window(
+        self,
+        session,
+        lower: datetime,
+        upper: datetime
+    ) -> Dict[Tuple[datetime, str, str], _Accumulator]:
+        """Agregados por celda de los turnos en (lower, upper], calculados en la base de datos
+        
+        Los sketches se construyen a partir de conteos por bucket logartmico (GROUP BY en SQL):
+        a Python slo llegan celdas y buckets, nunca un valor por turno.
+        """
+        in_window = and_(ConversationHistory.timestamp > lower, ConversationHistory.timestamp <= upper)
+        cell_columns = (_HOUR.label("hour"), ConversationHistory.agent_used, _USER.label("user_id"))
+        group = (_HOUR, ConversationHistory.agent_used, _USER)
+        
+        cells: Dict[Tuple[datetime, str, str], _Accumulator] = {}
+        for row in await session.execute(
+            select(
+                *cell_columns,
+                func.count().label("turn_count"),
+                func.sum(_TOOL_CALLS).label("tool_calls"),
+                func.sum(_LATENCY).label("latency_sum_ms"),
+                func.min(_LATENCY).label("latency_min"),
+                func.max(_LATENCY).label("latency_max"),
+                func.sum(_TOKENS).label("tokens_sum"),
+                func.min(_TOKENS).label("tokens_min"),
+                func.max(_TOKENS).label("tokens_max")
+            )
+            .where(in_window)
+            .group_by(*group)
+        ):
+            cells[(row.hour, row.agent_used, row.user_id)] = _Accumulator(row)
+        
+        if not cells:
+            return cells
+        
+        log_gamma = literal_column(repr(QuantileSketch().log_gamma), Float)
+        for name, value in (("latency", _LATENCY), ("tokens", _TOKENS)):
+            # Mismo bucket que QuantileSketch.add_many; los valores <= 0 van al contador de ceros
+            bucket = case((value > 0, func.ceil(func.ln(value) / log_gamma)))
+            for row in await session.execute(
+                select(*cell_columns, bucket.label("bucket"), func.count().label("count"))
+                .where(in_window, value.isnot(None))
+                .group_by(*group, bucket)
+            ):
+                sketch = getattr(cells[(row.hour, row.agent_used, row.user_id)], name)
+                if row.bucket is None:
+                    sketch.zero_count += row.count
+                else:
+                    sketch.bins[int(row.bucket)] = sketch.bins.get(int(row.bucket), 0) + row.count
+        return cells
+    
+    async def _merge_cells(self, session, cells: Dict[Tuple[datetime, str, str], _Accumulator]):
+        """Fusionar agregados parciales con las filas de rollup existentes"""
+        hours = {hour for hour, _, _ in cells}
+        existing = {
+            (r.hour, r.agent_used, r.user_id): r
+            for r in (await session.execute(
+                select(UsageRollupHourly)
+                .where(UsageRollupHourly.hour.in_(hours))
+                .with_for_update()
+            )).scalars()
+        }
+        
+        for key, cell in cells.items():
+            latency_sketch, token_sketch = cell.latency, cell.tokens
+            rollup = existing.get(key)
+            
+            if rollup is None:
+                session.add(UsageRollupHourly(
+                    hour=key[0],
+                    agent_used=key[1],
+                    user_id=key[2],
+                    turn_count=cell.turn_count,
+                    tool_calls=cell.tool_calls,
+                    latency_sum_ms=cell.latency_sum_ms,
+                    tokens_sum=cell.tokens_sum,
+                    latency_sketch=latency_sketch.to_bytes(),
+                    token_sketch=token_sketch.to_bytes()
+                ))
+            else:
+                rollup.turn_count += cell.turn_count
+                rollup.tool_calls += cell.tool_calls
+                rollup.latency_sum_ms += cell.latency_sum_ms
+                rollup.tokens_sum += cell.tokens_sum
+                rollup.latency_sketch = QuantileSketch.from_bytes(rollup.latency_sketch).merge(latency_sketch).to_bytes()
+                rollup.token_sketch = QuantileSketch.from_bytes(rollup.token_sketch).merge(token_sketch).to_bytes()
+                rollup.updated_at = datetime.now()
+    
+    async def query_usage(
+        self,
+        start: datetime,
+        end: datetime,
+        agent_used: Optional[str] = None,
+        user_id: Optional[str] = None,
+        group_by: str = "hour"
+    ) -> List[Dict[str, Any]]:
+        """Consultar uso agregado desde los rollups (nunca desde la tabla cruda)"""
+        group_columns = {
+            "hour": lambda r: r.hour.isoformat(),
+            "agent": lambda r: r.agent_used,
+            "user": lambda r: r.user_id,
+            "total": lambda r: "total"
+        }
+        if group_by not in group_columns:
+            raise ValueError(f"Agrupacin no soportada: {group_by}")
+        
+        query = select(UsageRollupHourly).where(
+            and_(UsageRollupHourly.hour >= start, UsageRollupHourly.hour < end)
+        )
+        if agent_used:
+            query = query.where(UsageRollupHourly.agent_used == agent_used)
+        if user_id:
+            query = query.where(UsageRollupHourly.user_id == user_id)
+        
+        groups: Dict[str, Dict[str, Any]] = {}
+        async with self.db_session() as session:
+            for rollup in (await session.execute(query)).scalars():
+                key = group_columns[group_by](rollup)
+                group = groups.get(key)
+                if group is None:
+                    group = groups[key] = {
+                        "turns": 0, "tool_calls": 0, "latency_sum_ms": 0.0, "tokens": 0,
+                        "latency": QuantileSketch(), "token_sketch": QuantileSketch()
+                    }
+                group["turns"] += rollup.turn_count
+                group["tool_calls"] += rollup.tool_calls
+                group["latency_sum_ms"] += rollup.latency_sum_ms
+                group["tokens"] += rollup.tokens_sum
+                group["latency"].merge(QuantileSketch.from_bytes(rollup.latency_sketch))
+                group["token_sketch"].merge(QuantileSketch.from_bytes(rollup.token_sketch))
+        
+        return [
+            {
+                group_by: key,
+                "turns": group["turns"],
+                "tool_calls": group["tool_calls"],
+                "tokens": group["tokens"],
+                "latency_avg_ms": round(group["latency_sum_ms"] / group["latency"].count, 1) if group["latency"].count else None,
+                "latency_ms": group["latency"].summary(),
+                "tokens_per_turn": group["token_sketch"].summary()
+            }
+            for key, group in sorted(groups.items())
+        ]
+    
+    async def cleanup(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+# Instancia global (se inicializa desde MemoryManager)
+usage_rollups = UsageRollupService()
@@ -1,22 +1,34 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, JSON
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, Date, DateTime, JSON, LargeBinary, Index, Uuid
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.dialects.postgresql import UUID
+from sqlalchemy.dialects.postgresql import UUID, JSONB
+from pgvector.sqlalchemy import Vector
 from datetime import datetime
 import uuid
 
+from src.core.config import settings
+
 Base = declarative_base()
 
 class ConversationHistory(Base):
     """Modelo para historial de conversaciones"""
     __tablename__ = "conversation_history"
     
+    # Esquema gestionado por migrations/: tabla particionada por mes sobre timestamp,
+    # por lo que la clave primaria incluye la columna de particin
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
-    session_id = Column(String(255), nullable=False, index=True)
+    session_id = Column(String(255), nullable=False)
+    user_id = Column(String(255), nullable=True, index=True)
     user_message = Column(Text, nullable=False)
     agent_response = Column(Text, nullable=False)
     agent_used = Column(String(100), nullable=False)
-    metadata = Column(JSON, default={})
-    timestamp = Column(DateTime, default=datetime.now, nullable=False)
+    # "metadata" est reservado en la API declarativa: el atributo se mapea como metadata_
+    metadata_ = Column("metadata", JSON().with_variant(JSONB, "postgresql"), default={})
+    timestamp = Column(DateTime, primary_key=True, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        # Lecturas "ltimos N turnos de la sesin" sin ordenar
+        Index("ix_conversation_history_session_timestamp", "session_id", timestamp.desc()),
+    )
 
 class SessionMemory(Base):
     """Modelo para memoria de sesiones"""
@@ -29,4 +41,103 @@ class SessionMemory(Base):
     preferences = Column(JSON, default={})
     created_at = Column(DateTime, default=datetime.now, nullable=False)
     updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
-    expires_at = Column(DateTime, nullable=True)
+    expires_at = Column(DateTime, nullable=True)
+
+class Campaign(Base):
+    """Modelo para campaas publicitarias"""
+    __tablename__ = "campaigns"
+    
+    # Uuid genrico: UUID nativo en PostgreSQL, CHAR(32) en SQLite (tests)
+    id = Column(Uuid, primary_key=True, default=uuid.uuid4)
+    user_id = Column(String(255), nullable=True, index=True)
+    name = Column(String(255), nullable=False)
+    objective = Column(String(100), nullable=True)
+    channel = Column(String(100), nullable=True)
+    status = Column(String(50), nullable=False, default="draft")
+    budget = Column(Float, nullable=False, default=0.0)
+    bid = Column(Float, nullable=True)
+    targeting = Column(JSON, default={})
+    start_date = Column(Date, nullable=True)
+    end_date = Column(Date, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+class ConversationEmbedding(Base):
+    """Modelo para embeddings de turnos (memoria semntica a largo plazo)"""
+    __tablename__ = "conversation_embeddings"
+    
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    conversation_id = Column(UUID(as_uuid=True), nullable=False, index=True)
+    session_id = Column(String(255), nullable=False)
+    user_id = Column(String(255), nullable=False, index=True)
+    content = Column(Text, nullable=False)
+    embedding = Column(Vector(settings.embedding_dimensions), nullable=False)
+    timestamp = Column(DateTime, default=datetime.now, nullable=False)
+    
+    __table_args__ = (
+        # ndice ANN por distancia coseno; HNSW por defecto, IVFFlat configurable
+        Index(
+            "ix_conversation_embeddings_embedding",
+            "embedding",
+            postgresql_using=settings.vector_index_type,
+            postgresql_with=(
+                {"lists": settings.vector_index_lists}
+                if settings.vector_index_type == "ivfflat"
+                else {"m": settings.vector_index_m, "ef_construction": settings.vector_index_ef_construction}
+            ),
+            postgresql_ops={"embedding": "vector_cosine_ops"}
+        ),
+    )
+
+class UsageRollupHourly(Base):
+    """Rollup horario de uso por agente y usuario (mantenido incrementalmente)"""
+    __tablename__ = "usage_rollup_hourly"
+    
+    hour = Column(DateTime, primary_key=True)
+    agent_used = Column(String(100), primary_key=True)
+    user_id = Column(String(255), primary_key=True, default="")  # "" = usuario annimo
+    turn_count = Column(BigInteger, default=0, nullable=False)
+    tool_calls = Column(BigInteger, default=0, nullable=False)
+    latency_sum_ms = Column(Float, default=0.0, nullable=False)
+    tokens_sum = Column(BigInteger, default=0, nullable=False)
+    latency_sketch = Column(LargeBinary, nullable=True)  # QuantileSketch serializado
+    token_sketch = Column(LargeBinary, nullable=True)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        Index("ix_usage_rollup_hourly_user_hour", "user_id", "hour"),
+    )
+
+class TokenUsageDaily(Base):
+    """Consumo diario de tokens y coste por usuario, sesin, agente, nodo y modelo"""
+    __tablename__ = "token_usage_daily"
+    
+    day = Column(Date, primary_key=True)
+    user_id = Column(String(255), primary_key=True, default="")  # "" = sin usuario (p.ej. health checks)
+    session_id = Column(String(255), primary_key=True, default="")
+    agent = Column(String(100), primary_key=True)
+    node = Column(String(50), primary_key=True)  # intent, tool_decision, answer
+    model = Column(String(100), primary_key=True)
+    calls = Column(BigInteger, default=0, nullable=False)
+    prompt_tokens = Column(BigInteger, default=0, nullable=False)
+    completion_tokens = Column(BigInteger, default=0, nullable=False)
+    cost_usd = Column(Float, default=0.0, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+    
+    __table_args__ = (
+        Index("ix_token_usage_daily_user_day", "user_id", "day"),
+    )
+
+class TokenUsageFlush(Base):
+    """Lotes de usage:flushing ya sumados a token_usage_daily (el volcado no se aplica dos veces)"""
+    __tablename__ = "token_usage_flushes"
+    
+    batch_id = Column(String(32), primary_key=True)
+    applied_at = Column(DateTime, default=datetime.now, nullable=False)
+
+class RollupWatermark(Base):
+    """Marca de agua de los rollups incrementales"""
+    __tablename__ = "rollup_watermarks"
+    
+    name = Column(String(100), primary_key=True)
+    watermark = Column(DateTime, nullable=False)
@@ -43,6 +43,13 @@ class StreamChatResponse(BaseModel):
     error: Optional[str] = None
     timestamp: str
 
+class PurgeRequest(BaseModel):
+    """Modelo para purgas masivas (exactamente un criterio)"""
+    user_id: Optional[str] = Field(None, description="Todas las sesiones e historial del usuario")
+    session_ids: Optional[List[str]] = Field(None, description="Sesiones concretas")
+    older_than_days: Optional[int] = Field(None, description="Historial y sesiones sin actividad desde hace ms das")
+    archive: bool = Field(False, description="Archivar el historial borrado en NDJSON gzip")
+
 class AgentStatus(BaseModel):
     """Estado de un agente"""
     name: str
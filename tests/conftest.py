@@ -0,0 +1,10 @@
+import pytest
+
+from src.core.circuit_breaker import circuit_breakers
+
+@pytest.fixture(autouse=True)
+def fresh_breakers():
+    """Cada test empieza con los circuitos del proceso vacos"""
+    circuit_breakers.clear()
+    yield
+    circuit_breakers.clear()
@@ -0,0 +1,121 @@
+from fnmatch import fnmatch
+import asyncio
+
+class FakeRedis:
+    """Redis en memoria con los comandos que usan los tests (decode_responses=True, sin TTL)"""
+    
+    def __init__(self):
+        self.values = {}
+        self.hashes = {}
+        self.streams = {}
+        self.expiring = set()
+    
+    def _has(self, key: str) -> bool:
+        return key in self.values or key in self.hashes or key in self.streams
+    
+    async def get(self, key):
+        return self.values.get(key)
+    
+    async def set(self, key, value, ex=None, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = value
+        if ex:
+            self.expiring.add(key)
+        return True
+    
+    async def setex(self, key, seconds, value):
+        return await self.set(key, value, ex=seconds)
+    
+    async def append(self, key, value):
+        self.values[key] = self.values.get(key, "") + value
+        return len(self.values[key])
+    
+    async def exists(self, *keys):
+        return sum(1 for key in keys if self._has(key))
+    
+    async def delete(self, *keys):
+        deleted = 0
+        for key in keys:
+            for store in (self.values, self.hashes, self.streams):
+                if key in store:
+                    del store[key]
+                    deleted += 1
+        return deleted
+    
+    unlink = delete
+    
+    async def expire(self, key, seconds):
+        if not self._has(key):
+            return False
+        self.expiring.add(key)
+        return True
+    
+    async def hset(self, key, field, value):
+        self.hashes.setdefault(key, {})[field] = value
+        return 1
+    
+    async def hget(self, key, field):
+        return self.hashes.get(key, {}).get(field)
+    
+    async def hdel(self, key, *fields):
+        values = self.hashes.get(key, {})
+        return sum(1 for field in fields if values.pop(field, None) is not None)
+    
+    async def hscan(self, key, cursor=0, count=None):
+        return 0, dict(self.hashes.get(key, {}))
+    
+    async def scan_iter(self, match="*", count=None):
+        for key in list(self.values) + list(self.hashes) + list(self.streams):
+            if fnmatch(key, match):
+                yield key
+    
+    async def xadd(self, key, fields, id, maxlen=None, approximate=True):
+        entries = self.streams.setdefault(key, [])
+        entries.append((id, dict(fields)))
+        if maxlen is not None:
+            del entries[:-maxlen]
+        return id
+    
+    async def xread(self, streams, count=None, block=None):
+        result = []
+        for key, last_id in streams.items():
+            last = tuple(int(part) for part in last_id.split("-"))
+            entries = [
+                entry for entry in self.streams.get(key, [])
+                if tuple(int(part) for part in entry[0].split("-")) > last
+            ]
+            if entries:
+                result.append((key, entries[:count]))
+        if not result:
+            await asyncio.sleep(0)
+        return result
+    
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+class FakePipeline:
+    """Encola los comandos y los ejecuta en orden en execute()"""
+    
+    def __init__(self, redis: FakeRedis):
+        self.redis = redis
+        self.commands = []
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+    
+    def __getattr__(self, name):
+        command = getattr(self.redis, name)
+        
+        def queue(*args, **kwargs):
+            self.commands.append((command, args, kwargs))
+            return self
+        return queue
+    
+    async def execute(self):
+        results = [await command(*args, **kwargs) for command, args, kwargs in self.commands]
+        self.commands = []
+        return results
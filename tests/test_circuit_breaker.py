@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from src.core.config import settings
+from src.core.circuit_breaker import CircuitBreaker, CircuitOpenError
+
+@pytest.fixture
+def breaker_settings(monkeypatch):
+    monkeypatch.setattr(settings, "breaker_window_size", 10)
+    monkeypatch.setattr(settings, "breaker_min_calls", 4)
+    monkeypatch.setattr(settings, "breaker_failure_rate", 0.5)
+    monkeypatch.setattr(settings, "breaker_slow_call_ms", 20000)
+    monkeypatch.setattr(settings, "breaker_open_seconds", 30.0)
+    monkeypatch.setattr(settings, "breaker_half_open_calls", 2)
+
+async def succeed(breaker: CircuitBreaker):
+    async with breaker.guard():
+        pass
+
+async def fail(breaker: CircuitBreaker):
+    with pytest.raises(ValueError):
+        async with breaker.guard():
+            raise ValueError("fallo del backend")
+
+@pytest.mark.asyncio
+async def test_successful_calls_are_counted(breaker_settings):
+    breaker = CircuitBreaker("llm:test")
+    
+    for _ in range(5):
+        await succeed(breaker)
+    
+    stats = breaker.get_stats()
+    assert (stats["calls"], stats["failures"], stats["window_calls"]) == (5, 0, 5)
+    assert stats["state"] == "closed"
+
+@pytest.mark.asyncio
+async def test_successes_keep_the_failure_rate_below_the_threshold(breaker_settings):
+    breaker = CircuitBreaker("llm:test")
+    
+    await succeed(breaker)
+    for _ in range(3):
+        await succeed(breaker)
+        await fail(breaker)
+    
+    stats = breaker.get_stats()
+    assert stats["failure_rate"] == pytest.approx(3 / 7, abs=0.001)
+    assert stats["state"] == "closed"
+
+@pytest.mark.asyncio
+async def test_opens_on_failure_rate_and_short_circuits(breaker_settings):
+    breaker = CircuitBreaker("llm:test")
+    
+    for _ in range(4):
+        await fail(breaker)
+    
+    assert breaker.state == "open"
+    with pytest.raises(CircuitOpenError):
+        await succeed(breaker)
+    assert breaker.get_stats()["short_circuited"] == 1
+
+@pytest.mark.asyncio
+async def test_cancelled_call_is_released_without_outcome(breaker_settings):
+    breaker = CircuitBreaker("llm:test")
+    
+    with pytest.raises(asyncio.CancelledError):
+        async with breaker.guard():
+            raise asyncio.CancelledError()
+    
+    stats = breaker.get_stats()
+    assert (stats["calls"], stats["failures"]) == (0, 0)
+
+@pytest.mark.asyncio
+async def test_half_open_probes_close_the_circuit(breaker_settings, monkeypatch):
+    breaker = CircuitBreaker("llm:test")
+    for _ in range(4):
+        await fail(breaker)
+    assert breaker.state == "open"
+    
+    monkeypatch.setattr(settings, "breaker_open_seconds", 0.0)
+    await succeed(breaker)
+    assert breaker.state == "half_open"
+    await succeed(breaker)
+    
+    assert breaker.state == "closed"
+    assert breaker.get_stats()["window_calls"] == 0
@@ -0,0 +1,69 @@
+import pytest
+
+from src.core.config import settings
+from src.core.circuit_breaker import get_breaker
+from src.core.llm_factory import AccountedLLM
+from src.core.structured_output import structured_output
+
+class Chunk:
+    def __init__(self, content: str):
+        self.content = content
+
+class StreamingLLM:
+    """LLM de prueba que emite la decisin de intencin en varios chunks"""
+    
+    CHUNKS = ['{"sub_agent_type": "campaign",', ' "confidence": 0.9,', ' "reasoning": "', "texto largo", '"}']
+    
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.closed = 0
+    
+    async def astream(self, input, config=None, **kwargs):
+        try:
+            for content in self.CHUNKS:
+                if self.fail:
+                    raise ConnectionError("backend cado")
+                yield Chunk(content)
+        finally:
+            self.closed += 1
+
+@pytest.mark.asyncio
+async def test_early_exit_counts_as_breaker_success(monkeypatch):
+    monkeypatch.setattr(settings, "structured_output_early_exit", True)
+    backend = StreamingLLM()
+    llm = AccountedLLM(backend, "test:early-exit")
+    
+    for _ in range(5):
+        decision = await structured_output.astream_json(
+            llm, "prompt", "intent", required=("sub_agent_type",), ready=("sub_agent_type", "confidence")
+        )
+        assert decision == {"sub_agent_type": "campaign", "confidence": 0.9}
+    
+    stats = get_breaker("llm:test:early-exit").get_stats()
+    assert stats["calls"] == 5
+    assert stats["failures"] == 0
+    assert stats["state"] == "closed"
+    # El stream del modelo se cierra en cada corte, no al recogerlo el GC
+    assert backend.closed == 5
+
+@pytest.mark.asyncio
+async def test_complete_stream_counts_as_breaker_success(monkeypatch):
+    monkeypatch.setattr(settings, "structured_output_early_exit", False)
+    llm = AccountedLLM(StreamingLLM(), "test:complete")
+    
+    decision = await structured_output.astream_json(llm, "prompt", "intent", required=("sub_agent_type",))
+    
+    assert decision["reasoning"] == "texto largo"
+    stats = get_breaker("llm:test:complete").get_stats()
+    assert (stats["calls"], stats["failures"]) == (1, 0)
+
+@pytest.mark.asyncio
+async def test_stream_error_counts_as_breaker_failure():
+    llm = AccountedLLM(StreamingLLM(fail=True), "test:failing")
+    
+    with pytest.raises(ConnectionError):
+        async for _ in llm.astream("prompt"):
+            pass
+    
+    stats = get_breaker("llm:test:failing").get_stats()
+    assert (stats["calls"], stats["failures"]) == (1, 1)
@@ -0,0 +1,151 @@
+import asyncio
+
+import pytest
+
+from src.core.config import settings
+from src.core.request_scheduler import RequestScheduler, SchedulerRejected
+
+@pytest.fixture
+def scheduler_settings(monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_queued", 100)
+    monkeypatch.setattr(settings, "scheduler_max_queued_per_user", 100)
+    monkeypatch.setattr(settings, "scheduler_queue_timeout_seconds", 5.0)
+    monkeypatch.setattr(settings, "scheduler_user_weights", {})
+
+async def settle():
+    """Dejar que los requests en espera se encolen o reanuden"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+async def admission_order(scheduler: RequestScheduler, requests):
+    """Encolar (usuario, prioridad) con el nico hueco ocupado y liberarlo uno a uno"""
+    order = []
+    
+    async def request(user, priority):
+        await scheduler.acquire(user, priority)
+        order.append(user)
+    
+    await scheduler.acquire("holder")
+    tasks = []
+    for user, priority in requests:
+        tasks.append(asyncio.create_task(request(user, priority)))
+        await settle()
+    assert scheduler.get_stats()["waiting"] == len(requests)
+    
+    for _ in requests:
+        scheduler.release()
+        await settle()
+    await asyncio.gather(*tasks)
+    return order
+
+@pytest.mark.asyncio
+async def test_heavy_user_does_not_delay_others_more_than_one_turn(scheduler_settings):
+    scheduler = RequestScheduler(max_in_flight=1)
+    
+    order = await admission_order(scheduler, [("heavy", "sync")] * 6 + [("light", "sync")])
+    
+    assert order.index("light") <= 1
+    assert order.count("heavy") == 6
+
+@pytest.mark.asyncio
+async def test_users_alternate_under_contention(scheduler_settings):
+    scheduler = RequestScheduler(max_in_flight=1)
+    
+    order = await admission_order(scheduler, [("a", "sync")] * 3 + [("b", "sync")] * 3)
+    
+    assert order == ["a", "b", "a", "b", "a", "b"]
+
+@pytest.mark.asyncio
+async def test_weights_share_turns(scheduler_settings, monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_user_weights", {"integration": 0.5})
+    scheduler = RequestScheduler(max_in_flight=1)
+    
+    order = await admission_order(scheduler, [("integration", "sync")] * 3 + [("user", "sync")] * 4)
+    
+    # Con peso 0.5, "integration" recibe un turno por cada dos de "user"
+    assert order[:6].count("user") == 4
+
+@pytest.mark.asyncio
+async def test_higher_priority_is_admitted_first(scheduler_settings):
+    scheduler = RequestScheduler(max_in_flight=1)
+    
+    order = await admission_order(scheduler, [("batch_user", "batch"), ("sync_user", "sync"), ("stream_user", "stream")])
+    
+    assert order == ["stream_user", "sync_user", "batch_user"]
+
+@pytest.mark.asyncio
+async def test_saturated_while_full_or_queued(scheduler_settings):
+    scheduler = RequestScheduler(max_in_flight=1)
+    assert not scheduler.saturated
+    
+    await scheduler.acquire("a")
+    assert scheduler.saturated
+    
+    scheduler.release()
+    assert not scheduler.saturated
+
+@pytest.mark.asyncio
+async def test_full_queue_is_rejected_with_503(scheduler_settings, monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_queued", 1)
+    scheduler = RequestScheduler(max_in_flight=1)
+    await scheduler.acquire("holder")
+    waiting = asyncio.create_task(scheduler.acquire("a"))
+    await settle()
+    
+    with pytest.raises(SchedulerRejected) as rejected:
+        await scheduler.acquire("b")
+    
+    assert rejected.value.status_code == 503
+    assert scheduler.get_stats()["rejected_queue_full"] == 1
+    scheduler.release()
+    await waiting
+
+@pytest.mark.asyncio
+async def test_user_queue_limit_is_rejected_with_429(scheduler_settings, monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_max_queued_per_user", 1)
+    scheduler = RequestScheduler(max_in_flight=1)
+    await scheduler.acquire("holder")
+    waiting = asyncio.create_task(scheduler.acquire("a"))
+    await settle()
+    
+    with pytest.raises(SchedulerRejected) as rejected:
+        await scheduler.acquire("a")
+    
+    assert rejected.value.status_code == 429
+    # Otro usuario s puede encolarse
+    other = asyncio.create_task(scheduler.acquire("b"))
+    await settle()
+    assert scheduler.get_stats()["waiting"] == 2
+    scheduler.release()
+    scheduler.release()
+    await asyncio.gather(waiting, other)
+
+@pytest.mark.asyncio
+async def test_queue_timeout_rejects_and_frees_the_ticket(scheduler_settings, monkeypatch):
+    monkeypatch.setattr(settings, "scheduler_queue_timeout_seconds", 0.05)
+    scheduler = RequestScheduler(max_in_flight=1)
+    await scheduler.acquire("holder")
+    
+    with pytest.raises(SchedulerRejected):
+        await scheduler.acquire("a")
+    
+    stats = scheduler.get_stats()
+    assert (stats["timeouts"], stats["waiting"], stats["in_flight"]) == (1, 0, 1)
+    scheduler.release()
+    assert not scheduler.saturated
+
+@pytest.mark.asyncio
+async def test_cancelled_waiter_leaves_the_queue(scheduler_settings):
+    scheduler = RequestScheduler(max_in_flight=1)
+    await scheduler.acquire("holder")
+    waiting = asyncio.create_task(scheduler.acquire("a"))
+    await settle()
+    
+    waiting.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    
+    stats = scheduler.get_stats()
+    assert (stats["cancelled"], stats["waiting"]) == (1, 0)
+    scheduler.release()
+    assert scheduler.get_stats()["in_flight"] == 0
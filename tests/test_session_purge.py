@@ -0,0 +1,145 @@
+import pytest
+from sqlalchemy.dialects import postgresql
+
+from src.core.config import settings
+from src.core.serialization import encode_value
+from src.core.session_purge import SessionPurgeWorker, PurgeJob, session_keys
+from src.core.session_store import TieredSessionStore
+from tests.fakes import FakeRedis
+
+def sql(condition) -> str:
+    return str(condition.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+class FakeResult:
+    def __init__(self, rows):
+        self.rows = rows
+    
+    async def partitions(self):
+        yield self.rows
+
+class FakeDBSession:
+    """Sesin de PostgreSQL de prueba: cualquier consulta devuelve las filas indicadas"""
+    
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+    
+    def __call__(self):
+        return self
+    
+    async def __aenter__(self):
+        return self
+    
+    async def __aexit__(self, *exc_info):
+        return False
+    
+    async def stream(self, query):
+        self.queries.append(query)
+        return FakeResult(self.rows)
+
+class RecordingWorker(SessionPurgeWorker):
+    """Registra las condiciones de borrado en lugar de ejecutarlas"""
+    
+    def __init__(self, sessions, redis_client=None):
+        super().__init__(redis_client or FakeRedis(), FakeDBSession([]), None)
+        self.sessions = set(sessions)
+        self.deleted = []
+    
+    async def _resolve_sessions(self, job, cutoff):
+        return set(self.sessions)
+    
+    async def _purge_redis_batches(self, job, ordered):
+        pass
+    
+    async def _purge_checkpoints(self, job, sessions):
+        return 0
+    
+    async def _purge_history(self, job, condition):
+        self.deleted.append(("conversation_history", sql(condition)))
+    
+    async def _delete_batches(self, job, model, condition):
+        self.deleted.append((model.__tablename__, sql(condition)))
+        return 1
+
+@pytest.fixture
+def small_batches(monkeypatch):
+    monkeypatch.setattr(settings, "purge_batch_size", 2)
+    monkeypatch.setattr(settings, "purge_rate_limit_per_second", 0)
+
+@pytest.mark.asyncio
+async def test_user_purge_deletes_session_rows_by_resolved_sessions(small_batches):
+    worker = RecordingWorker({"s1", "s2", "s3"})
+    job = PurgeJob("user_1", None, None, False)
+    
+    await worker._purge(job)
+    
+    assert worker.deleted == [
+        ("conversation_history", "conversation_history.user_id = 'user_1'"),
+        ("conversation_embeddings", "conversation_embeddings.user_id = 'user_1'"),
+        ("conversation_history", "conversation_history.session_id IN ('s1', 's2')"),
+        ("session_memory", "session_memory.session_id IN ('s1', 's2')"),
+        ("conversation_history", "conversation_history.session_id IN ('s3')"),
+        ("session_memory", "session_memory.session_id IN ('s3')")
+    ]
+    assert job.counts["sessions"] == 3
+    assert job.counts["session_rows"] == 2
+
+@pytest.mark.asyncio
+async def test_sessions_purge_is_limited_to_the_given_sessions(small_batches):
+    worker = RecordingWorker({"s1", "s2"})
+    job = PurgeJob(None, ["s1", "s2"], None, False)
+    
+    await worker._purge(job)
+    
+    assert worker.deleted == [
+        ("conversation_history", "conversation_history.session_id IN ('s1', 's2')"),
+        ("conversation_embeddings", "conversation_embeddings.session_id IN ('s1', 's2')"),
+        ("session_memory", "session_memory.session_id IN ('s1', 's2')")
+    ]
+
+@pytest.mark.asyncio
+async def test_age_purge_uses_the_cutoff(small_batches):
+    worker = RecordingWorker(set())
+    job = PurgeJob(None, None, 30, False)
+    
+    await worker._purge(job)
+    
+    tables = [table for table, _ in worker.deleted]
+    assert tables == ["conversation_history", "conversation_embeddings", "session_memory"]
+    assert "conversation_history.timestamp <" in worker.deleted[0][1]
+    assert "session_memory.updated_at <" in worker.deleted[2][1]
+
+@pytest.mark.asyncio
+async def test_user_purge_resolves_pending_sessions_of_the_user(small_batches):
+    redis = FakeRedis()
+    pending = TieredSessionStore.PENDING_KEY
+    await redis.hset(pending, "s_pending", encode_value({"session_id": "s_pending", "user_id": "user_1"}))
+    await redis.hset(pending, "s_other", encode_value({"session_id": "s_other", "user_id": "user_2"}))
+    await redis.hset(pending, "s_anonymous", encode_value({"session_id": "s_anonymous"}))
+    db = FakeDBSession([("s_history",)])
+    worker = SessionPurgeWorker(redis, db, None)
+    
+    sessions = await worker._resolve_sessions(PurgeJob("user_1", None, None, False), None)
+    
+    assert sessions == {"s_history", "s_pending"}
+    # Sesiones del historial y de session_memory del usuario
+    query = sql(db.queries[0])
+    assert "session_memory.user_id = 'user_1'" in query
+    assert "conversation_history.user_id = 'user_1'" in query
+
+@pytest.mark.asyncio
+async def test_redis_purge_tombstones_and_unlinks_session_keys():
+    redis = FakeRedis()
+    for session_id in ("s1", "s2"):
+        for key in session_keys(session_id):
+            await redis.set(key, "{}")
+        await redis.hset(TieredSessionStore.PENDING_KEY, session_id, "{}")
+    worker = SessionPurgeWorker(redis, FakeDBSession([]), None)
+    
+    deleted = await worker._purge_redis(["s1", "s2"])
+    
+    assert deleted == 4
+    assert await redis.get(TieredSessionStore.tombstone_key("s1")) == "1"
+    assert await redis.get(TieredSessionStore.tombstone_key("s2")) == "1"
+    assert await redis.hget(TieredSessionStore.PENDING_KEY, "s1") is None
+    assert not await redis.exists(*session_keys("s1"), *session_keys("s2"))
@@ -0,0 +1,84 @@
+import asyncio
+import uuid
+
+import pytest
+from langchain_core.messages import HumanMessage
+
+from src.core.config import settings
+from src.core.llm_factory import AccountedLLM
+from src.core.shadow_traffic import shadow_traffic
+from src.core.structured_output import structured_output
+from src.core.token_accounting import token_accounting
+
+DECISION = ['{"sub_agent_type": "campaign",', ' "confidence": 0.9,', ' "reasoning": "', "una explicacin larga", '"}']
+
+class Chunk:
+    def __init__(self, content: str):
+        self.content = content
+
+class CallbackStreamingLLM:
+    """LLM de prueba que emite los callbacks de streaming como langchain (sin usage)"""
+    
+    async def astream(self, input, config=None, **kwargs):
+        callbacks = config["callbacks"]
+        run_id = uuid.uuid4()
+        for callback in callbacks:
+            await callback.on_chat_model_start({}, [input], run_id=run_id, invocation_params={"model_name": "gpt-4"})
+        try:
+            for content in DECISION:
+                for callback in callbacks:
+                    await callback.on_llm_new_token(content, run_id=run_id)
+                yield Chunk(content)
+        except BaseException as e:
+            for callback in callbacks:
+                await callback.on_llm_error(e, run_id=run_id)
+            raise
+
+class ShadowLLM:
+    def __init__(self):
+        self.kwargs = None
+    
+    async def ainvoke(self, input, config=None, **kwargs):
+        self.kwargs = kwargs
+        return Chunk("".join(DECISION))
+
+@pytest.fixture
+def shadow(monkeypatch):
+    monkeypatch.setattr(settings, "shadow_enabled", True)
+    monkeypatch.setattr(settings, "shadow_sample_rate", 1.0)
+    monkeypatch.setattr(settings, "shadow_daily_token_budget", 0)
+    monkeypatch.setattr(settings, "shadow_provider", "ollama")
+    monkeypatch.setattr(settings, "shadow_model", "llama3")
+    monkeypatch.setattr(settings, "structured_output_native", True)
+    monkeypatch.setattr(settings, "structured_output_early_exit", True)
+    shadow_traffic.reset()
+    shadow_llm = shadow_traffic._llm = ShadowLLM()
+    yield shadow_llm
+    shadow_traffic.reset()
+
+@pytest.mark.asyncio
+async def test_early_exit_stream_is_mirrored(shadow):
+    llm = AccountedLLM(CallbackStreamingLLM(), "openai:gpt-4")
+    
+    with token_accounting.request("session_1", "user_1"), token_accounting.node("intent"):
+        decision = await structured_output.astream_json(
+            llm,
+            [HumanMessage(content="Cmo van mis campaas?")],
+            "intent",
+            required=("sub_agent_type",),
+            ready=("sub_agent_type", "confidence")
+        )
+    await asyncio.gather(*list(shadow_traffic._tasks))
+    
+    assert decision == {"sub_agent_type": "campaign", "confidence": 0.9}
+    # Mismas opciones que la llamada real, con el modo JSON del backend sombra
+    assert shadow.kwargs == {"format": "json"}
+    
+    nodes = shadow_traffic.report()["nodes"]
+    [(key, report)] = nodes.items()
+    assert key.endswith(":intent")
+    assert report["calls"] == 1
+    assert report["primary_truncated"] == 1
+    # Uso estimado del stream cortado: el prompt y lo recibido hasta el corte, no 0
+    assert report["tokens"]["primary_avg"]["prompt"] > 0
+    assert report["tokens"]["primary_avg"]["completion"] > 0
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from src.core.config import settings
+from src.core.stream_replay import ResumableStreamManager
+from tests.fakes import FakeRedis
+
+def chat_events(message_id: str, chunks):
+    async def events():
+        yield {"type": "start", "message_id": message_id}
+        for content in chunks:
+            yield {"type": "chunk", "message_id": message_id, "content": content}
+        yield {"type": "end", "message_id": message_id}
+    return events()
+
+@pytest.fixture
+def manager(monkeypatch):
+    monkeypatch.setattr(settings, "stream_replay_max_events", 2000)
+    redis = FakeRedis()
+    manager = ResumableStreamManager()
+    manager.initialize(redis, reader_client=redis)
+    return manager
+
+async def collect(manager: ResumableStreamManager, message_id: str, last_event_id: int = 0):
+    return [(seq, json.loads(data)) async for seq, data in manager.subscribe(message_id, last_event_id)]
+
+async def produce(manager: ResumableStreamManager, message_id: str, chunks):
+    await manager.start(message_id, chat_events(message_id, chunks))
+
+@pytest.mark.asyncio
+async def test_subscribe_from_start_replays_every_event(manager):
+    await produce(manager, "m1", ["Hola", ", ", "mundo"])
+    
+    events = await collect(manager, "m1")
+    
+    assert [seq for seq, _ in events] == [1, 2, 3, 4, 5]
+    assert [event["type"] for _, event in events] == ["start", "chunk", "chunk", "chunk", "end"]
+    assert manager.stats["completed"] == 1
+
+@pytest.mark.asyncio
+async def test_last_event_id_resumes_after_the_last_received_event(manager):
+    await produce(manager, "m1", ["Hola", ", ", "mundo"])
+    
+    events = await collect(manager, "m1", last_event_id=2)
+    
+    assert [seq for seq, _ in events] == [3, 4, 5]
+    assert [event.get("content") for _, event in events] == [", ", "mundo", None]
+    assert manager.stats["resumed"] == 1
+    assert manager.stats["replayed_events"] == 3
+
+@pytest.mark.asyncio
+async def test_trimmed_events_are_replaced_by_a_reset(manager, monkeypatch):
+    monkeypatch.setattr(settings, "stream_replay_max_events", 2)
+    await produce(manager, "m1", ["a", "b", "c", "d"])
+    
+    events = await collect(manager, "m1", last_event_id=1)
+    
+    # Los chunks recortados llegan como un reset con todo el texto; el evento final cierra el stream
+    assert [(seq, event["type"]) for seq, event in events] == [(6, "reset"), (6, "end")]
+    assert events[0][1]["content"] == "abcd"
+    assert manager.stats["resets"] == 1
+
+def test_parse_event_id():
+    assert ResumableStreamManager.parse_event_id("7") == 7
+    assert ResumableStreamManager.parse_event_id(None) == 0
+    assert ResumableStreamManager.parse_event_id("-3") == 0
+    assert ResumableStreamManager.parse_event_id("abc") == 0